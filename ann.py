@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+ANN 索引构建与检索参数（build_index / use / 基准脚本共用）
+spec 即 faiss.index_factory 描述串，例如：
+- "Flat"            暴力内积，召回 100%
+- "HNSW32"          图索引，efSearch 控制精度
+- "IVF1024,Flat"    倒排，nprobe 控制精度，需要训练
+- "IVF1024,PQ32"    倒排 + 乘积量化，内存最小，需要训练
+向量存储可改为标量量化（quantized_spec）：float16 → SQfp16（体积减半），int8 → SQ8（体积 1/4，需要训练）
+serve 侧用 read_index_mmap 只读映射索引文件，多个 worker 共享同一份 page cache
+"""
+import re
+import numpy as np, faiss
+
+# 向量存储类型 → faiss 标量量化编码；float32 保持原 spec
+VECTOR_DTYPES = {"float32": None, "float16": "SQfp16", "int8": "SQ8"}
+
+# faiss k-means 要求每个聚类中心至少 39 个训练点，少于此 IVF 训练直接报错
+MIN_POINTS_PER_CENTROID = 39
+
+def fit_spec(spec: str, n_train: int) -> str:
+    """
+    按可用训练条数调整 spec：IVF 的 nlist 超过 n_train // 39 时下调到该值；
+    PQ 每个子量化器需要 2^nbits 条训练向量，不够时抛 ValueError（小语料请改用 Flat / HNSW / SQ）
+    """
+    requested = spec
+    m = re.search(r"IVF(\d+)", spec)
+    if m:
+        nlist = max(1, min(int(m.group(1)), n_train // MIN_POINTS_PER_CENTROID))
+        spec = spec[:m.start(1)] + str(nlist) + spec[m.end(1):]
+    m = re.search(r"PQ\d+(?:x(\d+))?", spec)
+    if m:
+        need = 2 ** int(m.group(1) or 8)
+        if n_train < need:
+            raise ValueError(f"{requested} 的 PQ 训练至少需要 {need} 条向量，当前只有 {n_train} 条")
+    return spec
+
+def make_index(spec: str, X: np.ndarray, train_size: int = 50000, seed: int = 0):
+    """
+    按 spec 建内积索引；需要训练的类型从 X 中随机采样 train_size 条训练后再 add
+    spec 先经 fit_spec 按训练条数调整，调用方可先调 fit_spec 拿到实际使用的 spec
+    """
+    spec = fit_spec(spec, min(train_size, X.shape[0]))
+    index = faiss.index_factory(X.shape[1], spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        n = min(train_size, X.shape[0])
+        rows = np.sort(np.random.default_rng(seed).choice(X.shape[0], n, replace=False))
+        index.train(np.ascontiguousarray(X[rows], dtype="float32"))
+    index.add(X)
+    return index
+
+def can_update(index) -> bool:
+    """IVF 系列按 id 存向量、支持 remove_ids / add_with_ids，可在上一版索引上原地增删而不重新训练"""
+    return isinstance(faiss.downcast_index(index), faiss.IndexIVF)
+
+def update_index(index, X: np.ndarray, stale_ids, new_ids):
+    """在已训练的 IVF 索引上删掉 stale_ids，再以行号为 id 加入 X[new_ids]"""
+    if len(stale_ids):
+        index.remove_ids(np.asarray(stale_ids, dtype=np.int64))
+    if len(new_ids):
+        ids = np.asarray(new_ids, dtype=np.int64)
+        index.add_with_ids(np.ascontiguousarray(X[ids], dtype="float32"), ids)
+    return index
+
+def search_params(index, selector):
+    """带 IDSelector 的检索参数；沿用索引上已设置的 nprobe / efSearch（SearchParameters 会覆盖索引自身的设置）"""
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def tune_index(index, nprobe: int | None = None, ef_search: int | None = None):
+    """设置检索期参数；索引类型不支持的参数直接忽略（如 Flat 没有 nprobe）"""
+    ps = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if not value:
+            continue
+        try:
+            ps.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+    return index
+
+def quantized_spec(spec: str, vector_dtype: str = "float32") -> str:
+    """
+    把 spec 的向量存储换成标量量化：Flat → SQ8，IVF1024,Flat → IVF1024,SQ8，HNSW32 → HNSW32,SQ8
+    PQ 等本身已是压缩编码的 spec 原样返回
+    """
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"未知的 vector_dtype: {vector_dtype}（可选 {', '.join(VECTOR_DTYPES)}）")
+    code = VECTOR_DTYPES[vector_dtype]
+    if code is None:
+        return spec
+    parts = [p.strip() for p in spec.split(",")]
+    if parts[-1] == "Flat":
+        parts[-1] = code
+    elif len(parts) == 1 and parts[0].startswith("HNSW"):
+        parts.append(code)
+    return ",".join(parts)
+
+def read_index_mmap(path: str):
+    """
+    只读映射打开索引，向量/倒排不复制进进程私有内存，同机多个 worker 共享 page cache
+    依次尝试 IO_FLAG_MMAP_IFC（Flat/SQ/HNSW 的编码与 IVF 倒排）与 IO_FLAG_MMAP（仅 IVF 倒排），
+    faiss 版本或索引类型不支持时回退为普通读取；返回 (index, 是否映射)
+    """
+    for name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+        flag = getattr(faiss, name, None)
+        if flag is None:
+            continue
+        try:
+            return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY), True
+        except RuntimeError:
+            continue
+    return faiss.read_index(path), False
+
+def recall_at_k(truth, found):
+    hits = sum(len(set(t[t >= 0]) & set(f[f >= 0])) for t, f in zip(truth, found))
+    return hits / max(sum(int((t >= 0).sum()) for t in truth), 1)
+
+def check_recall(index, X: np.ndarray, k: int = 10, num_queries: int = 1000, seed: int = 1) -> float:
+    """从 X 中采样向量作查询，比较 index 与 float32 暴力内积检索的 recall@k"""
+    rows = np.sort(np.random.default_rng(seed).choice(X.shape[0], min(num_queries, X.shape[0]), replace=False))
+    q = np.ascontiguousarray(X[rows], dtype="float32")
+    _, truth = faiss.knn(q, np.ascontiguousarray(X, dtype="float32"), k, metric=faiss.METRIC_INNER_PRODUCT)
+    _, found = index.search(q, k)
+    return recall_at_k(truth, found)
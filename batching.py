@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+动态微批：把并发到达的单条请求在很短的时间窗口内合并成一批，交给同步的 batch_fn 一次处理，
+再把结果逐条分发回各自等待的请求。CPU 上一次编码/检索/重排 N 条远比 N 次单条便宜。
+整批失败时逐条重试，只有真正出错的那条请求收到异常，不连累同批的其他请求。
+"""
+import asyncio, time
+from collections import Counter
+from typing import Any, Callable, List, Optional
+
+class MicroBatcher:
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0,
+                 executor=None, max_inflight: int = 1):
+        """
+        batch_fn      ：同步函数 list[item] -> list[result]，结果与输入一一对应
+        max_batch_size：单批最多条数
+        max_wait_ms   ：第一条到达后最多再等多久凑批；0 表示只合并已在排队的请求
+        executor      ：运行 batch_fn 的线程池（None 为事件循环默认线程池）
+        max_inflight  ：同时执行的批数；执行中新到的请求继续排队，自然形成更大的下一批
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.max_inflight = max_inflight
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+        # 统计
+        self.batches = 0
+        self.items = 0
+        self.size_hist = Counter()
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.split_retries = 0
+
+    def _ensure_worker(self):
+        # 队列/信号量必须在运行中的事件循环里创建，所以延迟到第一次 submit
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+            self._worker = asyncio.get_running_loop().create_task(self._collect())
+
+    async def submit(self, item: Any) -> Any:
+        self._ensure_worker()
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, fut, time.perf_counter()))
+        return await fut
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._inflight.acquire()
+            loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            now = time.perf_counter()
+            waits = [now - t for _, _, t in batch]
+            self.batches += 1
+            self.items += len(batch)
+            self.size_hist[len(batch)] += 1
+            self.wait_total += sum(waits)
+            self.wait_max = max(self.wait_max, max(waits))
+
+            # 已取消（客户端断开）的请求不再计算
+            live = [b for b in batch if not b[1].done()]
+            if not live:
+                return
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, [item for item, _, _ in live])
+            except Exception as e:
+                if len(live) == 1:
+                    if not live[0][1].done():
+                        live[0][1].set_exception(e)
+                    return
+                # 整批失败：逐条重跑，找出真正出错的那条
+                self.split_retries += 1
+                live = [b for b in live if not b[1].done()]
+                outcomes = await loop.run_in_executor(self.executor, self._run_each, [item for item, _, _ in live])
+                for (_, fut, _), (ok, r) in zip(live, outcomes):
+                    if fut.done():
+                        continue
+                    if ok:
+                        fut.set_result(r)
+                    else:
+                        fut.set_exception(r)
+                return
+            for (_, fut, _), r in zip(live, results):
+                if not fut.done():
+                    fut.set_result(r)
+        finally:
+            self._inflight.release()
+
+    def _run_each(self, items: List[Any]) -> List[tuple]:
+        """逐条调用 batch_fn，返回 (是否成功, 结果或异常)"""
+        outcomes = []
+        for item in items:
+            try:
+                outcomes.append((True, self.batch_fn([item])[0]))
+            except Exception as e:
+                outcomes.append((False, e))
+        return outcomes
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_size_hist": {str(k): v for k, v in sorted(self.size_hist.items())},
+            "avg_queue_wait_ms": self.wait_total / self.items * 1000 if self.items else 0.0,
+            "max_queue_wait_ms": self.wait_max * 1000,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "split_retries": self.split_retries,
+        }
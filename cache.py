@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+/chat 回答缓存（两级）
+- 精确命中：归一化后的问题文本完全一致，连检索都省掉
+- 语义命中：用 retrieve() 已算好的问题向量，与缓存条目的余弦相似度 >= threshold
+淘汰：LRU（max_entries）+ TTL；新索引版本上线（set_version）时整体清空
+热更新前已在处理的请求仍带着旧版本号：查找一律未命中、写入直接丢弃，不会冲掉新版本的条目
+scope 区分同一问题在不同检索条件（如元数据过滤）下的回答，两级查找都只在同一 scope 内命中
+"""
+import re, time, unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+import numpy as np
+
+_PUNCT = re.compile(r"[\s，。；：、！？,.;:!?\"'“”‘’（）()【】\[\]《》<>]+")
+
+def normalize_query(q: str) -> str:
+    """全角转半角、小写、去标点和空白：'期末考试 安排？' 与 '期末考试安排' 视为同一问题"""
+    return _PUNCT.sub("", unicodedata.normalize("NFKC", q).lower())
+
+class AnswerCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.version = None
+        self._matrix = None  # 语义查找用的向量矩阵，条目变化后惰性重建
+        self._keys = []
+        self._scopes = None
+        # 统计
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.saved_llm_seconds = 0.0
+
+    def set_version(self, version):
+        """新索引版本上线时调用（启动加载、热更新）；版本变化时清空全部条目"""
+        if version != self.version:
+            self.entries.clear()
+            self._matrix = None
+            self.version = version
+
+    def _current(self, version) -> bool:
+        """调用方的版本是否为当前版本；尚未设置过版本时以第一次使用的版本为准"""
+        if self.version is None:
+            self.set_version(version)
+        return version == self.version
+
+    def _expired(self, entry) -> bool:
+        return time.monotonic() - entry["created"] > self.ttl
+
+    def _hit(self, key, kind) -> dict:
+        entry = self.entries[key]
+        self.entries.move_to_end(key)
+        if kind == "exact":
+            self.hits_exact += 1
+        else:
+            self.hits_semantic += 1
+        self.saved_llm_seconds += entry["llm_seconds"]
+        return entry["value"]
+
+    @staticmethod
+    def _key(query: str, scope: str) -> str:
+        return f"{scope}\x1f{normalize_query(query)}" if scope else normalize_query(query)
+
+    def get_exact(self, query: str, version, scope: str = "") -> Optional[Any]:
+        if not self._current(version):
+            return None
+        key = self._key(query, scope)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._drop(key)
+            return None
+        return self._hit(key, "exact")
+
+    def get_similar(self, vec: np.ndarray, version, scope: str = "") -> Optional[Any]:
+        """精确未命中后调用；此处的未命中才计入 misses"""
+        if self._current(version) and self.entries:
+            if self._matrix is None:
+                self._keys = list(self.entries)
+                self._matrix = np.stack([self.entries[k]["vec"] for k in self._keys])
+                self._scopes = np.array([self.entries[k]["scope"] for k in self._keys], dtype=object)
+            sims = self._matrix @ np.asarray(vec, dtype="float32").ravel()
+            sims[self._scopes != scope] = -np.inf
+            best = int(np.argmax(sims))
+            key = self._keys[best]
+            if sims[best] >= self.threshold:
+                if not self._expired(self.entries[key]):
+                    return self._hit(key, "semantic")
+                self._drop(key)
+        self.misses += 1
+        return None
+
+    def put(self, query: str, vec: np.ndarray, value: Any, llm_seconds: float, version, scope: str = ""):
+        if not self._current(version):
+            return
+        key = self._key(query, scope)
+        self.entries[key] = {
+            "scope": scope,
+            "value": value,
+            "vec": np.asarray(vec, dtype="float32").ravel(),
+            "created": time.monotonic(),
+            "llm_seconds": llm_seconds,
+        }
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._matrix = None
+
+    def _drop(self, key):
+        self.entries.pop(key, None)
+        self._matrix = None
+
+    def stats(self) -> dict:
+        lookups = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_rate": (self.hits_exact + self.hits_semantic) / lookups if lookups else 0.0,
+            "saved_llm_seconds": round(self.saved_llm_seconds, 3),
+        }
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+检索评测：标注问题 → 相关通知的 doc_id（chunk 元数据里的 doc_id），统计 hit@k 与 MRR
+- 检索结果是 chunk 列表，同一通知的多个 chunk 只按第一次出现的位置计名次
+- 名次从 1 开始；topk_final 以内没有命中记为 None（对 MRR 贡献 0）
+/ask/batch、/chat/batch 与 tools/evaluate.py 共用
+DEFAULT_QUERIES：没有问题文件时的内置样例，启动预热与 tools/bench_* 共用
+"""
+from typing import Iterable, List, Optional, Sequence
+
+DEFAULT_KS = (1, 3, 5, 8)
+
+DEFAULT_QUERIES = [
+    "期末考试安排什么时候公布",
+    "补考申请需要什么材料",
+    "选课系统开放时间",
+    "转专业的条件和流程",
+    "教学日历 2025 春季学期",
+    "成绩复核怎么申请",
+    "毕业论文答辩时间安排",
+    "缓考如何办理",
+]
+
+def ranked_doc_ids(docs: List[dict]) -> List[str]:
+    seen, out = set(), []
+    for d in docs:
+        key = d.get("doc_id") or d["id"]
+        if key not in seen:
+            seen.add(key)
+            out.append(key)
+    return out
+
+def first_hit(ranked: Sequence[str], relevant: Iterable[str]) -> Optional[int]:
+    relevant = set(relevant)
+    for i, doc_id in enumerate(ranked, 1):
+        if doc_id in relevant:
+            return i
+    return None
+
+def summarize(ranks: List[Optional[int]], ks: Sequence[int] = DEFAULT_KS) -> dict:
+    """ranks 为各标注问题的命中名次（未命中为 None）"""
+    n = len(ranks)
+    out = {"labeled": n}
+    for k in ks:
+        out[f"hit@{k}"] = round(sum(1 for r in ranks if r is not None and r <= k) / n, 4) if n else None
+    out["mrr"] = round(sum(1 / r for r in ranks if r is not None) / n, 4) if n else None
+    return out
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+元数据过滤（发布日期区间、部门、文档类型），在检索内部生效而不是事后过滤
+- build_index 写出 filter_fields.json（各字段取值表）、filter_codes.npy（每行各字段的取值编号）、
+  filter_dates.npy（publish_date 转成 yyyymmdd 整数，未知为 0）
+- FilterIndex 加载时为每个字段的每个取值预先算好按行号排列的位图（np.packbits little 序，与 faiss.IDSelectorBitmap 一致）；
+  一次查询的过滤条件 = 同字段内 OR、字段间 AND、再与日期区间 AND，全部在位图上按字节运算
+- 位图直接交给 faiss 的 IDSelector 在检索中跳过不满足条件的向量，同时用来屏蔽 BM25 分数
+"""
+import json, os, re
+from typing import Iterable, NamedTuple, Optional, Tuple
+import numpy as np
+
+FILTER_FIELDS = "filter_fields.json"
+FILTER_CODES = "filter_codes.npy"
+FILTER_DATES = "filter_dates.npy"
+FILTER_FILES = (FILTER_FIELDS, FILTER_CODES, FILTER_DATES)
+CATEGORICAL = ("dept", "doc_type")
+
+_DATE = re.compile(r"^(\d{4})-?(\d{1,2})?-?(\d{1,2})?")
+
+def date_code(s, end: bool = False) -> int:
+    """'2025-03-01' → 20250301；只给到年/月时按区间起点（end=True 时按终点）补齐；无法解析返回 0"""
+    m = _DATE.match(str(s or "").strip())
+    if not m:
+        return 0
+    y = int(m.group(1))
+    mo = int(m.group(2)) if m.group(2) else (12 if end else 1)
+    d = int(m.group(3)) if m.group(3) else (31 if end else 1)
+    if not (1 <= mo <= 12 and 1 <= d <= 31):
+        return 0
+    return y * 10000 + mo * 100 + d
+
+class Filters(NamedTuple):
+    """一次查询的过滤条件；可哈希，微批里按它分组、回答缓存按它隔离"""
+    date_from: int = 0  # yyyymmdd，0 表示不限
+    date_to: int = 0
+    dept: Tuple[str, ...] = ()
+    doc_type: Tuple[str, ...] = ()
+
+    def key(self) -> str:
+        return json.dumps(self, ensure_ascii=False, separators=(",", ":"))
+
+def make_filters(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                 dept: Optional[Iterable[str]] = None, doc_type: Optional[Iterable[str]] = None) -> Optional[Filters]:
+    """由请求参数构造过滤条件；没有任何条件时返回 None；日期无法解析时抛 ValueError"""
+    lo = date_code(date_from) if date_from else 0
+    hi = date_code(date_to, end=True) if date_to else 0
+    if (date_from and not lo) or (date_to and not hi):
+        raise ValueError("日期格式应为 YYYY-MM-DD（可只写到年或月）")
+    clean = lambda vs: tuple(sorted({v.strip() for v in vs or () if v and v.strip()}))
+    f = Filters(lo, hi, clean(dept), clean(doc_type))
+    return None if f == Filters() else f
+
+def build_filter_index(metas, index_dir: str, suffix: str = ""):
+    """按行号（与 faiss / meta.bin 一致）写出各字段编号与日期"""
+    values = {field: {} for field in CATEGORICAL}
+    codes = np.zeros((len(metas), len(CATEGORICAL)), dtype=np.int32)
+    dates = np.zeros(len(metas), dtype=np.int32)
+    for i, m in enumerate(metas):
+        for j, field in enumerate(CATEGORICAL):
+            v = m.get(field) or ""
+            codes[i, j] = values[field].setdefault(v, len(values[field]))
+        dates[i] = date_code(m.get("publish_date"))
+    with open(os.path.join(index_dir, FILTER_FIELDS + suffix), "w", encoding="utf-8") as f:
+        json.dump({"num_docs": len(metas), "fields": {k: list(v) for k, v in values.items()}}, f, ensure_ascii=False)
+    for name, arr in ((FILTER_CODES, codes), (FILTER_DATES, dates)):
+        with open(os.path.join(index_dir, name + suffix), "wb") as f:
+            np.save(f, arr)
+
+class FilterIndex:
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, FILTER_FIELDS), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.num_docs = meta["num_docs"]
+        self.values = meta["fields"]
+        codes = np.load(os.path.join(index_dir, FILTER_CODES))
+        # 每个取值一张位图：{字段: {取值: packed bitmap}}
+        self.bitmaps = {
+            field: {v: np.packbits(codes[:, j] == c, bitorder="little") for c, v in enumerate(self.values[field])}
+            for j, field in enumerate(CATEGORICAL)
+        }
+        # 日期区间 → 行号：按日期排序一次，查询时二分取区间
+        self.dates = np.load(os.path.join(index_dir, FILTER_DATES))
+        self.date_order = np.argsort(self.dates, kind="stable")
+        self.sorted_dates = self.dates[self.date_order]
+
+    @classmethod
+    def load(cls, index_dir: str):
+        """旧索引没有过滤数据时返回 None"""
+        if not all(os.path.exists(os.path.join(index_dir, name)) for name in FILTER_FILES):
+            return None
+        return cls(index_dir)
+
+    def _date_bitmap(self, lo: int, hi: int) -> np.ndarray:
+        # 有日期条件时，没有发布日期（0）的文档一律排除
+        s = np.searchsorted(self.sorted_dates, max(lo, 1), side="left")
+        e = np.searchsorted(self.sorted_dates, hi, side="right") if hi else len(self.sorted_dates)
+        mask = np.zeros(self.num_docs, dtype=bool)
+        mask[self.date_order[s:e]] = True
+        return np.packbits(mask, bitorder="little")
+
+    def bitmap(self, f: Filters) -> np.ndarray:
+        """满足条件的行号位图（packed，little 序）"""
+        nbytes = (self.num_docs + 7) // 8
+        result = None
+        for field in CATEGORICAL:
+            wanted = getattr(f, field)
+            if not wanted:
+                continue
+            m = np.zeros(nbytes, dtype=np.uint8)
+            for v in wanted:
+                bm = self.bitmaps[field].get(v)
+                if bm is not None:
+                    np.bitwise_or(m, bm, out=m)
+            result = m if result is None else np.bitwise_and(result, m, out=result)
+        if f.date_from or f.date_to:
+            dm = self._date_bitmap(f.date_from, f.date_to)
+            result = dm if result is None else np.bitwise_and(result, dm, out=result)
+        if result is None:
+            result = np.packbits(np.ones(self.num_docs, dtype=bool), bitorder="little")
+        return result
+
+    def mask(self, bitmap: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bitmap, count=self.num_docs, bitorder="little").astype(bool)
+
+    def ids(self, bitmap: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(self.mask(bitmap))
+
+    @staticmethod
+    def count(bitmap: np.ndarray) -> int:
+        return int(np.unpackbits(bitmap).sum())
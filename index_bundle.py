@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+版本化索引目录 + 可整体替换的检索数据包
+- build_index 每次构建写入 INDEX_DIR/versions/<版本号>/，写完后原子替换 INDEX_DIR/CURRENT（内容为版本号）；
+  版本目录写完即不再修改，读者看到的永远是完整的一版
+- IndexBundle 一次性打开某一版的 faiss 索引 / 元数据 / 向量 / BM25；use.py 热更新时在后台加载新版本，
+  再用一次引用赋值整体替换，正在执行的查询继续持有旧对象直到结束
+- 没有 CURRENT 的旧版平铺目录（文件直接放在 INDEX_DIR 下）照常可用
+- faiss 在 IndexBundle.load 里才导入，use.py 的模块导入保持轻量
+- 索引文件默认只读 mmap 打开（ann.read_index_mmap），与 embeddings.npy / meta / BM25 一样由各 worker 共享 page cache
+- IndexBundle.search 支持元数据过滤（filters.py）：条件很窄时直接对候选行精确打分，否则把位图交给 faiss IDSelector
+"""
+import os, shutil, time
+import numpy as np
+from metastore import open_meta_store
+from lexical import BM25Index
+from filters import FilterIndex
+
+CURRENT = "CURRENT"
+VERSIONS = "versions"
+EXACT_BLOCK = 4096  # 过滤后精确打分时每次取出的向量行数
+EXACT_MAX_FRACTION = 0.1  # 满足条件的行超过全库该比例时不走精确打分
+
+def current_version(index_dir):
+    """读取 CURRENT 指向的版本号；旧版平铺目录返回 None"""
+    try:
+        with open(os.path.join(index_dir, CURRENT), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def resolve_index_dir(index_dir):
+    """返回 (版本号, 实际文件所在目录)；平铺目录以 faiss.index 的 mtime-size 作为版本号"""
+    version = current_version(index_dir)
+    if version:
+        return version, os.path.join(index_dir, VERSIONS, version)
+    st = os.stat(os.path.join(index_dir, "faiss.index"))
+    return f"{st.st_mtime_ns}-{st.st_size}", index_dir
+
+def new_version_dir(index_dir):
+    """创建一个新的版本目录（按时间命名，字典序即时间序），返回 (版本号, 目录)"""
+    root = os.path.join(index_dir, VERSIONS)
+    os.makedirs(root, exist_ok=True)
+    while True:
+        now = time.time()
+        version = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1e6) % 1000000:06d}"
+        try:
+            os.mkdir(os.path.join(root, version))
+            return version, os.path.join(root, version)
+        except FileExistsError:  # 同一微秒内并发构建
+            time.sleep(0.001)
+
+def publish_version(index_dir, version):
+    """原子切换 CURRENT：先写临时文件再 os.replace，读者不会读到半个版本号"""
+    tmp = os.path.join(index_dir, CURRENT + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(index_dir, CURRENT))
+
+def prune_versions(index_dir, keep=3):
+    """只保留最新的 keep 个版本（当前版本总是保留），返回删除的版本号"""
+    root = os.path.join(index_dir, VERSIONS)
+    if keep <= 0 or not os.path.isdir(root):
+        return []
+    current = current_version(index_dir)
+    versions = sorted(v for v in os.listdir(root) if os.path.isdir(os.path.join(root, v)))
+    removed = []
+    for v in versions[:-keep]:
+        if v == current:
+            continue
+        # 仍被旧进程 mmap 的文件在 Windows 下删不掉，留到下次再删
+        shutil.rmtree(os.path.join(root, v), ignore_errors=True)
+        removed.append(v)
+    return removed
+
+class IndexBundle:
+    """一版索引的全部只读数据；加载完成后不再修改，可被多个线程同时使用"""
+    def __init__(self, version, path, index, metas, embeddings=None, bm25=None, filters=None, mmapped=False):
+        self.version = version
+        self.path = path
+        self.index = index
+        self.metas = metas
+        self.embeddings = embeddings
+        self.bm25 = bm25
+        self.filters = filters
+        self.mmapped = mmapped
+
+    @classmethod
+    def load(cls, index_dir, nprobe=None, ef_search=None, hybrid=True, mmap=True):
+        import faiss
+        from ann import tune_index, read_index_mmap
+        version, path = resolve_index_dir(index_dir)
+        index_path = os.path.join(path, "faiss.index")
+        index, mmapped = read_index_mmap(index_path) if mmap else (faiss.read_index(index_path), False)
+        index = tune_index(index, nprobe=nprobe, ef_search=ef_search)
+        metas = open_meta_store(path)  # 只读 mmap，按需反序列化；更早的索引回退读 meta.jsonl
+        # build_index 保存的向量矩阵（只读 mmap，float32 或 float16）；旧索引没有该文件时回退到 index.reconstruct
+        emb_path = os.path.join(path, "embeddings.npy")
+        embeddings = np.load(emb_path, mmap_mode="r") if os.path.exists(emb_path) else None
+        # BM25 倒排（字二元组）；旧索引没有倒排时只用向量检索
+        bm25 = BM25Index.load(path) if hybrid else None
+        # 元数据过滤位图；旧索引没有时不支持过滤
+        filters = FilterIndex.load(path)
+        return cls(version, path, index, metas, embeddings, bm25, filters, mmapped)
+
+    def stored_vectors(self, ids: np.ndarray) -> np.ndarray:
+        """取出候选 chunk 已入库的归一化向量，避免对候选文本重新编码"""
+        if self.embeddings is not None:
+            return np.asarray(self.embeddings[ids], dtype="float32")
+        return self.index.reconstruct_batch(ids)
+
+    def filter_bitmap(self, filters):
+        """过滤条件 → 行号位图；无条件或旧索引不支持过滤时返回 None"""
+        if filters is None or self.filters is None:
+            return None
+        return self.filters.bitmap(filters)
+
+    def search(self, qv: np.ndarray, k: int, bitmap=None, exact_max: int = 0):
+        """
+        向量检索，返回 (D, I)，不足 k 条时 I 以 -1 填充
+        给定 bitmap 时只在满足条件的行里找：行数 <= exact_max 且有 embeddings 时直接精确打分，
+        否则用位图构造 IDSelector，在 faiss 检索过程中跳过其余向量
+        """
+        if bitmap is None:
+            return self.index.search(qv, k)
+        import faiss
+        from ann import search_params
+        n = self.filters.count(bitmap)
+        if n == 0:
+            return (np.full((len(qv), k), -np.inf, dtype=np.float32),
+                    np.full((len(qv), k), -1, dtype=np.int64))
+        # 条件很宽（如全库同一部门）时精确打分等于整库扫描，交给 faiss
+        if n <= exact_max and n <= self.filters.num_docs * EXACT_MAX_FRACTION and self.embeddings is not None:
+            return self._exact_search(qv, k, self.filters.ids(bitmap))
+        # IDSelectorBitmap 的第一个参数是位图字节数
+        selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+        return self.index.search(qv, k, params=search_params(self.index, selector))
+
+    def _exact_search(self, qv: np.ndarray, k: int, ids: np.ndarray):
+        """只对 ids 这些行精确打分；按 EXACT_BLOCK 行分块取向量，每块只保留 top-k，不一次性复制全部候选"""
+        D = np.full((len(qv), k), -np.inf, dtype=np.float32)
+        I = np.full((len(qv), k), -1, dtype=np.int64)
+        for start in range(0, len(ids), EXACT_BLOCK):
+            block = ids[start:start + EXACT_BLOCK]
+            sims = qv @ np.asarray(self.embeddings[block], dtype="float32").T
+            allD = np.concatenate([D, sims], axis=1)
+            allI = np.concatenate([I, np.broadcast_to(block, sims.shape)], axis=1)
+            top = np.argsort(-allD, axis=1, kind="stable")[:, :k]
+            D = np.take_along_axis(allD, top, axis=1)
+            I = np.take_along_axis(allI, top, axis=1)
+        return D, I
+
+    def bm25_search(self, query: str, k: int, bitmap=None):
+        mask = self.filters.mask(bitmap) if bitmap is not None else None
+        return self.bm25.search(query, k, mask=mask)
+
+    def __len__(self):
+        return self.index.ntotal
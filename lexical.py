@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+中文 BM25 倒排索引 + RRF 融合
+- 切词：中文按字二元组（单字成词时保留单字），字母数字串整体成词（课程代码、表格编号、日期）
+- 构建时把每个 (词, chunk) 的 BM25 分量预先算好，检索只需对命中词的倒排做一次 scatter-add
+- 存储为 CSR：bm25_indptr.npy / bm25_docs.npy / bm25_weights.npy（均可 mmap）+ bm25_vocab.json
+"""
+import json, math, os, re, unicodedata
+from collections import Counter
+from typing import List, Sequence, Tuple
+import numpy as np
+
+BM25_VOCAB = "bm25_vocab.json"
+BM25_INDPTR = "bm25_indptr.npy"
+BM25_DOCS = "bm25_docs.npy"
+BM25_WEIGHTS = "bm25_weights.npy"
+BM25_FILES = (BM25_VOCAB, BM25_INDPTR, BM25_DOCS, BM25_WEIGHTS)
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*|[㐀-鿿]+")
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKC", text).lower()
+    terms = []
+    for m in _TOKEN.finditer(text):
+        w = m.group(0)
+        if "㐀" <= w[0] <= "鿿":
+            if len(w) == 1:
+                terms.append(w)
+            else:
+                terms.extend(w[i:i + 2] for i in range(len(w) - 1))
+        else:
+            terms.append(w)
+    return terms
+
+def _save_npy(path, arr):
+    # 直接写文件对象，避免 np.save 给 .tmp 文件名再追加 .npy
+    with open(path, "wb") as f:
+        np.save(f, arr)
+
+def build_bm25(texts: Sequence[str], index_dir: str, suffix: str = "", k1: float = 1.2, b: float = 0.75):
+    """对 texts（行号即 chunk id，与 faiss 一致）建倒排并写入 index_dir"""
+    n = len(texts)
+    postings = {}  # term -> ([doc], [tf])
+    doc_len = np.zeros(n, dtype=np.float32)
+    for i, t in enumerate(texts):
+        tf = Counter(tokenize(t))
+        doc_len[i] = sum(tf.values())
+        for term, c in tf.items():
+            p = postings.get(term)
+            if p is None:
+                p = postings[term] = ([], [])
+            p[0].append(i)
+            p[1].append(c)
+    avgdl = float(doc_len.mean()) if n else 1.0
+    norm = k1 * (1 - b + b * doc_len / max(avgdl, 1e-9))
+
+    vocab = sorted(postings)
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    for tid, term in enumerate(vocab):
+        indptr[tid + 1] = indptr[tid] + len(postings[term][0])
+    docs = np.empty(indptr[-1], dtype=np.int32)
+    weights = np.empty(indptr[-1], dtype=np.float32)
+    for tid, term in enumerate(vocab):
+        d = np.asarray(postings[term][0], dtype=np.int32)
+        tf = np.asarray(postings[term][1], dtype=np.float32)
+        idf = math.log(1 + (n - len(d) + 0.5) / (len(d) + 0.5))
+        s, e = indptr[tid], indptr[tid + 1]
+        docs[s:e] = d
+        weights[s:e] = idf * tf * (k1 + 1) / (tf + norm[d])
+
+    with open(os.path.join(index_dir, BM25_VOCAB + suffix), "w", encoding="utf-8") as f:
+        json.dump({"num_docs": n, "terms": vocab}, f, ensure_ascii=False)
+    _save_npy(os.path.join(index_dir, BM25_INDPTR + suffix), indptr)
+    _save_npy(os.path.join(index_dir, BM25_DOCS + suffix), docs)
+    _save_npy(os.path.join(index_dir, BM25_WEIGHTS + suffix), weights)
+
+class BM25Index:
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, BM25_VOCAB), encoding="utf-8") as f:
+            v = json.load(f)
+        self.num_docs = v["num_docs"]
+        self.vocab = {t: i for i, t in enumerate(v["terms"])}
+        self.indptr = np.load(os.path.join(index_dir, BM25_INDPTR), mmap_mode="r")
+        self.docs = np.load(os.path.join(index_dir, BM25_DOCS), mmap_mode="r")
+        self.weights = np.load(os.path.join(index_dir, BM25_WEIGHTS), mmap_mode="r")
+
+    @classmethod
+    def load(cls, index_dir: str):
+        """索引目录里没有倒排（旧版 build_index 的产物）时返回 None"""
+        if not all(os.path.exists(os.path.join(index_dir, name)) for name in BM25_FILES):
+            return None
+        return cls(index_dir)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            s, e = self.indptr[tid], self.indptr[tid + 1]
+            scores[self.docs[s:e]] += self.weights[s:e]  # 同一词的倒排内 doc 不重复
+        return scores
+
+    def search(self, query: str, k: int, mask: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        """返回按分数降序的 (ids, scores)，只含分数 > 0 的文档；mask（bool，按行号）为 False 的文档不参与排序"""
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[scores[top] > 0]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top.astype(np.int64), scores[top]
+
+def rrf_fuse(rankings: Sequence[Sequence[int]], k: int = 60,
+             limit: int | None = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Reciprocal Rank Fusion：score(d) = Σ 1 / (k + rank)，rank 从 1 开始；返回按分数降序的 (ids, scores)"""
+    fused = {}
+    for ranking in rankings:
+        for r, i in enumerate(ranking, 1):
+            i = int(i)
+            fused[i] = fused.get(i, 0.0) + 1.0 / (k + r)
+    ids = sorted(fused, key=fused.get, reverse=True)[:limit]
+    return np.asarray(ids, dtype=np.int64), np.asarray([fused[i] for i in ids], dtype=np.float32)
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-from typing import List, Dict, Any, Optional
-import os
-from openai import OpenAI
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
+import os, asyncio, time
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from metrics import observe_llm
 
 Message = Dict[str, str]  # {"role": "system|user|assistant", "content": "..."}
 
@@ -11,89 +13,165 @@ class ChatLLM:
     def chat(self, messages: List[Message], **kwargs) -> str:
         raise NotImplementedError
 
+    def stream(self, messages: List[Message], **kwargs) -> Iterator[str]:
+        """逐段产出回答文本；未实现流式的 provider 退化为一次性返回整段"""
+        yield self.chat(messages, **kwargs)
+
+    async def achat(self, messages: List[Message], **kwargs) -> str:
+        """异步接口；未实现原生异步的 provider 在线程中调用 chat，避免阻塞事件循环"""
+        return await asyncio.to_thread(self.chat, messages, **kwargs)
+
+    async def astream(self, messages: List[Message], **kwargs) -> AsyncIterator[str]:
+        yield await self.achat(messages, **kwargs)
+
 class ChatOpenAI(ChatLLM):
-    """OpenAI 官方/兼容实现（默认 base_url=api.openai.com）"""
+    """OpenAI 官方/兼容实现（默认 base_url=api.openai.com），其余兼容 provider 均复用"""
+    provider = "openai"  # 指标标签
+    stream_usage = True  # 流式请求带 stream_options.include_usage，最后一个 chunk 返回 token 用量
+
     def __init__(self, model: str, api_key: Optional[str] = None,
                  base_url: Optional[str] = None, temperature: float = 0.3,
-                 max_tokens: int = 1024):
-        self.client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"),
-                             base_url=base_url or "https://api.openai.com/v1")
+                 max_tokens: int = 1024, api_key_env: str = "OPENAI_API_KEY",
+                 timeout: float = 60.0, max_connections: int = 64, max_retries: int = 2):
+        api_key = api_key or os.getenv(api_key_env)
+        base_url = base_url or "https://api.openai.com/v1"
+        # 长连接池：复用到 provider 的 TCP/TLS 连接；超时同时约束连接与两次读之间的间隔
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries,
+                             http_client=DefaultHttpxClient(limits=limits, timeout=timeout))
+        self.aclient = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries,
+                                   http_client=DefaultAsyncHttpxClient(limits=limits, timeout=timeout))
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
 
-    def chat(self, messages: List[Message], **kwargs) -> str:
-        resp = self.client.chat.completions.create(
+    def _params(self, messages: List[Message], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(
             model=self.model,
             messages=messages,
             temperature=kwargs.get("temperature", self.temperature),
             max_tokens=kwargs.get("max_tokens", self.max_tokens),
         )
+
+    def _stream_params(self, messages: List[Message], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        params = self._params(messages, kwargs)
+        params["stream"] = True
+        if self.stream_usage:
+            params["stream_options"] = {"include_usage": True}
+        return params
+
+    def _observe(self, mode: str, t0: float, first_token: Optional[float] = None, usage=None):
+        observe_llm(self.provider, self.model, mode, time.perf_counter() - t0, first_token, usage)
+
+    def _observe_error(self):
+        observe_llm(self.provider, self.model, "", 0.0, error=True)
+
+    def chat(self, messages: List[Message], **kwargs) -> str:
+        t0 = time.perf_counter()
+        try:
+            resp = self.client.chat.completions.create(**self._params(messages, kwargs))
+        except Exception:
+            self._observe_error()
+            raise
+        self._observe("chat", t0, usage=resp.usage)
+        return resp.choices[0].message.content
+
+    def stream(self, messages: List[Message], **kwargs) -> Iterator[str]:
+        t0 = time.perf_counter()
+        first_token, usage = None, None
+        try:
+            resp = self.client.chat.completions.create(**self._stream_params(messages, kwargs))
+            for chunk in resp:
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token is None:
+                        first_token = time.perf_counter() - t0
+                    yield delta
+        except Exception:
+            self._observe_error()
+            raise
+        self._observe("stream", t0, first_token, usage)
+
+    async def achat(self, messages: List[Message], **kwargs) -> str:
+        t0 = time.perf_counter()
+        try:
+            resp = await self.aclient.chat.completions.create(**self._params(messages, kwargs))
+        except Exception:
+            self._observe_error()
+            raise
+        self._observe("chat", t0, usage=resp.usage)
         return resp.choices[0].message.content
 
-class ChatDeepSeek(ChatLLM):
+    async def astream(self, messages: List[Message], **kwargs) -> AsyncIterator[str]:
+        t0 = time.perf_counter()
+        first_token, usage = None, None
+        try:
+            resp = await self.aclient.chat.completions.create(**self._stream_params(messages, kwargs))
+            async for chunk in resp:
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token is None:
+                        first_token = time.perf_counter() - t0
+                    yield delta
+        except Exception:
+            self._observe_error()
+            raise
+        self._observe("stream", t0, first_token, usage)
+
+class ChatDeepSeek(ChatOpenAI):
     """DeepSeek（OpenAI 兼容）"""
+    provider = "deepseek"
+
     def __init__(self, model: str = "deepseek-chat",
                  api_key: Optional[str] = None,
-                 temperature: float = 0.7, max_tokens: int = 2048):
-        self.client = OpenAI(api_key=api_key or os.getenv("DEEPSEEK_API_KEY"),
-                             base_url="https://api.deepseek.com/v1")
-        self.model = model
-        self.temperature = temperature
-        self.max_tokens = max_tokens
-
-    def chat(self, messages: List[Message], **kwargs) -> str:
-        resp = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=kwargs.get("temperature", self.temperature),
-            max_tokens=kwargs.get("max_tokens", self.max_tokens),
-        )
-        return resp.choices[0].message.content
+                 temperature: float = 0.7, max_tokens: int = 2048, **client_kwargs):
+        super().__init__(model, api_key=api_key, api_key_env="DEEPSEEK_API_KEY",
+                         base_url="https://api.deepseek.com/v1",
+                         temperature=temperature, max_tokens=max_tokens, **client_kwargs)
 
-class ChatQwen(ChatLLM):
+class ChatQwen(ChatOpenAI):
     """通义千问（OpenAI 兼容模式）"""
+    provider = "qwen"
+
     def __init__(self, model: str = "qwen-turbo",
                  api_key: Optional[str] = None,
-                 temperature: float = 0.3, max_tokens: int = 1024):
-        self.client = OpenAI(api_key=api_key or os.getenv("DASHSCOPE_API_KEY"),
-                             base_url="https://dashscope.aliyuncs.com/compatible-mode/v1")
-        self.model = model
-        self.temperature = temperature
-        self.max_tokens = max_tokens
+                 temperature: float = 0.3, max_tokens: int = 1024, **client_kwargs):
+        super().__init__(model, api_key=api_key, api_key_env="DASHSCOPE_API_KEY",
+                         base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+                         temperature=temperature, max_tokens=max_tokens, **client_kwargs)
 
-    def chat(self, messages: List[Message], **kwargs) -> str:
-        resp = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=kwargs.get("temperature", self.temperature),
-            max_tokens=kwargs.get("max_tokens", self.max_tokens),
-        )
-        return resp.choices[0].message.content
-
-class ChatZhipu(ChatLLM):
+class ChatZhipu(ChatOpenAI):
     """智谱 GLM（OpenAI 兼容）"""
+    provider = "zhipu"
+    stream_usage = False  # 兼容接口不认 stream_options，用量只在非流式调用里统计
+
     def __init__(self, model: str = "glm-4",
                  api_key: Optional[str] = None,
-                 temperature: float = 0.3, max_tokens: int = 1024):
-        self.client = OpenAI(api_key=api_key or os.getenv("ZHIPU_API_KEY"),
-                             base_url="https://open.bigmodel.cn/api/paas/v4")
-        self.model = model
-        self.temperature = temperature
-        self.max_tokens = max_tokens
+                 temperature: float = 0.3, max_tokens: int = 1024, **client_kwargs):
+        super().__init__(model, api_key=api_key, api_key_env="ZHIPU_API_KEY",
+                         base_url="https://open.bigmodel.cn/api/paas/v4",
+                         temperature=temperature, max_tokens=max_tokens, **client_kwargs)
 
-    def chat(self, messages: List[Message], **kwargs) -> str:
-        resp = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=kwargs.get("temperature", self.temperature),
-            max_tokens=kwargs.get("max_tokens", self.max_tokens),
-        )
-        return resp.choices[0].message.content
+class ChatStub(ChatOpenAI):
+    """本地假 LLM（tools/stub_llm.py），压测时替代真实 provider；地址取 STUB_LLM_BASE_URL"""
+    provider = "stub"
+
+    def __init__(self, model: str = "stub",
+                 api_key: Optional[str] = None,
+                 temperature: float = 0.3, max_tokens: int = 1024, **client_kwargs):
+        super().__init__(model, api_key=api_key or "stub", api_key_env="STUB_LLM_API_KEY",
+                         base_url=os.getenv("STUB_LLM_BASE_URL", "http://127.0.0.1:8901/v1"),
+                         temperature=temperature, max_tokens=max_tokens, **client_kwargs)
 
 
 def make_llm(provider: str, **kwargs) -> ChatLLM:
-    """简单工厂：provider in {openai, deepseek, qwen, zhipu}"""
+    """简单工厂：provider in {openai, deepseek, qwen, zhipu, stub}"""
     provider = provider.lower()
     if provider == "openai":
         return ChatOpenAI(**kwargs)
@@ -103,4 +181,6 @@ def make_llm(provider: str, **kwargs) -> ChatLLM:
         return ChatQwen(**kwargs)
     if provider == "zhipu":
         return ChatZhipu(**kwargs)
+    if provider == "stub":
+        return ChatStub(**kwargs)
     raise ValueError(f"Unknown provider: {provider}")
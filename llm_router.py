@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+多 provider 路由：按配置顺序为主/备，慢请求对冲（hedge）、失败切换（failover）与熔断
+- 每个 provider 有自己的在途请求上限（信号量）与超时；底层客户端是长连接池（见 ChatOpenAI 的 max_connections）
+- 按 provider 记录最近的耗时（非流式为总耗时，流式为首 token 延迟）；请求超过该 provider 的 p95 仍未返回时，
+  向下一个有空闲名额的 provider 发同样的请求，先返回者胜出，另一个立即取消
+- 对冲受预算约束：每个请求积累 hedge_budget 个令牌（最多 hedge_burst 个），每次对冲消耗 1 个，
+  因此对冲量长期不超过请求量的 hedge_budget 比例，provider 整体变慢时也不会成倍放大调用费用
+- 连续失败 breaker_failures 次的 provider 熔断 breaker_cooldown 秒，期间跳过；冷却后只放一个试探请求，成功即恢复
+- 流式请求只在首 token 之前对冲/切换；开始输出后再失败直接抛出，不拼接两个模型的回答
+异步接口（achat / astream）由事件循环单线程驱动，状态不加锁；同步接口只做顺序切换，不对冲
+"""
+from __future__ import annotations
+import asyncio, time
+from collections import deque
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+import numpy as np
+from llm import ChatLLM, Message, make_llm
+from metrics import observe_router
+
+def parse_providers(spec: str) -> List[tuple]:
+    """'qwen:qwen-plus,zhipu' → [('qwen', 'qwen-plus'), ('zhipu', None)]"""
+    out = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        provider, _, model = item.partition(":")
+        out.append((provider.strip(), model.strip() or None))
+    return out
+
+class LatencyWindow:
+    """最近 size 次耗时（秒）；样本不足 min_samples 时不给分位数，此时不对冲"""
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.values = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        self.values.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.values) < self.min_samples:
+            return None
+        return float(np.quantile(np.fromiter(self.values, dtype=np.float64), q))
+
+class CircuitBreaker:
+    """closed → 连续失败达到阈值 → open（冷却期内拒绝）→ half_open（放一个试探请求）→ 成功 closed / 失败 open"""
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def ready(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.probing)
+
+    def on_start(self):
+        if self.opened_at is not None:
+            self.probing = True
+
+    def on_success(self):
+        self.consecutive = 0
+        self.opened_at = None
+        self.probing = False
+
+    def on_failure(self) -> bool:
+        """返回本次失败是否使熔断器（重新）打开"""
+        self.consecutive += 1
+        trip = self.probing or (self.opened_at is None and self.consecutive >= self.failures)
+        self.probing = False
+        if trip:
+            self.opened_at = time.monotonic()
+        return trip
+
+    def on_cancel(self):
+        # 被对冲取消或客户端断开：不计成功也不计失败，只归还试探名额
+        self.probing = False
+
+class Backend:
+    """路由里的一个 provider：客户端 + 在途上限 + 熔断器 + 耗时窗口"""
+    def __init__(self, llm: ChatLLM, max_concurrency: int, breaker: CircuitBreaker,
+                 window: int, min_samples: int):
+        self.llm = llm
+        self.provider = getattr(llm, "provider", type(llm).__name__)
+        self.model = getattr(llm, "model", "")
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.breaker = breaker
+        self.latency = LatencyWindow(window, min_samples)  # 非流式总耗时
+        self.ttft = LatencyWindow(window, min_samples)  # 流式首 token 延迟
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+    def has_capacity(self) -> bool:
+        return not self.slots.locked()
+
+    async def acquire(self, timeout: float):
+        self.breaker.on_start()
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout)
+        except BaseException:
+            # 本地名额排队超时不算 provider 的失败
+            self.breaker.on_cancel()
+            raise
+        self.in_flight += 1
+        self.calls += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.slots.release()
+
+    def failure(self):
+        self.errors += 1
+        if self.breaker.on_failure():
+            observe_router(self.provider, self.model, "breaker_open")
+
+    def stats(self) -> dict:
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        return {
+            "breaker": self.breaker.state,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "wins": self.wins,
+            "latency_p50_ms": ms(self.latency.quantile(0.5)),
+            "latency_p95_ms": ms(self.latency.quantile(0.95)),
+            "ttft_p50_ms": ms(self.ttft.quantile(0.5)),
+            "ttft_p95_ms": ms(self.ttft.quantile(0.95)),
+        }
+
+class ChatRouter(ChatLLM):
+    """把多个 ChatLLM 组合成一个；第一个为主 provider，其余按顺序作为对冲/切换目标"""
+    provider = "router"
+
+    def __init__(self, llms: List[ChatLLM], timeout: float = 60.0, max_concurrency: int = 32,
+                 hedge_quantile: float = 0.95, hedge_budget: float = 0.05, hedge_burst: float = 5.0,
+                 breaker_failures: int = 5, breaker_cooldown: float = 30.0,
+                 window: int = 200, min_samples: int = 20):
+        if not llms:
+            raise ValueError("ChatRouter 至少需要一个 provider")
+        self.backends = [Backend(llm, max_concurrency, CircuitBreaker(breaker_failures, breaker_cooldown),
+                                 window, min_samples) for llm in llms]
+        self.model = self.backends[0].model
+        self.timeout = timeout
+        self.hedge_quantile = hedge_quantile
+        self.hedge_budget = hedge_budget
+        self.hedge_burst = hedge_burst
+        self.hedge_tokens = hedge_burst
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    # ---- 选择 provider ----
+    def _pick(self, tried: List[Backend]) -> Optional[Backend]:
+        """未尝试过、未熔断的 provider 中优先有空闲名额的；都满时排队等第一个"""
+        candidates = [b for b in self.backends if b not in tried and b.breaker.ready()]
+        for b in candidates:
+            if b.has_capacity():
+                return b
+        return candidates[0] if candidates else None
+
+    def _hedge_target(self, tried: List[Backend]) -> Optional[Backend]:
+        """对冲只发给有空闲名额的 provider，并消耗一个预算令牌"""
+        if self.hedge_tokens < 1:
+            return None
+        for b in self.backends:
+            if b not in tried and b.breaker.ready() and b.has_capacity():
+                self.hedge_tokens -= 1
+                return b
+        return None
+
+    def _hedge_wait(self, window: LatencyWindow, t_start: float) -> Optional[float]:
+        """距离触发对冲还要等多少秒；没有足够样本或关闭对冲时返回 None（一直等）"""
+        if self.hedge_quantile <= 0 or len(self.backends) < 2:
+            return None
+        deadline = window.quantile(self.hedge_quantile)
+        if deadline is None:
+            return None
+        return max(deadline - (time.perf_counter() - t_start), 0.0)
+
+    def _begin(self):
+        self.requests += 1
+        self.hedge_tokens = min(self.hedge_burst, self.hedge_tokens + self.hedge_budget)
+
+    def _no_backend(self, last_exc: Optional[BaseException]):
+        if last_exc is not None:
+            raise last_exc
+        raise RuntimeError("所有 LLM provider 均处于熔断状态")
+
+    # ---- 单个 provider 上的一次调用 ----
+    async def _achat_once(self, b: Backend, messages: List[Message], kwargs: dict) -> str:
+        await b.acquire(self.timeout)
+        t0 = time.perf_counter()
+        try:
+            answer = await asyncio.wait_for(b.llm.achat(messages, **kwargs), self.timeout)
+        except asyncio.CancelledError:
+            b.breaker.on_cancel()
+            raise
+        except Exception:
+            b.failure()
+            raise
+        finally:
+            b.release()
+        b.latency.add(time.perf_counter() - t0)
+        b.breaker.on_success()
+        return answer
+
+    async def _open_stream(self, b: Backend, messages: List[Message], kwargs: dict):
+        """取到首段文本为止，返回 (生成器, 首段)；成功后名额由调用方在流结束时释放"""
+        await b.acquire(self.timeout)
+        agen = b.llm.astream(messages, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            first = await asyncio.wait_for(agen.__anext__(), self.timeout)
+        except StopAsyncIteration:
+            first = ""
+        except BaseException as e:
+            await agen.aclose()
+            b.release()
+            if isinstance(e, Exception):
+                b.failure()
+            else:
+                b.breaker.on_cancel()
+            raise
+        b.ttft.add(time.perf_counter() - t0)
+        return agen, first
+
+    # ---- 对冲 + 切换 ----
+    async def _race(self, start_call, window_of):
+        """
+        start_call(b) 返回协程；先发主 provider，超过其分位耗时未返回则对冲，失败则切换
+        返回 (胜出的 Backend, 结果)；失败的尝试已计入各自熔断器
+        """
+        tried: List[Backend] = []
+        pending: Dict[asyncio.Future, Backend] = {}
+        hedged, hedge_target = False, None
+        last_exc = None
+
+        def start(b: Backend):
+            tried.append(b)
+            pending[asyncio.ensure_future(start_call(b))] = b
+
+        primary = self._pick(tried)
+        if primary is None:
+            self._no_backend(None)
+        start(primary)
+        t_start = time.perf_counter()
+        try:
+            while pending:
+                wait = self._hedge_wait(window_of(primary), t_start) if not hedged else None
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    hedge_target = self._hedge_target(tried)
+                    if hedge_target is not None:
+                        self.hedges += 1
+                        observe_router(hedge_target.provider, hedge_target.model, "hedge")
+                        start(hedge_target)
+                    continue
+                winner = None
+                for t in done:
+                    b = pending.pop(t)
+                    if t.exception() is not None:
+                        last_exc = t.exception()
+                    elif winner is None:
+                        winner = (b, t.result())
+                    else:
+                        # 同一轮里两个都成功：多余的那个按取消处理
+                        await self._discard(b, t.result())
+                if winner is not None:
+                    b = winner[0]
+                    b.wins += 1
+                    if b is hedge_target:
+                        self.hedge_wins += 1
+                        observe_router(b.provider, b.model, "hedge_win")
+                    return winner
+                if not pending:
+                    nxt = self._pick(tried)
+                    if nxt is None:
+                        break
+                    self.failovers += 1
+                    observe_router(nxt.provider, nxt.model, "failover")
+                    start(nxt)
+                    # 切换后的请求重新计时，仍可按它自己的分位耗时对冲
+                    primary, t_start, hedged = nxt, time.perf_counter(), False
+        finally:
+            # 落败的尝试：取消；取消前后恰好已拿到结果的（wait_for 可能吞掉取消）也要关掉流、归还名额
+            for t, b in pending.items():
+                t.cancel()
+                t.add_done_callback(lambda t, b=b: self._reap(t, b))
+        self._no_backend(last_exc)
+
+    def _reap(self, t: asyncio.Future, b: Backend):
+        if not t.cancelled() and t.exception() is None:
+            asyncio.ensure_future(self._discard(b, t.result()))
+
+    async def _discard(self, b: Backend, result):
+        if isinstance(result, tuple):  # 流式：关闭生成器并归还名额
+            await result[0].aclose()
+            b.release()
+            b.breaker.on_cancel()
+
+    async def achat(self, messages: List[Message], **kwargs) -> str:
+        self._begin()
+        _, answer = await self._race(lambda b: self._achat_once(b, messages, kwargs), lambda b: b.latency)
+        return answer
+
+    async def astream(self, messages: List[Message], **kwargs) -> AsyncIterator[str]:
+        self._begin()
+        b, (agen, first) = await self._race(lambda b: self._open_stream(b, messages, kwargs), lambda b: b.ttft)
+        finished = False
+        try:
+            if first:
+                yield first
+            async for piece in agen:
+                yield piece
+            finished = True
+        except Exception:
+            b.failure()
+            raise
+        finally:
+            await agen.aclose()
+            b.release()
+            if finished:
+                b.breaker.on_success()
+            else:
+                b.breaker.on_cancel()
+
+    # ---- 同步接口：顺序切换 ----
+    def _sync_order(self) -> List[Backend]:
+        return [b for b in self.backends if b.breaker.ready()]
+
+    def chat(self, messages: List[Message], **kwargs) -> str:
+        self._begin()
+        last_exc = None
+        for b in self._sync_order():
+            b.breaker.on_start()
+            try:
+                answer = b.llm.chat(messages, **kwargs)
+            except Exception as e:
+                b.failure()
+                last_exc = e
+                continue
+            b.breaker.on_success()
+            return answer
+        self._no_backend(last_exc)
+
+    def stream(self, messages: List[Message], **kwargs) -> Iterator[str]:
+        self._begin()
+        last_exc = None
+        for b in self._sync_order():
+            b.breaker.on_start()
+            it = b.llm.stream(messages, **kwargs)
+            try:
+                first = next(it, "")
+            except Exception as e:
+                b.failure()
+                last_exc = e
+                continue
+            try:
+                if first:
+                    yield first
+                yield from it
+            except Exception:
+                b.failure()
+                raise
+            b.breaker.on_success()
+            return
+        self._no_backend(last_exc)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+            "hedge_tokens": round(self.hedge_tokens, 2),
+            "failovers": self.failovers,
+            "providers": {b.name: b.stats() for b in self.backends},
+        }
+
+def make_router(primary: str, model: str, fallbacks: str, llm_kwargs: Optional[dict] = None,
+                timeout: float = 60.0, max_concurrency: int = 32, **router_kwargs) -> ChatLLM:
+    """
+    主 provider + fallbacks（'provider[:model],...'）组成路由；fallbacks 为空时直接返回单个 provider
+    llm_kwargs（temperature / max_tokens）对所有 provider 生效；
+    路由模式下关闭 openai 客户端自带的重试，由路由负责切换，避免重试退避拖长尾延迟
+    """
+    llm_kwargs = llm_kwargs or {}
+    client = dict(timeout=timeout, max_connections=max_concurrency)
+    specs = parse_providers(fallbacks)
+    if not specs:
+        return make_llm(primary, model=model, **llm_kwargs, **client)
+    llms = [make_llm(primary, model=model, max_retries=0, **llm_kwargs, **client)]
+    for provider, m in specs:
+        llms.append(make_llm(provider, **({"model": m} if m else {}), max_retries=0, **llm_kwargs, **client))
+    return ChatRouter(llms, timeout=timeout, max_concurrency=max_concurrency, **router_kwargs)
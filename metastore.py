@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+chunk 元数据的紧凑只读存储（替代常驻内存的 METAS 列表）
+- meta.bin     ：逐条紧凑 JSON（utf-8）首尾相接
+- meta.idx.npy ：uint64 偏移数组，第 i 条记录为 meta.bin[off[i]:off[i+1]]
+两者都以只读 mmap 打开：启动不解析任何记录，多个 uvicorn worker 通过系统页缓存共享同一份数据，
+只有 retrieve() 实际返回的行才会被读取和反序列化
+更早的索引目录只有 meta.jsonl：open_meta_store 回退为一次性读入内存的 ListMetaStore，接口相同
+"""
+import json, mmap, os
+import numpy as np
+
+META_BIN = "meta.bin"
+META_IDX = "meta.idx.npy"
+META_JSONL = "meta.jsonl"
+
+def write_meta_store(index_dir, metas, suffix=""):
+    """写出 meta.bin / meta.idx.npy（文件名追加 suffix，便于先写 .tmp 再原子替换）"""
+    offsets = np.zeros(len(metas) + 1, dtype=np.uint64)
+    pos = 0
+    with open(os.path.join(index_dir, META_BIN + suffix), "wb") as f:
+        for i, m in enumerate(metas):
+            b = json.dumps(m, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            f.write(b)
+            pos += len(b)
+            offsets[i + 1] = pos
+    with open(os.path.join(index_dir, META_IDX + suffix), "wb") as f:
+        np.save(f, offsets)
+
+class MetaStore:
+    """按行号随机读取 chunk 元数据，接口与 list[dict] 的只读部分一致"""
+    def __init__(self, index_dir):
+        bin_path = os.path.join(index_dir, META_BIN)
+        idx_path = os.path.join(index_dir, META_IDX)
+        if not os.path.exists(bin_path) or not os.path.exists(idx_path):
+            raise FileNotFoundError(f"{index_dir} 下缺少 {META_BIN}/{META_IDX}，请重新运行 tools/build_index.py")
+        self.offsets = np.load(idx_path, mmap_mode="r")
+        with open(bin_path, "rb") as f:
+            # 空文件无法 mmap（corpus 为空时）
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i) -> dict:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return json.loads(self.buf[int(self.offsets[i]):int(self.offsets[i + 1])])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_many(self, ids) -> list[dict]:
+        return [self[i] for i in ids]
+
+class ListMetaStore(list):
+    """旧索引（只有 meta.jsonl）的回退：整份读入内存"""
+    def get_many(self, ids) -> list[dict]:
+        # 与 MetaStore 一样每次返回新 dict：调用方会写入 score，共享的记录会被并发请求互相覆盖
+        return [dict(self[int(i)]) for i in ids]
+
+def open_meta_store(index_dir):
+    """优先 mmap 的 meta.bin；没有时回退读 meta.jsonl；两者都没有时报错提示重建"""
+    if os.path.exists(os.path.join(index_dir, META_BIN)) and os.path.exists(os.path.join(index_dir, META_IDX)):
+        return MetaStore(index_dir)
+    jsonl = os.path.join(index_dir, META_JSONL)
+    if os.path.exists(jsonl):
+        with open(jsonl, encoding="utf-8") as f:
+            return ListMetaStore(json.loads(line) for line in f if line.strip())
+    raise FileNotFoundError(f"{index_dir} 下既没有 {META_BIN}/{META_IDX} 也没有 {META_JSONL}，请重新运行 tools/build_index.py")
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+分阶段耗时与 LLM 用量的 Prometheus 指标（/metrics 以文本格式导出，不依赖 prometheus_client）
+- Spans：一次请求或一批检索的分阶段计时，每段同时写入 rag_stage_seconds 直方图
+- observe_llm：ChatLLM 每次调用的总耗时、首 token 延迟与 token 数；observe_router：多 provider 路由的对冲/切换/熔断事件
+- configure(enabled=False) 后 span() 返回共享的空上下文，observe 直接返回，开销只剩一次属性判断
+"""
+import bisect, os, threading, time
+from typing import Dict, Optional, Sequence, Tuple
+
+# 覆盖 1 ms 到 60 s：检索各阶段在毫秒级，LLM 调用在秒级
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+ENABLED = True
+
+def configure(enabled: bool):
+    global ENABLED
+    ENABLED = enabled
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    parts = [f'{n}="{esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [各桶计数..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for labels, s in sorted(series.items()):
+            acc = 0
+            for b, c in zip(self.buckets, s):
+                acc += c
+                le = f'le="{b}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {acc}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {s[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {s[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {s[-1]}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, v in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {v}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        m = Histogram(*args, **kwargs)
+        self.metrics.append(m)
+        return m
+
+    def counter(self, *args, **kwargs) -> Counter:
+        m = Counter(*args, **kwargs)
+        self.metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        return "\n".join(line for m in self.metrics for line in m.render()) + "\n"
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("rag_stage_seconds", "各处理阶段耗时（秒）", ("stage",))
+REQUEST_SECONDS = REGISTRY.histogram("rag_request_seconds", "接口端到端耗时（秒）", ("endpoint",))
+LLM_SECONDS = REGISTRY.histogram("rag_llm_seconds", "LLM 调用总耗时（秒）", ("provider", "model", "mode"))
+LLM_TTFT_SECONDS = REGISTRY.histogram("rag_llm_first_token_seconds", "流式调用首 token 延迟（秒）",
+                                      ("provider", "model"))
+LLM_TOKENS = REGISTRY.counter("rag_llm_tokens_total", "LLM token 用量", ("provider", "model", "kind"))
+LLM_ERRORS = REGISTRY.counter("rag_llm_errors_total", "LLM 调用失败次数", ("provider", "model"))
+LLM_ROUTER_EVENTS = REGISTRY.counter("rag_llm_router_events_total",
+                                     "LLM 路由事件（hedge / hedge_win / failover / breaker_open）",
+                                     ("provider", "model", "event"))
+PROMPT_TOKENS = REGISTRY.counter("rag_context_tokens_total", "prompt 上下文 token 估算（naive=逐条拼接，packed=实际发送）",
+                                 ("kind",))
+
+class _Span:
+    __slots__ = ("spans", "stage", "t0")
+
+    def __init__(self, spans, stage):
+        self.spans = spans
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.spans.record(self.stage, time.perf_counter() - self.t0)
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class Spans:
+    """分阶段计时；同名阶段多次出现时累加。timings 为 {阶段: 秒}，禁用时保持为空"""
+    __slots__ = ("enabled", "timings")
+
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = ENABLED if enabled is None else enabled
+        self.timings: Dict[str, float] = {}
+
+    def span(self, stage: str):
+        return _Span(self, stage) if self.enabled else NULL_SPAN
+
+    def record(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage)
+
+    def rounded(self, ndigits: int = 4) -> Dict[str, float]:
+        return {k: round(v, ndigits) for k, v in self.timings.items()}
+
+def observe_request(endpoint: str, seconds: float):
+    if ENABLED:
+        REQUEST_SECONDS.observe(seconds, endpoint)
+
+def observe_llm(provider: str, model: str, mode: str, seconds: float,
+                first_token: Optional[float] = None, usage=None, error: bool = False):
+    """usage 为 OpenAI 格式的 usage 对象（prompt_tokens / completion_tokens），没有时不计 token"""
+    if not ENABLED:
+        return
+    if error:
+        LLM_ERRORS.inc(1, provider, model)
+        return
+    LLM_SECONDS.observe(seconds, provider, model, mode)
+    if first_token is not None:
+        LLM_TTFT_SECONDS.observe(first_token, provider, model)
+    if usage is not None:
+        LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, provider, model, "prompt")
+        LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, provider, model, "completion")
+
+def observe_router(provider: str, model: str, event: str):
+    if ENABLED:
+        LLM_ROUTER_EVENTS.inc(1, provider, model, event)
+
+def observe_prompt(naive: int, packed: int):
+    if ENABLED:
+        PROMPT_TOKENS.inc(naive, "naive")
+        PROMPT_TOKENS.inc(packed, "packed")
+
+def process_memory() -> Dict[str, float]:
+    """
+    当前进程内存（MB），读 /proc/self/smaps_rollup：
+    rss 含与其他 worker 共享的文件映射页（mmap 的索引/向量）；pss 把共享页按进程数均摊，各 worker 的 pss 之和即真实占用；
+    anon 为进程私有的匿名内存。非 Linux 只给出 rss 峰值
+    """
+    fields = {"Rss": "rss_mb", "Pss": "pss_mb", "Anonymous": "anon_mb", "Shared_Clean": "shared_mb"}
+    out: Dict[str, float] = {"pid": os.getpid()}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in fields:
+                    out[fields[key]] = round(int(rest.split()[0]) / 1024, 1)
+        return out
+    except OSError:
+        pass
+    try:
+        import resource, sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        out["max_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    return out
+
+def render() -> str:
+    return REGISTRY.render()
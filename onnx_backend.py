@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+CPU 推理后端：ONNX Runtime + 动态 int8 量化（Settings.inference_backend = "onnx" 时启用）
+- tools/export_onnx.py 把嵌入模型与重排模型导出到 onnx_dir/embed、onnx_dir/rerank：
+  model.onnx（池化已并入计算图）+ 分词器文件 + backend.json（源模型名、池化方式、维度、最大长度）
+- OnnxEncoder.encode / OnnxReranker.compute_score 的用法与 SentenceTransformer / FlagReranker 一致，
+  use.py 的检索逻辑不需要区分后端
+- onnxruntime 为可选依赖，只在选用该后端时导入；不依赖 torch
+"""
+import json, os
+import numpy as np
+
+EMBED_SUBDIR = "embed"
+RERANK_SUBDIR = "rerank"
+MODEL_FILE = "model.onnx"
+CONFIG_FILE = "backend.json"
+
+def make_session(path, threads=0):
+    import onnxruntime as ort
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads > 0:
+        opts.intra_op_num_threads = threads
+    return ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+
+class _OnnxModel:
+    def __init__(self, model_dir, threads=0, expected_model=None):
+        from transformers import AutoTokenizer
+        with open(os.path.join(model_dir, CONFIG_FILE), encoding="utf-8") as f:
+            self.config = json.load(f)
+        # 导出的模型与 Settings 里配置的不一致时，向量空间/打分都对不上，宁可启动失败
+        if expected_model and self.config["model"] != expected_model:
+            raise RuntimeError(f"{model_dir} 导出自 {self.config['model']}，与配置的 {expected_model} 不一致，"
+                               f"请重新运行 tools/export_onnx.py")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = make_session(os.path.join(model_dir, MODEL_FILE), threads)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = self.config.get("max_length", 512)
+
+    def _run(self, *texts) -> np.ndarray:
+        enc = self.tokenizer(*texts, padding=True, truncation=True,
+                             max_length=self.max_length, return_tensors="np")
+        feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+        return self.session.run(None, feeds)[0]
+
+class OnnxEncoder(_OnnxModel):
+    def get_sentence_embedding_dimension(self):
+        return self.config["dim"]
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        out = np.empty((len(sentences), self.config["dim"]), dtype=np.float32)
+        # 与 SentenceTransformer 一样按长度降序分批，减少 padding
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        for s in range(0, len(order), batch_size):
+            rows = order[s:s + batch_size]
+            out[rows] = self._run([sentences[i] for i in rows])
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out[0] if single else out
+
+class OnnxReranker(_OnnxModel):
+    def compute_score(self, sentence_pairs, batch_size=32, **kwargs):
+        """返回原始 logit；与 FlagReranker 相同，只有一对时返回单个 float"""
+        if sentence_pairs and isinstance(sentence_pairs[0], str):
+            sentence_pairs = [sentence_pairs]
+        scores = np.empty(len(sentence_pairs), dtype=np.float32)
+        order = np.argsort([-len(q) - len(p) for q, p in sentence_pairs], kind="stable")
+        for s in range(0, len(order), batch_size):
+            rows = order[s:s + batch_size]
+            scores[rows] = self._run([sentence_pairs[i][0] for i in rows],
+                                     [sentence_pairs[i][1] for i in rows]).reshape(-1)
+        return float(scores[0]) if len(scores) == 1 else scores.tolist()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+按 token 预算拼装 prompt 上下文
+- 同一篇通知（doc_id）的 chunk 归为一组，按 #pN 排序；相邻 chunk 去掉 chunking 产生的重叠后首尾拼接，
+  不相邻的片段之间用省略号隔开
+- 按检索分数从高到低逐条纳入，每条只计算它带来的增量 token（重叠部分、同组标题不重复计），超出预算即跳过
+- 输出按组内最高分排序的段落，供 build_prompt 编号；同时给出拼装前后的 token 估算
+token 数是估算值：CJK 字符按 1 个计，其余非空白字符按 4 个折 1 个，与常见中文模型的分词器量级一致
+"""
+import re
+from typing import Dict, List, Tuple
+
+_CJK = re.compile(r"[　-〿㐀-鿿＀-￯]")
+_CHUNK_NO = re.compile(r"#p(\d+)$")
+GAP = "……"
+
+def estimate_tokens(text: str) -> int:
+    cjk = len(_CJK.findall(text))
+    other = len(text) - cjk - text.count(" ") - text.count("\n")
+    return cjk + (max(other, 0) + 3) // 4
+
+def chunk_no(d: dict) -> int:
+    m = _CHUNK_NO.search(d.get("id", ""))
+    return int(m.group(1)) if m else -1
+
+def overlap_len(prev: str, nxt: str, max_len: int = 120, min_len: int = 8) -> int:
+    """prev 的后缀与 nxt 的前缀最长重合的长度；短于 min_len 视为巧合，不算重叠"""
+    for k in range(min(len(prev), len(nxt), max_len), min_len - 1, -1):
+        if prev.endswith(nxt[:k]):
+            return k
+    return 0
+
+def header(d: dict) -> str:
+    return f"{d['titles'][0]}（{d.get('publish_date') or '未知日期'}）"
+
+def merge_group(chunks: List[dict]) -> str:
+    """同一 doc_id 的 chunk（已按 #pN 排序）合成一段正文"""
+    parts, prev = [], None
+    for d in chunks:
+        text = d["text"]
+        if prev is not None:
+            if chunk_no(d) == chunk_no(prev) + 1:
+                k = overlap_len(prev["text"], text)
+                parts.append(text[k:] if k else "\n" + text)
+            else:
+                parts.append(GAP + text)
+        else:
+            parts.append(text)
+        prev = d
+    return "".join(parts)
+
+def naive_tokens(docs: List[dict]) -> int:
+    """逐条原样拼接（旧 build_prompt）时的 token 估算"""
+    return sum(estimate_tokens(header(d)) + estimate_tokens(d["text"]) for d in docs)
+
+def _groups(selected: List[dict]) -> Dict[str, List[dict]]:
+    groups: Dict[str, List[dict]] = {}
+    for d in selected:
+        groups.setdefault(d.get("doc_id") or d["id"], []).append(d)
+    for chunks in groups.values():
+        chunks.sort(key=chunk_no)
+    return groups
+
+def _group_tokens(chunks: List[dict]) -> int:
+    return estimate_tokens(header(chunks[0])) + estimate_tokens(merge_group(chunks))
+
+def pack_context(docs: List[dict], budget: int) -> Tuple[List[dict], dict]:
+    """
+    docs：检索结果（带 score，缺省按列表顺序视为降序）
+    返回 (段落列表, 统计)；段落为 {doc_id, title, publish_date, source_url, text, chunk_ids, score}
+    预算不足以放下任何一条时至少保留分数最高的一条，避免上下文为空
+    """
+    order = sorted(range(len(docs)), key=lambda i: (-docs[i].get("score", -i), i))
+    selected: List[dict] = []
+    cost: Dict[str, int] = {}  # doc_id -> 该组当前 token
+    used = 0
+    for i in order:
+        d = docs[i]
+        key = d.get("doc_id") or d["id"]
+        chunks = sorted([c for c in selected if (c.get("doc_id") or c["id"]) == key] + [d], key=chunk_no)
+        delta = _group_tokens(chunks) - cost.get(key, 0)
+        if used + delta > budget and selected:
+            continue
+        selected.append(d)
+        cost[key] = cost.get(key, 0) + delta
+        used += delta
+
+    sections = []
+    for key, chunks in _groups(selected).items():
+        first = chunks[0]
+        sections.append({
+            "doc_id": key,
+            "title": first["titles"][0],
+            "publish_date": first.get("publish_date"),
+            "source_url": first.get("source_url"),
+            "text": merge_group(chunks),
+            "chunk_ids": [c["id"] for c in chunks],
+            "score": max(c.get("score", 0.0) for c in chunks),
+        })
+    sections.sort(key=lambda s: -s["score"])
+    naive = naive_tokens(docs)
+    picked = {id(d) for d in selected}
+    stats = {
+        "chunks_in": len(docs),
+        "chunks_used": len(selected),
+        "sections": len(sections),
+        "tokens_naive": naive,
+        "tokens_packed": used,
+        "tokens_saved": naive - used,
+        # 其中因超出预算被丢弃的 chunk 占多少；其余为去重叠、合并标题省下的
+        "tokens_dropped": naive_tokens([d for d in docs if id(d) not in picked]),
+    }
+    return sections, stats
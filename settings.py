@@ -6,16 +6,68 @@ class Settings(BaseSettings):
     index_dir: str = "dataset/index"
     topk_faiss: int = 24
     topk_final: int = 8
+    # ANN 索引类型（faiss.index_factory 描述串）：Flat / HNSW32 / IVF1024,Flat / IVF1024,PQ32
+    index_spec: str = "Flat"
+    index_train_size: int = 50000  # IVF/PQ 训练采样条数
+    index_nprobe: int = 16  # IVF 检索时探查的簇数
+    index_ef_search: int = 64  # HNSW 检索时的候选队列长度
+    index_vector_dtype: str = "float32"  # build_index 的向量存储精度：float32 / float16（SQfp16）/ int8（SQ8）
+    index_mmap: bool = True  # 只读 mmap 打开 faiss 索引，多 worker 共享 page cache；不支持时自动回退为读入内存
+    index_watch_seconds: float = 0  # 轮询 CURRENT 的间隔秒数，发现新版本即热更新；0 表示只靠 /admin/reload
+    admin_token: str | None = None  # /admin/* 接口的 X-Admin-Token；为 None 时不校验
+    # 混合检索：BM25（字二元组倒排）+ 向量，RRF 融合
+    hybrid_enabled: bool = True
+    topk_bm25: int = 24
+    rrf_k: int = 60
+    topk_candidates: int = 16  # 融合后送入重排/重打分的候选数
+    filter_exact_max: int = 4096  # 元数据过滤后剩余行数不超过该值（且不超过全库 10%）时直接精确打分，不走 ANN
+    # 上下文拼装：同一通知的相邻 chunk 去重叠合并，按分数填充 token 预算（估算值）
+    context_packing: bool = True
+    context_token_budget: int = 3000
 
     # 嵌入/重排
     embed_model: str = "BAAI/bge-small-zh-v1.5"
     rerank_model: str | None = None  # 可选的重排模型，设为 None 禁用
+    # 推理后端：torch（默认）/ onnx（tools/export_onnx.py 导出的 int8 量化模型，需安装 onnxruntime）
+    inference_backend: str = "torch"
+    onnx_dir: str = "dataset/onnx"
+    onnx_threads: int = 0  # 每个 ONNX 会话的线程数，0 表示由 onnxruntime 决定
 
     # LLM
-    llm_provider: str = "deepseek"  # openai/deepseek/qwen/zhipu
+    llm_provider: str = "deepseek"  # openai/deepseek/qwen/zhipu/stub（本地压测用，见 tools/stub_llm.py）
     llm_model: str = "deepseek-chat"
     llm_temperature: float = 0.7
     llm_max_tokens: int = 2048
+    llm_timeout: float = 60.0  # 单次调用超时秒数（流式为等到首 token 的超时）
+    llm_max_concurrency: int = 32  # 每个 provider 的在途请求上限，也是其长连接池大小
+    # 多 provider 路由（llm_fallbacks 非空时启用，见 llm_router.py）：慢于 p95 时对冲，失败切换，连续失败熔断
+    llm_fallbacks: str = ""  # 备用 provider，逗号分隔的 provider[:model]，如 "qwen:qwen-plus,zhipu:glm-4"
+    llm_hedge_quantile: float = 0.95  # 超过主 provider 该分位耗时仍未返回即对冲；0 表示不对冲
+    llm_hedge_budget: float = 0.05  # 对冲请求量占总请求量的比例上限
+    llm_breaker_failures: int = 5  # 连续失败多少次熔断
+    llm_breaker_cooldown: float = 30.0  # 熔断持续秒数，之后放一个试探请求
+
+    # 回答缓存
+    cache_enabled: bool = True
+    cache_max_entries: int = 1024  # LRU 容量
+    cache_ttl: float = 86400  # 条目存活秒数
+    cache_similarity: float = 0.95  # 语义命中的余弦相似度阈值
+
+    # 并发
+    retrieve_workers: int = 4  # 检索（编码/FAISS/重排）线程池大小
+    max_concurrent_requests: int = 64  # 单 worker 同时处理的 /ask /chat 请求上限
+    queue_timeout: float = 10.0  # 排队等待名额的最长秒数，超时返回 503
+    batch_max_size: int = 16  # 检索微批：单批最多查询数
+    batch_max_wait_ms: float = 5.0  # 检索微批：首条查询到达后最多等待凑批的毫秒数
+    batch_api_max_queries: int = 1000  # /ask/batch、/chat/batch 单次最多问题数
+    batch_api_chunk: int = 128  # 批量接口每次送进 retrieve_batch 的问题数（一次编码/检索/重排）
+    batch_llm_concurrency: int = 8  # /chat/batch 同时在途的 LLM 调用数
+
+    # 启动
+    warmup_queries: int = 8  # 就绪前用多少条合成问题预热检索链路，0 表示不预热
+
+    # 指标
+    metrics_enabled: bool = True  # 分阶段计时与 /metrics；关闭后计时点退化为空操作
 
     class Config:
         env_file = ".env"  # 可用 .env 覆盖
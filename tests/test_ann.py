@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import pathlib, sys
+import numpy as np, pytest
+
+faiss = pytest.importorskip("faiss")
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from ann import can_update, fit_spec, make_index, update_index
+
+def vectors(n, d=16, seed=0):
+    X = np.random.default_rng(seed).standard_normal((n, d)).astype("float32")
+    faiss.normalize_L2(X)
+    return X
+
+def test_fit_spec_clamps_nlist_to_corpus():
+    assert fit_spec("IVF1024,Flat", 39 * 10) == "IVF10,Flat"
+    assert fit_spec("HNSW32", 10) == "HNSW32"
+    with pytest.raises(ValueError):
+        fit_spec("IVF4,PQ8", 100)  # PQ 默认 8 bit，至少 256 条
+
+def test_only_ivf_supports_in_place_update():
+    X = vectors(400)
+    assert can_update(make_index("IVF4,Flat", X))
+    assert not can_update(make_index("Flat", X))
+    assert not can_update(make_index("HNSW8", X))
+
+def test_update_index_replaces_stale_rows():
+    X = vectors(400)
+    index = make_index("IVF4,Flat", X)
+    index.nprobe = 4
+    Y = X.copy()
+    Y[[5, 17]] = vectors(2, seed=1)  # 这两行换成新内容
+    update_index(index, Y, stale_ids=[5, 17, 399], new_ids=[5, 17])
+    assert index.ntotal == 399
+    _, I = index.search(Y[:399], 1)
+    assert (I[:, 0] == np.arange(399)).all()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import asyncio, pathlib, sys
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from batching import MicroBatcher
+
+def double(items):
+    if "bad" in items:
+        raise ValueError("bad item")
+    return [x * 2 for x in items]
+
+async def submit_all(batcher, items):
+    return await asyncio.gather(*(batcher.submit(x) for x in items), return_exceptions=True)
+
+def test_results_follow_input_order():
+    batcher = MicroBatcher(double, max_batch_size=8, max_wait_ms=20)
+    assert asyncio.run(submit_all(batcher, [1, 2, 3])) == [2, 4, 6]
+    assert batcher.batches == 1
+
+def test_failing_item_does_not_fail_its_batch():
+    batcher = MicroBatcher(double, max_batch_size=8, max_wait_ms=20)
+    results = asyncio.run(submit_all(batcher, [1, "bad", 3]))
+    assert results[0] == 2 and results[2] == 6
+    assert isinstance(results[1], ValueError)
+    assert batcher.stats()["split_retries"] == 1
+
+def test_single_item_error_propagates():
+    batcher = MicroBatcher(double, max_batch_size=8, max_wait_ms=0)
+    with pytest.raises(ValueError):
+        asyncio.run(batcher.submit("bad"))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import pathlib, sys
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from cache import AnswerCache
+
+VEC = np.array([1.0, 0.0], dtype="float32")
+
+def test_exact_and_semantic_hits_within_version():
+    cache = AnswerCache()
+    cache.set_version("v1")
+    cache.put("期末考试安排？", VEC, {"answer": "a"}, 1.0, "v1")
+    assert cache.get_exact("期末考试 安排", "v1") == {"answer": "a"}
+    assert cache.get_similar(VEC, "v1") == {"answer": "a"}
+
+def test_stale_version_neither_clears_nor_writes():
+    cache = AnswerCache()
+    cache.set_version("v2")
+    cache.put("q", VEC, {"answer": "new"}, 1.0, "v2")
+    # 热更新前已在处理的请求带着旧版本号
+    assert cache.get_exact("q", "v1") is None
+    assert cache.get_similar(VEC, "v1") is None
+    cache.put("q", VEC, {"answer": "old"}, 1.0, "v1")
+    assert cache.version == "v2"
+    assert cache.get_exact("q", "v2") == {"answer": "new"}
+
+def test_set_version_clears_entries():
+    cache = AnswerCache()
+    cache.put("q", VEC, {"answer": "a"}, 1.0, "v1")  # 未设置版本时以第一次使用的版本为准
+    assert cache.version == "v1"
+    cache.set_version("v2")
+    assert cache.get_exact("q", "v2") is None
+    assert cache.stats()["entries"] == 0
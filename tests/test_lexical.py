@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import pathlib, sys
+import numpy as np, pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from lexical import BM25Index, build_bm25, rrf_fuse, tokenize
+
+TEXTS = [
+    "关于2025年春季学期补考安排的通知",
+    "补考申请表下载及填写说明",
+    "期末考试考场规则",
+    "课程 CS031 数据结构补考时间调整",
+    "选课系统开放时间通知",
+]
+
+def bm25(tmp_path):
+    build_bm25(TEXTS, str(tmp_path))
+    return BM25Index.load(str(tmp_path))
+
+def test_tokenize_keeps_course_code_whole():
+    assert "cs031" in tokenize("CS031 补考")
+    assert "补考" in tokenize("CS031 补考")
+
+def test_bm25_ranks_exact_code_match_first(tmp_path):
+    ids, scores = bm25(tmp_path).search("CS031 补考", k=3)
+    assert ids[0] == 3
+    assert np.all(np.diff(scores) <= 0)
+
+def test_rrf_returns_scores_in_descending_order():
+    ids, scores = rrf_fuse([[0, 1, 2], [2, 3]], k=60)
+    assert list(ids) == [2, 0, 1, 3]
+    assert scores[0] == pytest.approx(1 / 63 + 1 / 61)
+    assert np.all(np.diff(scores) <= 0)
+
+def test_lexical_only_match_reaches_final_topk(tmp_path):
+    # 向量检索没召回课程代码那一条；融合后按 RRF 顺序截断，BM25 的第一名仍在最终 top-2 里
+    dense = [0, 1, 2, 4]
+    lexical = bm25(tmp_path).search("CS031 数据结构", k=4)[0]
+    assert 3 not in dense and list(lexical) == [3]
+    ids, _ = rrf_fuse([dense, lexical], k=60, limit=4)
+    assert 3 in ids[:2]
+
+def test_lexical_top_hit_outranks_lower_dense_hits():
+    # 向量第 4、BM25 第 1 的结果应排在只被向量排到前几名的结果前面
+    ids, _ = rrf_fuse([[10, 11, 12, 31], [31]], k=60, limit=4)
+    assert list(ids[:2]) == [31, 10]
+
+def test_rrf_limit_and_empty():
+    ids, scores = rrf_fuse([[], []], k=60, limit=4)
+    assert len(ids) == 0 and len(scores) == 0
+    assert len(rrf_fuse([[1, 2, 3]], limit=2)[0]) == 2
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import pathlib, sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from packing import GAP, estimate_tokens, merge_group, overlap_len, pack_context
+
+def chunk(doc_id, n, text, score=None, title="期末考试安排通知"):
+    d = {"id": f"{doc_id}#p{n}", "doc_id": doc_id, "titles": [title], "text": text, "publish_date": "2025-06-01"}
+    if score is not None:
+        d["score"] = score
+    return d
+
+HEAD = "第一部分内容：考试时间安排如下，请各学院通知到每位学生。"
+TAIL = "请各学院通知到每位学生。第二部分内容：考场规则与注意事项。"
+SHARED = "请各学院通知到每位学生。"
+
+def test_overlap_len_finds_shared_suffix_prefix():
+    assert overlap_len(HEAD, TAIL) == len(SHARED)
+
+def test_overlap_len_ignores_short_coincidence():
+    assert overlap_len("abcdefgXYZ", "XYZhijklmn") == 0  # 3 个字符 < min_len
+    assert overlap_len("abc", "") == 0
+
+def test_merge_group_strips_overlap_between_adjacent_chunks():
+    merged = merge_group([chunk("d1", 0, HEAD), chunk("d1", 1, TAIL)])
+    assert merged == HEAD + TAIL[len(SHARED):]
+    assert merged.count(SHARED) == 1
+
+def test_merge_group_adjacent_without_overlap_joins_with_newline():
+    merged = merge_group([chunk("d1", 0, "甲" * 20), chunk("d1", 1, "乙" * 20)])
+    assert merged == "甲" * 20 + "\n" + "乙" * 20
+
+def test_merge_group_non_adjacent_chunks_use_gap():
+    merged = merge_group([chunk("d1", 0, HEAD), chunk("d1", 2, TAIL)])
+    assert merged == HEAD + GAP + TAIL
+
+def test_pack_context_merges_same_doc_into_one_section():
+    docs = [chunk("d1", 1, TAIL, score=0.9), chunk("d1", 0, HEAD, score=0.8)]
+    sections, stats = pack_context(docs, budget=10000)
+    assert len(sections) == 1
+    assert sections[0]["text"] == HEAD + TAIL[len(SHARED):]
+    assert sections[0]["chunk_ids"] == ["d1#p0", "d1#p1"]
+    assert sections[0]["score"] == 0.9
+    assert stats["tokens_saved"] > 0
+    assert stats["tokens_dropped"] == 0
+
+def test_pack_context_stops_at_budget_in_score_order():
+    docs = [chunk(f"d{i}", 0, "字" * 100, score=s, title=f"通知{i}") for i, s in enumerate([0.5, 0.9, 0.7])]
+    per_doc = estimate_tokens("通知0（2025-06-01）") + 100
+    sections, stats = pack_context(docs, budget=2 * per_doc)
+    assert [s["doc_id"] for s in sections] == ["d1", "d2"]
+    assert stats["chunks_used"] == 2
+    assert stats["tokens_packed"] == 2 * per_doc
+    assert stats["tokens_dropped"] == per_doc
+
+def test_pack_context_keeps_top_chunk_over_budget():
+    docs = [chunk("d1", 0, "字" * 500, score=0.9), chunk("d2", 0, "词" * 10, score=0.1)]
+    sections, stats = pack_context(docs, budget=50)
+    assert [s["doc_id"] for s in sections] == ["d1"]
+    assert stats["chunks_used"] == 1
+    assert stats["tokens_packed"] > 50
+
+def test_pack_context_empty_input():
+    sections, stats = pack_context([], budget=100)
+    assert sections == []
+    assert stats == {"chunks_in": 0, "chunks_used": 0, "sections": 0, "tokens_naive": 0,
+                     "tokens_packed": 0, "tokens_saved": 0, "tokens_dropped": 0}
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+ANN 索引基准：在真实语料（build_index 生成的 embeddings.npy）上比较不同 index spec
+- recall@k：与 Flat 暴力检索结果的重合率，k 默认取 Settings.topk_faiss
+- 单条查询检索延迟 p50 / p99、构建耗时、索引体积
+用法：
+  python bench_ann.py --specs Flat HNSW32 IVF1024,Flat IVF1024,PQ32
+  python bench_ann.py --specs Flat SQfp16 SQ8 IVF1024,SQ8   # 标量量化存储（build_index --vector-dtype）
+  python bench_ann.py --queries queries.txt   # 用真实问题编码作查询；缺省从语料中采样向量
+"""
+import argparse, sys, pathlib, time
+import numpy as np, faiss
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from settings import Settings
+from ann import make_index, tune_index, recall_at_k, fit_spec
+from index_bundle import resolve_index_dir
+
+def load_query_vectors(args, X, S):
+    if args.queries:
+        from sentence_transformers import SentenceTransformer
+        with open(args.queries, encoding="utf-8") as f:
+            qs = [l.strip() for l in f if l.strip()]
+        model = SentenceTransformer(S.embed_model)
+        return model.encode(qs, normalize_embeddings=True).astype("float32")
+    rows = np.random.default_rng(1).choice(X.shape[0], min(args.num_queries, X.shape[0]), replace=False)
+    return np.ascontiguousarray(X[np.sort(rows)], dtype="float32")
+
+def main():
+    S = Settings()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--index-dir", default="../dataset/index")
+    ap.add_argument("--specs", nargs="+", default=["Flat", "HNSW32", "IVF1024,Flat", "IVF1024,PQ32"])
+    ap.add_argument("--topk", type=int, default=S.topk_faiss)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[S.index_nprobe])
+    ap.add_argument("--ef-search", type=int, nargs="+", default=[S.index_ef_search])
+    ap.add_argument("--train-size", type=int, default=S.index_train_size)
+    ap.add_argument("--queries", default=None, help="每行一个问题；缺省从语料中采样向量作查询")
+    ap.add_argument("--num-queries", type=int, default=1000)
+    args = ap.parse_args()
+
+    X = np.load(pathlib.Path(resolve_index_dir(args.index_dir)[1]) / "embeddings.npy", mmap_mode="r")
+    X = np.ascontiguousarray(X, dtype="float32")
+    Q = load_query_vectors(args, X, S)
+    print(f"语料 {X.shape[0]} 条 × {X.shape[1]} 维；查询 {Q.shape[0]} 条；k={args.topk}")
+
+    flat = faiss.IndexFlatIP(X.shape[1])
+    flat.add(X)
+    _, truth = flat.search(Q, args.topk)
+
+    print(f"{'spec':24s} {'params':20s} {'recall':>7s} {'p50 ms':>8s} {'p99 ms':>8s} {'build s':>8s} {'size MB':>8s}")
+    for requested in args.specs:
+        try:
+            spec = fit_spec(requested, min(args.train_size, X.shape[0]))
+        except ValueError as e:
+            print(f"{requested:24s} 跳过：{e}")
+            continue
+        if spec != requested:
+            print(f"{requested:24s} 语料太小，nlist 下调为 {spec}")
+        t0 = time.perf_counter()
+        index = make_index(spec, X, train_size=args.train_size)
+        build_s = time.perf_counter() - t0
+        size_mb = faiss.serialize_index(index).nbytes / 2**20
+        grid = [(p, e) for p in args.nprobe for e in args.ef_search]
+        if "IVF" not in spec:
+            grid = sorted({(None, e) for _, e in grid})
+        if "HNSW" not in spec:
+            grid = sorted({(p, None) for p, _ in grid}, key=lambda x: x[0] or 0)
+        for nprobe, ef in grid:
+            tune_index(index, nprobe=nprobe, ef_search=ef)
+            _, found = index.search(Q, args.topk)
+            lat = []
+            for q in Q:  # 服务端是逐条查询，按单条计延迟
+                t = time.perf_counter()
+                index.search(q[None, :], args.topk)
+                lat.append((time.perf_counter() - t) * 1000)
+            params = " ".join(f"{k}={v}" for k, v in (("nprobe", nprobe), ("ef", ef)) if v)
+            print(f"{spec:24s} {params or '-':20s} {recall_at_k(truth, found):7.3f} "
+                  f"{np.percentile(lat, 50):8.3f} {np.percentile(lat, 99):8.3f} {build_s:8.1f} {size_mb:8.1f}")
+
+if __name__ == "__main__":
+    main()
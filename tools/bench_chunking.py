@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+切块基准：在合成语料（默认 10 万篇）上比较
+- legacy     ：旧实现（串行，每篇写一个 jsonl，indexer 再 glob 重新打开）
+- serial     ：新实现单进程，输出单个 chunks.jsonl
+- pool       ：新实现进程池
+- unchanged  ：内容未变时的二次运行（全部沿用上次 chunk）
+用法：python bench_chunking.py --docs 100000 --workers 8
+"""
+import argparse, json, os, pathlib, random, sys, tempfile, time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+from chunking import make_chunks, run
+
+SENTS = ["关于做好2025年秋季学期期末考试工作的通知。", "请各学院于第十八周前提交考试安排。",
+         "补考申请需填写《课程补考申请表》并经学院审核；", "选课系统将于9月1日8:00开放！",
+         "学生可登录教务系统查看成绩，如有疑问请在一周内申请复核。", "毕业论文答辩原则上以学院为单位组织。"]
+
+def make_corpus(root, n, seed=0):
+    rnd = random.Random(seed)
+    for i in range(n):
+        d = root / f"HTU_教务处_通知_2025-01-01_{i:07d}"
+        d.mkdir()
+        meta = {"doc_id": d.name, "title": f"通知{i}", "publish_date": "2025-01-01"}
+        (d / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        text = "".join(rnd.choice(SENTS) for _ in range(rnd.randint(10, 80)))
+        (d / "content.md").write_text(text, encoding="utf-8")
+
+def legacy(staging, out):
+    """旧流程：逐篇切块、每篇一个文件，再由 indexer glob 读回"""
+    out.mkdir(exist_ok=True)
+    for docdir in staging.iterdir():
+        meta = json.loads((docdir / "meta.json").read_text(encoding="utf-8"))
+        text = (docdir / "content.md").read_text(encoding="utf-8")
+        with open(out / f"{meta['doc_id']}.jsonl", "w", encoding="utf-8") as f:
+            for item in make_chunks(meta, text):
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    n = 0
+    for file in out.glob("*.jsonl"):
+        with open(file, encoding="utf-8") as f:
+            n += sum(1 for _ in f)
+    return n
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=100_000)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        staging = tmp / "staging"
+        staging.mkdir()
+        t0 = time.perf_counter()
+        make_corpus(staging, args.docs)
+        print(f"合成语料 {args.docs} 篇，用时 {time.perf_counter() - t0:.1f}s")
+
+        results = {}
+        t0 = time.perf_counter()
+        legacy(staging, tmp / "legacy")
+        results["legacy"] = time.perf_counter() - t0
+        for name, out, workers in (("serial", "serial", 0), ("pool", "pool", args.workers),
+                                   ("unchanged", "pool", args.workers)):
+            t0 = time.perf_counter()
+            run(staging, str(tmp / out), workers=workers, progress=False)
+            results[name] = time.perf_counter() - t0
+
+    print(f"\n{'mode':10s} {'seconds':>8s} {'docs/s':>10s}")
+    for name, sec in results.items():
+        print(f"{name:10s} {sec:8.1f} {args.docs / sec:10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+爬虫吞吐基准：本地起一个模拟教务处栏目的 HTTP 服务（带人为延迟），比较串行与并发模式
+- 栏目页 /teaching/3251/list{n}.htm，每页 --per-page 篇文章并带“下一页”
+- 文章页 /teaching/2025/1105/c3251a{id}/page.htm，部分文章带一个 PDF 附件；带 ETag，支持 304
+- 附件 /files/form{0-4}.pdf 被多篇文章共用，支持 HEAD
+用法：python bench_crawl.py --pages 5 --per-page 20 --latency 0.05 --concurrency 8 --rps 50
+"""
+import argparse, pathlib, re, sys, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+from crawl import crawl, crawl_concurrent
+
+PDF_BODY = b"%PDF-1.4 " + b"0" * 200_000
+
+def make_handler(pages, per_page, latency):
+    counter = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body: bytes, ctype="text/html; charset=utf-8", etag=None):
+            if etag and self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            if etag:
+                self.send_header("ETag", etag)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with lock:
+                counter["requests"] += 1
+            time.sleep(latency)
+            path = self.path
+            if path.startswith("/teaching/3251/list"):
+                n = int(path.rsplit("list", 1)[1].split(".")[0] or 1)
+                links = "".join(
+                    f'<li><a href="/teaching/2025/1105/c3251a{n * 1000 + i}/page.htm">通知{n}-{i}</a></li>'
+                    for i in range(per_page))
+                nxt = f'<a href="/teaching/3251/list{n + 1}.htm">下一页</a>' if n < pages else ""
+                self._send(f"<html><body><ul>{links}</ul>{nxt}</body></html>".encode("utf-8"))
+            elif path.endswith("/page.htm"):
+                aid = re.search(r"c\d+a(\d+)/", path).group(1)
+                para = "关于期末考试安排的通知，请各学院按时组织。" * 20
+                attach = f'<a href="/files/form{int(aid) % 5}.pdf">附件</a>' if int(aid) % 3 == 0 else ""
+                self._send(f"<html><head><title>通知{aid}</title></head><body><h1>通知{aid}</h1>"
+                           f"<article><p>{para}</p><p>{para}</p></article>{attach}</body></html>".encode("utf-8"),
+                           etag=f'"a{aid}"')
+            elif path.endswith(".pdf"):
+                self._send(PDF_BODY, "application/pdf", etag=f'"{path}"')
+            else:
+                self.send_error(404)
+
+        def do_HEAD(self):
+            with lock:
+                counter["requests"] += 1
+            if not self.path.endswith(".pdf"):
+                self.send_error(405)
+                return
+            self.send_response(200)
+            self.send_header("ETag", f'"{self.path}"')
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(PDF_BODY)))
+            self.end_headers()
+
+    return Handler, counter
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, default=5)
+    ap.add_argument("--per-page", type=int, default=20)
+    ap.add_argument("--latency", type=float, default=0.05, help="每个请求的服务端延迟（秒）")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--rps", type=float, default=50.0)
+    ap.add_argument("--skip-serial", action="store_true")
+    args = ap.parse_args()
+
+    handler, counter = make_handler(args.pages, args.per_page, args.latency)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    start = f"http://127.0.0.1:{server.server_address[1]}/teaching/3251/list1.htm"
+    n_articles = args.pages * args.per_page
+
+    results = {}
+    runs = [] if args.skip_serial else [("serial", lambda out: crawl(start, out, args.pages, delay=0))]
+    runs.append(("concurrent", lambda out: crawl_concurrent(start, out, args.pages, args.concurrency, args.rps)))
+    for name, run in runs:
+        counter["requests"] = 0
+        with tempfile.TemporaryDirectory() as out:
+            t0 = time.perf_counter()
+            run(out)
+            elapsed = time.perf_counter() - t0
+        results[name] = (elapsed, counter["requests"])
+    server.shutdown()
+
+    print(f"\n栏目页 {args.pages}，文章 {n_articles}，服务端延迟 {args.latency * 1000:.0f} ms")
+    for name, (elapsed, reqs) in results.items():
+        print(f"  {name:10s} {elapsed:7.2f}s  {n_articles / elapsed:7.1f} 篇/s  "
+              f"{reqs} 次请求，{reqs / elapsed:6.1f} req/s")
+
+if __name__ == "__main__":
+    main()
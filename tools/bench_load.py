@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+端到端压测 / 回归基准：按固定并发回放问题文件，请求 /ask、/chat、/chat/stream
+- 每个（接口, 并发）组合跑 --requests 条（或 --duration 秒）；闭环压测：每个并发槽收到响应后立即发下一条
+- 统计 QPS、延迟 p50/p95/p99、首 token 延迟（/chat/stream 第一个 token 事件）、错误分布、回答缓存命中数
+- 结果写 JSON（--out），--baseline 指定上一次的 JSON 时打印逐项对比，便于发现延迟回退
+问题文件：.txt 每行一个问题；.jsonl 每行一个对象，取 q / query / question 字段
+压测时建议 LLM_PROVIDER=stub（先运行 stub_llm.py）且 CACHE_ENABLED=false 启动 use.py，否则重复问题会命中回答缓存
+用法：python bench_load.py --url http://127.0.0.1:8000 --queries q.jsonl --endpoints ask chat chat/stream \
+        --concurrency 1 8 32 --requests 200 --out run.json [--baseline last.json]
+"""
+import argparse, asyncio, itertools, json, pathlib, sys, time
+from collections import Counter
+import httpx
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from evaluation import DEFAULT_QUERIES
+
+def load_queries(path):
+    if not path:
+        return DEFAULT_QUERIES
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                obj = json.loads(line)
+                line = obj.get("q") or obj.get("query") or obj.get("question")
+                if not line:
+                    continue
+            out.append(line)
+    return out
+
+async def one(client, endpoint, q):
+    t0 = time.perf_counter()
+    ttft, cached, status = None, False, None
+    try:
+        if endpoint == "chat/stream":
+            async with client.stream("GET", "/chat/stream", params={"q": q}) as r:
+                status = r.status_code
+                async for line in r.aiter_lines():
+                    if not line.startswith("event: "):
+                        continue
+                    event = line[7:]
+                    if event == "token" and ttft is None:
+                        ttft = time.perf_counter() - t0
+                    elif event == "llm_error":
+                        status = "llm_error"
+        else:
+            r = await client.get(f"/{endpoint}", params={"q": q})
+            status = r.status_code
+            if endpoint == "chat" and status == 200:
+                body = r.json()
+                cached = "cached" in body
+                if "error" in body:
+                    status = "llm_error"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {"latency": time.perf_counter() - t0, "ttft": ttft, "status": status, "cached": cached}
+
+def pct(xs, p):
+    return round(float(np.percentile(xs, p)) * 1000, 2) if xs else None
+
+async def run_level(url, endpoint, queries, concurrency, n_requests, duration, timeout, warmup):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        for q in queries[:warmup]:
+            await one(client, endpoint, q)
+        counter = itertools.count()
+        results = []
+        t0 = time.perf_counter()
+        deadline = t0 + duration if duration else None
+
+        async def worker():
+            while True:
+                i = next(counter)
+                if n_requests and i >= n_requests:
+                    return
+                if deadline and time.perf_counter() >= deadline:
+                    return
+                results.append(await one(client, endpoint, queries[i % len(queries)]))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+
+    ok = [r for r in results if r["status"] == 200]
+    lat = [r["latency"] for r in ok]
+    ttft = [r["ttft"] for r in ok if r["ttft"] is not None]
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": dict(Counter(str(r["status"]) for r in results if r["status"] != 200)),
+        "cached": sum(r["cached"] for r in ok),
+        "seconds": round(elapsed, 3),
+        "qps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {"p50": pct(lat, 50), "p95": pct(lat, 95), "p99": pct(lat, 99),
+                       "mean": round(float(np.mean(lat)) * 1000, 2) if lat else None},
+        "ttft_ms": {"p50": pct(ttft, 50), "p95": pct(ttft, 95), "p99": pct(ttft, 99)} if ttft else None,
+    }
+
+def print_row(r):
+    lat, ttft = r["latency_ms"], r["ttft_ms"] or {}
+    fmt = lambda v: f"{v:8.1f}" if v is not None else f"{'-':>8s}"
+    print(f"{r['endpoint']:12s} {r['concurrency']:4d} {r['ok']:6d}/{r['requests']:<6d} {r['qps']:8.2f} "
+          f"{fmt(lat['p50'])} {fmt(lat['p95'])} {fmt(lat['p99'])} {fmt(ttft.get('p50'))} {fmt(ttft.get('p95'))} "
+          f"{sum(r['errors'].values()):6d} {r['cached']:6d}")
+
+def compare(results, baseline_path):
+    base = {(r["endpoint"], r["concurrency"]): r for r in json.loads(pathlib.Path(baseline_path).read_text("utf-8"))["results"]}
+    print(f"\n对比 {baseline_path}（正值 = 本次更高）")
+    print(f"{'endpoint':12s} {'conc':>4s} {'qps':>9s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'ttft p50':>9s}")
+    delta = lambda new, old: f"{(new - old) / old * 100:+8.1f}%" if new is not None and old else f"{'-':>9s}"
+    for r in results:
+        b = base.get((r["endpoint"], r["concurrency"]))
+        if b is None:
+            continue
+        print(f"{r['endpoint']:12s} {r['concurrency']:4d} {delta(r['qps'], b['qps'])} "
+              f"{delta(r['latency_ms']['p50'], b['latency_ms']['p50'])} "
+              f"{delta(r['latency_ms']['p95'], b['latency_ms']['p95'])} "
+              f"{delta(r['latency_ms']['p99'], b['latency_ms']['p99'])} "
+              f"{delta((r['ttft_ms'] or {}).get('p50'), (b['ttft_ms'] or {}).get('p50'))}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--queries", default=None, help=".txt 或 .jsonl 问题文件；缺省使用内置样例")
+    ap.add_argument("--endpoints", nargs="+", default=["ask", "chat", "chat/stream"],
+                    choices=["ask", "chat", "chat/stream"])
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    ap.add_argument("--requests", type=int, default=200, help="每个组合的请求数（与 --duration 二选一）")
+    ap.add_argument("--duration", type=float, default=0, help="每个组合压测秒数，>0 时忽略 --requests")
+    ap.add_argument("--warmup", type=int, default=3, help="每个组合正式计时前的预热请求数")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--out", default=None, help="结果 JSON 路径")
+    ap.add_argument("--baseline", default=None, help="上一次的结果 JSON，打印对比")
+    args = ap.parse_args()
+
+    queries = load_queries(args.queries)
+    server = None
+    try:
+        server = httpx.get(f"{args.url}/readyz", timeout=10).json()
+    except (httpx.HTTPError, ValueError):
+        pass
+
+    print(f"{'endpoint':12s} {'conc':>4s} {'ok/total':>13s} {'qps':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} "
+          f"{'ttft50':>8s} {'ttft95':>8s} {'errors':>6s} {'cached':>6s}")
+    results = []
+    for endpoint in args.endpoints:
+        for c in args.concurrency:
+            r = asyncio.run(run_level(args.url, endpoint, queries, c, 0 if args.duration else args.requests,
+                                      args.duration, args.timeout, args.warmup))
+            print_row(r)
+            results.append(r)
+
+    if args.out:
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "url": args.url,
+            "queries": args.queries or "builtin",
+            "num_queries": len(queries),
+            "requests_per_level": 0 if args.duration else args.requests,
+            "duration_per_level": args.duration,
+            "server": server,
+            "results": results,
+        }
+        pathlib.Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n结果已写入 {args.out}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+多 worker 内存报告：模拟 uvicorn --workers N，每个子进程各自加载一份 IndexBundle 并跑一轮检索
+- 分别以 mmap（Settings.index_mmap 默认）与普通读取打开 faiss 索引，对比每个 worker 的 rss / pss / anon
+- pss 把共享页按进程数均摊，N 个 worker 的 pss 之和才是整机真实占用；mmap 时索引页只算一份
+- 查询向量从 embeddings.npy 采样，不需要加载嵌入模型
+用法：python bench_memory.py --index-dir ../dataset/index --workers 4 [--modes mmap read]
+"""
+import argparse, multiprocessing as mp, pathlib, sys, time
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from index_bundle import IndexBundle
+from metrics import process_memory
+
+def worker(index_dir, mmap, num_queries, topk, ready, go, out):
+    bundle = IndexBundle.load(index_dir, hybrid=False, mmap=mmap)
+    rows = np.random.default_rng(0).choice(len(bundle), min(num_queries, len(bundle)), replace=False)
+    qv = bundle.stored_vectors(np.sort(rows))
+    bundle.search(qv, topk)  # 触碰检索会访问的页
+    ready.release()
+    go.wait()  # 等所有 worker 都加载完再采样，pss 的均摊才反映并存的进程数
+    out.put({**process_memory(), "mmapped": bundle.mmapped})
+
+def run(index_dir, mmap, workers, num_queries, topk):
+    ctx = mp.get_context("spawn")
+    ready, go, out = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(index_dir, mmap, num_queries, topk, ready, go, out))
+             for _ in range(workers)]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready.acquire()
+    load_s = time.perf_counter() - t0
+    go.set()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return sorted(results, key=lambda r: r["pid"]), load_s
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--index-dir", default="../dataset/index")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--modes", nargs="+", default=["mmap", "read"], choices=["mmap", "read"])
+    ap.add_argument("--num-queries", type=int, default=200)
+    ap.add_argument("--topk", type=int, default=24)
+    args = ap.parse_args()
+
+    print(f"{'mode':6s} {'pid':>7s} {'mapped':>6s} {'rss MB':>8s} {'pss MB':>8s} {'anon MB':>8s} {'shared MB':>9s}")
+    for mode in args.modes:
+        results, load_s = run(args.index_dir, mode == "mmap", args.workers, args.num_queries, args.topk)
+        for r in results:
+            print(f"{mode:6s} {r['pid']:7d} {str(r['mmapped']):>6s} {r.get('rss_mb', r.get('max_rss_mb', 0)):8.1f} "
+                  f"{r.get('pss_mb', 0):8.1f} {r.get('anon_mb', 0):8.1f} {r.get('shared_mb', 0):9.1f}")
+        total = sum(r.get("pss_mb", 0) for r in results)
+        print(f"{mode:6s} {args.workers} 个 worker：pss 合计 {total:.1f} MB，平均 {total / len(results):.1f} MB，"
+              f"并行加载 {load_s:.1f}s\n")
+
+if __name__ == "__main__":
+    main()
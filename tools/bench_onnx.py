@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+ONNX int8 后端与 PyTorch 后端的对比（先运行 export_onnx.py）
+- 一致性：问题向量余弦、FAISS top-k 重合率与 top-1 一致率；重排分数的 Spearman 相关、top-1 一致率、
+  top-{topk_final} 重合率（候选取 torch 问题向量的 FAISS top-k）
+- 延迟：单条问题编码、单个问题的整组候选重排，p50 / p99
+用法：python bench_onnx.py --index-dir ../dataset/index --onnx-dir ../dataset/onnx [--queries q.txt] [--repeat 5]
+"""
+import argparse, os, pathlib, sys, time
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from settings import Settings
+from index_bundle import IndexBundle
+from onnx_backend import OnnxEncoder, OnnxReranker, EMBED_SUBDIR, RERANK_SUBDIR
+from bench_rescore import load_queries, percentile_ms
+
+def spearman(a, b):
+    ra = np.argsort(np.argsort(a)).astype(np.float64)
+    rb = np.argsort(np.argsort(b)).astype(np.float64)
+    if ra.std() == 0 or rb.std() == 0:
+        return 1.0
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+def overlap(a, b, k):
+    return len(set(a[:k]) & set(b[:k])) / max(min(k, len(a)), 1)
+
+def timed(fn, repeat):
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return out
+
+def main():
+    S = Settings()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--index-dir", default="../dataset/index")
+    ap.add_argument("--onnx-dir", default="../dataset/onnx")
+    ap.add_argument("--embed-model", default=S.embed_model)
+    ap.add_argument("--rerank-model", default=S.rerank_model)
+    ap.add_argument("--queries", default=None, help="每行一个问题；缺省使用内置样例")
+    ap.add_argument("--topk", type=int, default=S.topk_faiss)
+    ap.add_argument("--topk-final", type=int, default=S.topk_final)
+    ap.add_argument("--threads", type=int, default=S.onnx_threads)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    bundle = IndexBundle.load(args.index_dir)
+    queries = load_queries(args.queries)
+    torch_enc = SentenceTransformer(args.embed_model)
+    onnx_enc = OnnxEncoder(os.path.join(args.onnx_dir, EMBED_SUBDIR), threads=args.threads,
+                           expected_model=args.embed_model)
+    torch_rr = onnx_rr = None
+    if args.rerank_model:
+        from FlagEmbedding import FlagReranker
+        torch_rr = FlagReranker(args.rerank_model, use_fp16=False)
+        onnx_rr = OnnxReranker(os.path.join(args.onnx_dir, RERANK_SUBDIR), threads=args.threads,
+                               expected_model=args.rerank_model)
+
+    enc_lat = {"torch": [], "onnx": []}
+    rr_lat = {"torch": [], "onnx": []}
+    cos, faiss_overlap, faiss_top1 = [], [], []
+    rho, rr_top1, rr_overlap = [], [], []
+    for enc in (torch_enc, onnx_enc):
+        enc.encode(queries[:1], normalize_embeddings=True)  # 预热
+    for q in queries:
+        qt = torch_enc.encode([q], normalize_embeddings=True).astype("float32")
+        qo = onnx_enc.encode([q], normalize_embeddings=True).astype("float32")
+        enc_lat["torch"] += timed(lambda: torch_enc.encode([q], normalize_embeddings=True), args.repeat)
+        enc_lat["onnx"] += timed(lambda: onnx_enc.encode([q], normalize_embeddings=True), args.repeat)
+        cos.append(float(qt[0] @ qo[0]))
+        _, It = bundle.index.search(qt, args.topk)
+        _, Io = bundle.index.search(qo, args.topk)
+        it, io = It[0][It[0] >= 0], Io[0][Io[0] >= 0]
+        faiss_overlap.append(overlap(list(it), list(io), args.topk))
+        faiss_top1.append(float(len(it) > 0 and len(io) > 0 and it[0] == io[0]))
+
+        if torch_rr is None or len(it) < 2:
+            continue
+        pairs = [(q, " ".join(c["titles"]) + " " + c["text"]) for c in bundle.metas.get_many(it)]
+        st = np.asarray(torch_rr.compute_score(pairs), dtype=np.float32)
+        so = np.asarray(onnx_rr.compute_score(pairs), dtype=np.float32)
+        rr_lat["torch"] += timed(lambda: torch_rr.compute_score(pairs), args.repeat)
+        rr_lat["onnx"] += timed(lambda: onnx_rr.compute_score(pairs), args.repeat)
+        rho.append(spearman(st, so))
+        rank_t, rank_o = list(np.argsort(-st)), list(np.argsort(-so))
+        rr_top1.append(float(rank_t[0] == rank_o[0]))
+        rr_overlap.append(overlap(rank_t, rank_o, args.topk_final))
+
+    print(f"问题 {len(queries)} 条，候选 top-{args.topk}，每项重复 {args.repeat} 次")
+    print(f"\n[一致性] 嵌入：余弦 mean {np.mean(cos):.4f} / min {np.min(cos):.4f}，"
+          f"FAISS top-{args.topk} 重合 {np.mean(faiss_overlap):.3f}，top-1 一致 {np.mean(faiss_top1):.3f}")
+    if rho:
+        print(f"[一致性] 重排：Spearman mean {np.mean(rho):.4f} / min {np.min(rho):.4f}，"
+              f"top-1 一致 {np.mean(rr_top1):.3f}，top-{args.topk_final} 重合 {np.mean(rr_overlap):.3f}")
+    print(f"\n{'stage':12s} {'backend':8s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for stage, lat in (("encode", enc_lat), ("rerank", rr_lat)):
+        for backend, xs in lat.items():
+            if xs:
+                print(f"{stage:12s} {backend:8s} {percentile_ms(xs, 50):8.2f} {percentile_ms(xs, 99):8.2f}")
+    for stage, lat in (("encode", enc_lat), ("rerank", rr_lat)):
+        if lat["torch"] and lat["onnx"]:
+            print(f"{stage} 加速比（p50）：{np.percentile(lat['torch'], 50) / np.percentile(lat['onnx'], 50):.2f}x")
+
+if __name__ == "__main__":
+    main()
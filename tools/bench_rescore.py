@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+无重排模型时的候选重打分微基准
+- before：对 topk_faiss 个候选逐条 embed_model.encode（旧实现）
+- after ：直接取 build_index 保存的 embeddings.npy / index.reconstruct
+用法：python bench_rescore.py --index-dir ../dataset/index --repeat 3
+"""
+import argparse, json, pathlib, sys, time
+import numpy as np, faiss
+from sentence_transformers import SentenceTransformer
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from index_bundle import resolve_index_dir
+from evaluation import DEFAULT_QUERIES
+
+def load_queries(path):
+    if not path:
+        return DEFAULT_QUERIES
+    with open(path, encoding="utf-8") as f:
+        return [l.strip() for l in f if l.strip()]
+
+def rescore_before(model, qv, cands):
+    cand_vecs = [model.encode(" ".join(c["titles"]) + " " + c["text"],
+                              normalize_embeddings=True) for c in cands]
+    return np.array(cand_vecs) @ qv.T
+
+def rescore_after(emb, index, qv, ids):
+    vecs = np.asarray(emb[ids], dtype="float32") if emb is not None else index.reconstruct_batch(ids)
+    return vecs @ qv.T
+
+def percentile_ms(xs, p):
+    return float(np.percentile(np.array(xs) * 1000, p))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--index-dir", default="../dataset/index")
+    ap.add_argument("--model", default="BAAI/bge-small-zh-v1.5")
+    ap.add_argument("--queries", default=None, help="每行一个问题；缺省使用内置样例")
+    ap.add_argument("--topk", type=int, default=24)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    index_dir = pathlib.Path(resolve_index_dir(args.index_dir)[1])  # CURRENT 指向的版本（或旧版平铺目录）
+    model = SentenceTransformer(args.model)
+    index = faiss.read_index(str(index_dir / "faiss.index"))
+    with open(index_dir / "meta.jsonl", encoding="utf-8") as f:
+        metas = [json.loads(l) for l in f]
+    emb_path = index_dir / "embeddings.npy"
+    emb = np.load(emb_path, mmap_mode="r") if emb_path.exists() else None
+    queries = load_queries(args.queries)
+
+    model.encode(queries[:1], normalize_embeddings=True)  # 预热
+    timings = {"before": [], "after": []}
+    agree = 0
+    for _ in range(args.repeat):
+        for q in queries:
+            for mode in ("before", "after"):
+                t0 = time.perf_counter()
+                qv = model.encode([q], normalize_embeddings=True).astype("float32")
+                _, I = index.search(qv, args.topk)
+                ids = I[0][I[0] >= 0]
+                if mode == "before":
+                    sims_b = rescore_before(model, qv, [metas[i] for i in ids])
+                else:
+                    sims_a = rescore_after(emb, index, qv, ids)
+                timings[mode].append(time.perf_counter() - t0)
+            agree += int(np.array_equal(np.argsort(sims_b.ravel())[::-1],
+                                        np.argsort(sims_a.ravel())[::-1]))
+
+    n = len(timings["before"])
+    print(f"查询 {n} 次，topk={args.topk}，向量来源：{'embeddings.npy' if emb is not None else 'index.reconstruct'}")
+    for mode in ("before", "after"):
+        xs = timings[mode]
+        print(f"  {mode:6s} mean={np.mean(xs) * 1000:8.2f} ms  p50={percentile_ms(xs, 50):8.2f} ms  "
+              f"p99={percentile_ms(xs, 99):8.2f} ms")
+    print(f"  加速比 {np.mean(timings['before']) / np.mean(timings['after']):.1f}x；排序一致 {agree}/{n}")
+
+if __name__ == "__main__":
+    main()
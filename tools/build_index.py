@@ -1,31 +1,279 @@
 # build_index.py
-import os
+"""
+chunks → 向量索引
+- 读取 CHUNK_DIR/chunks.jsonl（兼容旧版每篇一个 *.jsonl）；--staging 时直接调用 chunking.iter_chunks
+- 按文本长度排序后分批编码（减少 padding 浪费），可选 CPU 多进程池
+- 向量直接写入预分配的 float32 memmap（embeddings.npy），不经过 Python list
+- --incremental：按 manifest.json（chunk id → 内容哈希 + 向量行号）只编码新增/变更的 chunk，
+  已删除的 chunk 在重写时丢弃；未变的 chunk 留在原行号，新 chunk 填进空出的行再追加到末尾
+  IVF 系列索引沿用上一版的训练结果原地 remove_ids / add_with_ids（--retrain 时重新训练）；
+  Flat / HNSW 不支持按 id 删除，仍按全部向量重建（Flat 重建只是拷贝，HNSW 需要重新建图）
+- 每次构建写入新的版本目录 versions/<时间戳>/，写完后原子切换 CURRENT；use.py 可据此热更新，
+  默认保留最近 3 个版本（--keep），增量构建以 CURRENT 指向的版本为基准（兼容旧版平铺目录）
+- 元数据同时写 meta.jsonl 与 meta.bin/meta.idx.npy（use.py 以 mmap 按行读取）
+- 同时生成字二元组 BM25 倒排（bm25_*），供 use.py 做混合检索
+- 以及元数据过滤数据（filter_*：部门 / 文档类型编号与发布日期），供检索时按条件过滤
+- --index-spec：索引类型（Flat / HNSW32 / IVF1024,Flat / IVF1024,PQ32 ...），默认取 Settings.index_spec
+- --vector-dtype float16 / int8：索引内向量改为标量量化（SQfp16 / SQ8），embeddings.npy 存为 float16；
+  构建后对采样查询做 recall@k 检查（对比 float32 暴力检索），结果写入 manifest.json
+用法：python build_index.py --batch-size 64 --workers 4 [--incremental] [--index-spec HNSW32] [--vector-dtype int8] [--keep 3] [--retrain]
+"""
+import argparse, os, sys, json, pathlib, time, hashlib
 from sentence_transformers import SentenceTransformer
-import numpy as np, faiss, json, pathlib, tqdm
+import numpy as np, faiss, tqdm
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from settings import Settings
+from ann import make_index, quantized_spec, check_recall, tune_index, fit_spec, can_update, update_index
+from metastore import write_meta_store
+from lexical import build_bm25
+from filters import build_filter_index
+from chunking import iter_chunks, CHUNK_FILE
+from index_bundle import current_version, new_version_dir, publish_version, prune_versions, VERSIONS
 
 CHUNK_DIR = "../dataset/chunks"
 INDEX_DIR = "../dataset/index"
-os.makedirs(INDEX_DIR, exist_ok=True)
-
-model = SentenceTransformer("BAAI/bge-small-zh-v1.5")
-embeddings, metas = [], []
-
-for file in tqdm.tqdm(list(pathlib.Path(CHUNK_DIR).glob("*.jsonl")), desc="Embedding"):
-    with open(file, encoding="utf-8") as f:
-        for line in f:
-            d = json.loads(line)
-            txt = " ".join(d["titles"]) + " " + d["text"]
-            emb = model.encode(txt, normalize_embeddings=True)
-            embeddings.append(emb)
-            metas.append(d)
-
-X = np.array(embeddings, dtype="float32")
-index = faiss.IndexFlatIP(X.shape[1])
-index.add(X)
-faiss.write_index(index, f"{INDEX_DIR}/faiss.index")
-
-with open(f"{INDEX_DIR}/meta.jsonl", "w", encoding="utf-8") as f:
-    for m in metas:
-        f.write(json.dumps(m, ensure_ascii=False) + "\n")
-
-print("✅ 向量索引已创建，共", len(metas), "条 chunk")
+EMBED_MODEL = "BAAI/bge-small-zh-v1.5"
+
+def embed_text(d: dict) -> str:
+    """入库向量所用文本，与 use.py 中重排的拼接方式保持一致"""
+    return " ".join(d["titles"]) + " " + d["text"]
+
+def text_hash(text: str) -> str:
+    return "md5:" + hashlib.md5(text.encode("utf-8")).hexdigest()
+
+def load_chunks(chunk_dir):
+    """优先读 chunking.py 输出的单个 chunks.jsonl；兼容旧版每篇文档一个 jsonl"""
+    single = pathlib.Path(chunk_dir) / CHUNK_FILE
+    files = [single] if single.exists() else sorted(pathlib.Path(chunk_dir).glob("*.jsonl"))
+    metas = []
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    metas.append(json.loads(line))
+    return metas
+
+def encode_into(model, texts, out, batch_size=64, workers=0):
+    """
+    编码 texts 并按原顺序写入 out[i]（预分配的 ndarray / memmap）
+    - 全局按长度降序分批：同批文本长度相近，padding 最少；最长的先跑，显存/内存不够会尽早暴露
+    - workers > 1 时使用 sentence-transformers 的多进程池（仅 CPU）
+    """
+    n = len(texts)
+    order = np.argsort([-len(t) for t in texts], kind="stable")
+    pool = None
+    if workers > 1:
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * workers)
+        step = batch_size * workers * 4  # 每轮给每个进程若干个 batch，摊薄进程间通信
+    else:
+        step = batch_size
+    try:
+        with tqdm.tqdm(total=n, desc="Embedding", unit="chunk") as bar:
+            for s in range(0, n, step):
+                idx = order[s:s + step]
+                batch = [texts[i] for i in idx]
+                if pool is not None:
+                    vecs = model.encode_multi_process(batch, pool, batch_size=batch_size)
+                else:
+                    vecs = model.encode(batch, batch_size=batch_size, convert_to_numpy=True)
+                vecs = np.ascontiguousarray(vecs, dtype="float32")
+                faiss.normalize_L2(vecs)
+                out[idx] = vecs
+                bar.update(len(idx))
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+def load_previous(index_dir, model_name):
+    """读取上一次构建的 manifest 与向量；模型不同或文件缺失时返回 None（退化为全量）"""
+    manifest_path = pathlib.Path(index_dir) / "manifest.json"
+    emb_path = pathlib.Path(index_dir) / "embeddings.npy"
+    if not manifest_path.exists() or not emb_path.exists():
+        return None
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    if manifest.get("model") != model_name:
+        print(f"[全量] 嵌入模型由 {manifest.get('model')} 变为 {model_name}")
+        return None
+    emb = np.load(emb_path, mmap_mode="r")
+    if emb.shape[0] != len(manifest["chunks"]):
+        print("[全量] manifest 与 embeddings.npy 行数不一致")
+        return None
+    return manifest, emb
+
+def plan_rows(metas, hashes, old_chunks):
+    """
+    分配本次构建的行号（即 faiss id）：内容未变的 chunk 尽量留在上一版的行号上，
+    新增/变更的 chunk（以及原行号超出新总数的未变 chunk）依次填进空出的行；没有旧结果时就是原顺序
+    返回 (order, reuse_new, reuse_old, todo)：order[row] 为该行对应的 metas 下标，
+    reuse_new / reuse_old 为沿用向量的新旧行号，todo 为需要编码的行号
+    """
+    n = len(metas)
+    keep, fresh = {}, []
+    for i, (d, h) in enumerate(zip(metas, hashes)):
+        old = old_chunks.get(d["id"])
+        if old is not None and old["hash"] == h:
+            keep[i] = old["row"]
+        else:
+            fresh.append(i)
+    order = [None] * n
+    for i, row in keep.items():
+        if row < n:
+            order[row] = i
+    pending = iter(fresh + [i for i, row in keep.items() if row >= n])
+    for row in range(n):
+        if order[row] is None:
+            order[row] = next(pending)
+    reuse_new = [row for row, i in enumerate(order) if i in keep]
+    reuse_old = [keep[order[row]] for row in reuse_new]
+    todo = [row for row, i in enumerate(order) if i not in keep]
+    return order, reuse_new, reuse_old, todo
+
+def load_reusable_index(prev_dir, manifest, spec, vector_dtype):
+    """上一版索引与本次 spec / 向量精度一致且为 IVF 系列时读入（供原地增删），否则返回 None"""
+    path = os.path.join(prev_dir, "faiss.index")
+    if (manifest.get("index_spec") != spec or manifest.get("vector_dtype", "float32") != vector_dtype
+            or "IVF" not in spec or not os.path.exists(path)):
+        return None
+    index = faiss.read_index(path)
+    return index if can_update(index) else None
+
+def build(chunk_dir=CHUNK_DIR, index_dir=INDEX_DIR, model_name=EMBED_MODEL,
+          batch_size=64, workers=0, incremental=False, index_spec="Flat", train_size=50000,
+          staging_dir=None, keep=3, vector_dtype="float32", recall_k=10, nprobe=16, ef_search=64,
+          retrain=False):
+    spec = quantized_spec(index_spec, vector_dtype)
+    os.makedirs(index_dir, exist_ok=True)
+    # 给定 staging_dir 时直接消费切块生成器，不经过中间 chunk 文件
+    metas = list(iter_chunks(staging_dir, workers=workers)) if staging_dir else load_chunks(chunk_dir)
+    if not metas:
+        raise SystemExit(f"❌ {staging_dir or chunk_dir} 下没有可用的 chunk")
+    texts = [embed_text(d) for d in metas]
+    hashes = [text_hash(t) for t in texts]
+
+    cur = current_version(index_dir)
+    prev_dir = os.path.join(index_dir, VERSIONS, cur) if cur else index_dir  # 无 CURRENT 时读旧版平铺目录
+    prev = load_previous(prev_dir, model_name) if incremental else None
+    old_chunks = prev[0]["chunks"] if prev else {}
+    removed = len(set(old_chunks) - {d["id"] for d in metas})
+    order, reuse_new, reuse_old, todo = plan_rows(metas, hashes, old_chunks)
+    metas, texts, hashes = [metas[i] for i in order], [texts[i] for i in order], [hashes[i] for i in order]
+    # 行号未变的向量在上一版 IVF 索引里原样保留，其余旧行删掉、新行加入
+    prev_manifest, prev_rows = (prev[0], prev[1].shape[0]) if prev else (None, 0)
+    staying = {new for new, old in zip(reuse_new, reuse_old) if new == old}
+
+    # 没有需要编码的 chunk 时不加载模型，夜间增量通常几秒完成
+    model = SentenceTransformer(model_name) if todo else None
+    dim = model.get_sentence_embedding_dimension() if model else prev[0]["dim"]
+
+    # 新版本目录在 CURRENT 切换前对读者不可见，直接写最终文件名；中途失败只留下一个未发布的目录
+    version, out_dir = new_version_dir(index_dir)
+    out = lambda name: os.path.join(out_dir, name)
+    # 与 meta.jsonl 行号一一对应，检索时直接取向量重打分，无需重新编码
+    # 量化存储时先写 float32 工作文件，建完索引再转存 float16 的 embeddings.npy
+    work = out("embeddings.npy") if vector_dtype == "float32" else out("embeddings.f32.tmp.npy")
+    X = np.lib.format.open_memmap(work, mode="w+", dtype="float32", shape=(len(texts), dim))
+    if reuse_new:
+        X[np.array(reuse_new)] = prev[1][np.array(reuse_old)]
+    if prev:
+        del prev  # 释放旧 embeddings.npy 的映射，Windows 下才能清理旧版本目录
+    elapsed = 0.0
+    if todo:
+        buf = np.empty((len(todo), dim), dtype="float32")
+        t0 = time.perf_counter()
+        encode_into(model, [texts[i] for i in todo], buf, batch_size=batch_size, workers=workers)
+        elapsed = time.perf_counter() - t0
+        X[np.array(todo)] = buf
+    X.flush()
+
+    try:
+        fitted = fit_spec(spec, min(train_size, X.shape[0]))
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    if fitted != spec:
+        print(f"   语料只有 {X.shape[0]} 条，{spec} 的 nlist 下调为 {fitted}")
+        spec = fitted
+    t0 = time.perf_counter()
+    index = load_reusable_index(prev_dir, prev_manifest, spec, vector_dtype) if prev_manifest and not retrain else None
+    if index is not None:
+        stale = [row for row in range(prev_rows) if row not in staying]
+        added = [row for row in range(X.shape[0]) if row not in staying]
+        update_index(index, X, stale, added)
+        print(f"   索引 {spec} 沿用上一版训练结果：删除 {len(stale)}，加入 {len(added)}，"
+              f"耗时 {time.perf_counter() - t0:.1f}s")
+    else:
+        index = make_index(spec, X, train_size=train_size)
+        print(f"   索引 {spec} 构建耗时 {time.perf_counter() - t0:.1f}s")
+    recall = None
+    if spec != "Flat" and recall_k > 0:
+        # 按线上检索参数测，与 use.py 看到的召回一致
+        recall = check_recall(tune_index(index, nprobe=nprobe, ef_search=ef_search), X, k=recall_k)
+        print(f"   recall@{recall_k}（对比 float32 暴力检索，nprobe={nprobe} efSearch={ef_search}）{recall:.4f}")
+    if vector_dtype != "float32":
+        Y = np.lib.format.open_memmap(out("embeddings.npy"), mode="w+", dtype="float16", shape=X.shape)
+        for i in range(0, X.shape[0], 65536):
+            Y[i:i + 65536] = X[i:i + 65536]
+        Y.flush()
+        del Y
+    del X
+    if vector_dtype != "float32":
+        os.remove(work)
+    faiss.write_index(index, out("faiss.index"))
+
+    with open(out("meta.jsonl"), "w", encoding="utf-8") as f:
+        for m in metas:
+            f.write(json.dumps(m, ensure_ascii=False) + "\n")
+    # use.py 通过 mmap 按行读取的紧凑元数据
+    write_meta_store(out_dir, metas)
+    # BM25 倒排不依赖模型，每次都按全量 chunk 重建
+    t0 = time.perf_counter()
+    build_bm25(texts, out_dir)
+    print(f"   BM25 倒排构建耗时 {time.perf_counter() - t0:.1f}s")
+    build_filter_index(metas, out_dir)
+
+    manifest = {
+        "model": model_name,
+        "dim": dim,
+        "index_spec": spec,
+        "vector_dtype": vector_dtype,
+        "recall_check": {"k": recall_k, "recall": recall} if recall is not None else None,
+        "chunks": {d["id"]: {"hash": h, "row": row}
+                   for row, (d, h) in enumerate(zip(metas, hashes))},
+    }
+    with open(out("manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    publish_version(index_dir, version)
+    removed_versions = prune_versions(index_dir, keep)
+
+    print(f"✅ 向量索引已创建，共 {len(metas)} 条 chunk；"
+          f"复用 {len(reuse_new)}，编码 {len(todo)}，删除 {removed}")
+    print(f"   当前版本 {version}" + (f"，清理旧版本 {', '.join(removed_versions)}" if removed_versions else ""))
+    if todo:
+        print(f"   编码耗时 {elapsed:.1f}s，吞吐 {len(todo) / max(elapsed, 1e-9):.1f} chunks/s")
+
+def main():
+    S = Settings()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", default=CHUNK_DIR, help="chunk jsonl 目录")
+    ap.add_argument("--staging", default=None, help="直接从 staging 目录切块建索引（跳过 chunks 文件）")
+    ap.add_argument("--out", default=INDEX_DIR, help="索引输出目录")
+    ap.add_argument("--model", default=EMBED_MODEL)
+    ap.add_argument("--batch-size", type=int, default=64, help="每批编码条数")
+    ap.add_argument("--workers", type=int, default=0, help="CPU 多进程数，<=1 表示单进程")
+    ap.add_argument("--incremental", action="store_true", help="只编码新增/变更的 chunk")
+    ap.add_argument("--index-spec", default=S.index_spec, help="faiss.index_factory 描述串")
+    ap.add_argument("--train-size", type=int, default=S.index_train_size, help="IVF/PQ 训练采样条数")
+    ap.add_argument("--keep", type=int, default=3, help="保留最近几个索引版本，<=0 表示全部保留")
+    ap.add_argument("--vector-dtype", default=S.index_vector_dtype, choices=["float32", "float16", "int8"],
+                    help="索引内向量的存储精度")
+    ap.add_argument("--recall-k", type=int, default=10, help="构建后 recall@k 检查的 k，0 表示跳过")
+    ap.add_argument("--retrain", action="store_true",
+                    help="增量构建时也重新训练 IVF/PQ（语料分布变化较大时），默认沿用上一版的训练结果")
+    args = ap.parse_args()
+    build(args.chunks, args.out, args.model, args.batch_size, args.workers, args.incremental,
+          args.index_spec, args.train_size, args.staging, args.keep, args.vector_dtype, args.recall_k,
+          S.index_nprobe, S.index_ef_search, args.retrain)
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,36 @@
 # chunker_htuedu.py
-import os, re, json, pathlib
+"""
+staging/<doc_id>/{meta.json, content.md} → chunks
+- 可作为库调用：iter_chunks() 是生成器，逐条产出 chunk，可直接写文件或交给 build_index
+- --workers N：进程池并行切块（按 doc_id 排序，结果保序）
+- 输出单个 chunks.jsonl（先写 .tmp 再原子替换），不再每篇文档一个小文件
+- chunk_state.json 记录每篇文档的内容哈希；哈希未变的文档直接沿用上次的 chunk，不再重切
+- --changed：爬虫清单（changed_docs.json）之外的文档连哈希都不算，直接沿用
+用法：python chunking.py [--workers 8] [--changed ../dataset/changed_docs.json]
+"""
+import os, re, json, pathlib, argparse, hashlib, time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
 STAGING_DIR = "../dataset/staging"
 CHUNK_DIR = "../dataset/chunks"
-os.makedirs(CHUNK_DIR, exist_ok=True)
+CHUNK_FILE = "chunks.jsonl"
+STATE_FILE = "chunk_state.json"
+
+_SENT_SPLIT = re.compile(r'(?<=[。！？!?；;])\s*')
 
 def chunk_text(text, size=350, overlap=60):
     """句子优先的滑动窗口切块"""
-    sents = re.split(r'(?<=[。！？!?；;])\s*', text)
+    sents = _SENT_SPLIT.split(text)
     chunks, cur, cur_len = [], [], 0
     for s in sents:
         slen = len(s)
         if cur_len + slen > size:
-            chunks.append("".join(cur))
+            block = "".join(cur)  # 每次落块只拼接一次
+            chunks.append(block)
             # overlap：取末尾一部分进入下一块
-            overlap_text = "".join(cur)[-overlap:]
+            overlap_text = block[-overlap:]
             cur, cur_len = [overlap_text, s], len(overlap_text) + slen
         else:
             cur.append(s)
@@ -24,33 +39,166 @@ def chunk_text(text, size=350, overlap=60):
         chunks.append("".join(cur))
     return [c.strip() for c in chunks if len(c.strip()) > 30]
 
-all_chunks = []
-for docdir in tqdm(list(pathlib.Path(STAGING_DIR).iterdir()), desc="Processing"):
-    meta_path = docdir / "meta.json"
-    content_path = docdir / "content.md"
-    if not meta_path.exists() or not content_path.exists():
-        continue
-    meta = json.loads(meta_path.read_text(encoding="utf-8"))
-    text = content_path.read_text(encoding="utf-8")
+def make_chunks(meta, text):
     title = meta.get("title") or "无标题通知"
     doc_id = meta["doc_id"]
+    return [{
+        "id": f"{doc_id}#p{i}",
+        "doc_id": doc_id,
+        "titles": [title],
+        "text": ck,
+        "doc_type": meta.get("doc_type", "通知公告"),
+        "dept": meta.get("dept", "教务处"),
+        "publish_date": meta.get("publish_date"),
+        "source_url": meta.get("source_url"),
+        "lang": "zh"
+    } for i, ck in enumerate(chunk_text(text, size=350, overlap=60), 1)]
+
+def _process(job):
+    """
+    进程池任务：(docdir, 上次哈希, 是否无需检查) → (dir 名, 哈希, chunk 的 JSON 行或 None)
+    None 表示沿用上次结果；哈希同时覆盖 meta.json（标题等也会进入 chunk）
+    序列化在子进程里完成，主进程只负责按序写出
+    """
+    docdir, old_hash, trust_old = job
+    name = os.path.basename(docdir)
+    if trust_old and old_hash:
+        return name, old_hash, None
+    meta_path = os.path.join(docdir, "meta.json")
+    content_path = os.path.join(docdir, "content.md")
+    if not os.path.exists(meta_path) or not os.path.exists(content_path):
+        return name, None, []
+    with open(meta_path, "rb") as f:
+        meta_bytes = f.read()
+    with open(content_path, "rb") as f:
+        content_bytes = f.read()
+    h = "md5:" + hashlib.md5(meta_bytes + b"\0" + content_bytes).hexdigest()
+    if h == old_hash:
+        return name, h, None
+    chunks = make_chunks(json.loads(meta_bytes), content_bytes.decode("utf-8"))
+    return name, h, [json.dumps(c, ensure_ascii=False) + "\n" for c in chunks]
+
+# chunks.jsonl 由本模块写出，键顺序固定，可以不解析整行直接取 doc_id
+_DOC_ID = re.compile(r'\{"id": "(?:[^"\\]|\\.)*", "doc_id": "((?:[^"\\]|\\.)*)"')
+
+def _old_groups(path):
+    """按 doc_id 分组顺序读出上次 chunks.jsonl 的原始行（写出时即按 doc_id 排序）"""
+    if not path or not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        cur_id, group = None, []
+        for line in f:
+            m = _DOC_ID.match(line)
+            doc_id = m.group(1) if m else json.loads(line)["doc_id"]
+            if doc_id != cur_id:
+                if group:
+                    yield cur_id, group
+                cur_id, group = doc_id, []
+            group.append(line)
+        if group:
+            yield cur_id, group
+
+def iter_chunk_lines(staging_dir=STAGING_DIR, workers=0, prev_state=None, old_chunk_file=None,
+                     changed=None, new_state=None, stats=None, progress=True):
+    """
+    生成器：按 doc_id 顺序逐条产出 chunk 的 JSON 行（含换行符）
+    - prev_state / old_chunk_file：上次的哈希表与输出文件，哈希未变的文档直接沿用其中的 chunk
+    - changed：doc_id 集合；给定时只检查其中的文档，其余有旧结果的一律沿用
+    - new_state：传入 dict 时填入本次每篇文档的哈希
+    - stats：传入 Counter 时累计 docs / chunked / reused / chunks 计数；
+      missing 为哈希未变、但旧文件里找不到同名 doc_id 而被迫重切的文档数
+    旧 chunk 按 staging 目录名匹配 chunk 里的 doc_id，两者不一致时无法沿用
+    """
+    prev_state = prev_state or {}
+    stats = stats if stats is not None else Counter()
+    docdirs = sorted(str(p) for p in pathlib.Path(staging_dir).iterdir() if p.is_dir())
+    jobs = [(d, prev_state.get(os.path.basename(d)),
+             changed is not None and os.path.basename(d) not in changed) for d in docdirs]
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    results = pool.map(_process, jobs, chunksize=64) if pool else map(_process, jobs)
+    old = _old_groups(old_chunk_file)
+    old_item = next(old, None)
+    try:
+        for name, h, chunks in tqdm(results, total=len(jobs), desc="Chunking", disable=not progress):
+            # 旧文件与 docdirs 同序，归并式前进即可，不需要把旧 chunk 全部读进内存
+            while old_item is not None and old_item[0] < name:
+                old_item = next(old, None)
+            reused = None
+            if old_item is not None and old_item[0] == name:
+                reused = old_item[1]
+                old_item = next(old, None)
+            if chunks is None:
+                if reused is None:  # 状态里有哈希但旧 chunk 丢失：重切
+                    name, h, chunks = _process((os.path.join(staging_dir, name), None, False))
+                    stats["chunked"] += 1
+                    stats["missing"] += 1
+                else:
+                    chunks = reused
+                    stats["reused"] += 1
+            else:
+                stats["chunked"] += 1
+            if h is None:
+                continue
+            stats["docs"] += 1
+            stats["chunks"] += len(chunks)
+            if new_state is not None:
+                new_state[name] = h
+            yield from chunks
+    finally:
+        old.close()
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+def iter_chunks(staging_dir=STAGING_DIR, workers=0, **kwargs):
+    """生成器：逐条产出 chunk dict（参数同 iter_chunk_lines），供 build_index 直接消费"""
+    for line in iter_chunk_lines(staging_dir, workers, **kwargs):
+        yield json.loads(line)
+
+def write_chunk_file(lines, out_path):
+    """流式写出单个 jsonl（.tmp → 原子替换），返回条数"""
+    tmp = f"{out_path}.tmp"
+    n = 0
+    with open(tmp, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line)
+            n += 1
+    os.replace(tmp, out_path)
+    return n
+
+def run(staging_dir=STAGING_DIR, chunk_dir=CHUNK_DIR, workers=0, changed_path=None, progress=True):
+    os.makedirs(chunk_dir, exist_ok=True)
+    state_path = pathlib.Path(chunk_dir) / STATE_FILE
+    out_path = pathlib.Path(chunk_dir) / CHUNK_FILE
+    prev_state = json.loads(state_path.read_text(encoding="utf-8")) if state_path.exists() and out_path.exists() else {}
+    changed = None
+    if changed_path:
+        docs = json.loads(pathlib.Path(changed_path).read_text(encoding="utf-8"))["docs"]
+        changed = {d["doc_id"] for d in docs}
+
+    new_state, stats = {}, Counter()
+    t0 = time.perf_counter()
+    write_chunk_file(iter_chunk_lines(staging_dir, workers, prev_state, out_path, changed,
+                                      new_state, stats, progress), out_path)
+    elapsed = time.perf_counter() - t0
+    tmp = state_path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(new_state, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, state_path)
+    print(f"✅ Chunking 完成：文档 {stats['docs']}（重切 {stats['chunked']}，沿用 {stats['reused']}），"
+          f"chunk {stats['chunks']}，耗时 {elapsed:.1f}s → {out_path}")
+    if stats["missing"]:
+        print(f"⚠️ {stats['missing']} 篇文档哈希未变，但上次的 {CHUNK_FILE} 里没有与目录名相同的 doc_id，已全部重切；"
+              f"请确认 staging 目录名与 meta.json 中的 doc_id 一致")
+    return stats
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--staging", default=STAGING_DIR)
+    ap.add_argument("--out", default=CHUNK_DIR)
+    ap.add_argument("--workers", type=int, default=0, help="切块进程数，<=1 表示单进程")
+    ap.add_argument("--changed", default=None, help="crawl.py 输出的 changed_docs.json")
+    args = ap.parse_args()
+    run(args.staging, args.out, args.workers, args.changed)
 
-    chunks = chunk_text(text, size=350, overlap=60)
-    out_path = pathlib.Path(CHUNK_DIR) / f"{doc_id}.jsonl"
-
-    with open(out_path, "w", encoding="utf-8") as f:
-        for i, ck in enumerate(chunks, 1):
-            item = {
-                "id": f"{doc_id}#p{i}",
-                "doc_id": doc_id,
-                "titles": [title],
-                "text": ck,
-                "doc_type": meta.get("doc_type", "通知公告"),
-                "dept": meta.get("dept", "教务处"),
-                "publish_date": meta.get("publish_date"),
-                "source_url": meta.get("source_url"),
-                "lang": "zh"
-            }
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
-
-print("✅ Chunking 完成，输出目录:", CHUNK_DIR)
+if __name__ == "__main__":
+    main()
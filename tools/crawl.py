@@ -5,10 +5,19 @@ HTU 教务处栏目爬虫（结构化落盘）
 - 递归“下一页”
 - 抽取每篇文章，保存 HTML / Markdown / meta.json / 附件
 - 目录：raw/<doc_id>/..., staging/<doc_id>/...
+- 变更检测：crawl_state.json 按 URL 记录 ETag / Last-Modified / hash_html，
+  复访时发条件请求（304 或内容哈希不变即跳过），本轮新增/变更的文档写入 changed_docs.json
+- 附件：流式下载、边下边算 sha256，按内容寻址存入 blobs/（同一文件只存一份），
+  已知 URL 先 HEAD 比对 ETag / 大小，未变则不再下载
+- --concurrency N（N>1）：线程池并发抓取，栏目翻页与文章下载流水线并行；
+  按主机令牌桶限速（--rps），在途请求数有上限，连接池复用，失败按指数退避重试
 """
-import argparse, os, re, time, json, hashlib, pathlib, datetime, sys
+import argparse, os, re, time, json, hashlib, pathlib, datetime, sys, threading, tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
 from urllib.parse import urljoin, urlparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 import trafilatura
 
@@ -24,8 +33,59 @@ def ensure_dir(p: pathlib.Path):
     p.mkdir(parents=True, exist_ok=True)
     return p
 
-def http_get(url, session, timeout=20):
-    r = session.get(url, timeout=timeout)
+class TokenBucket:
+    """令牌桶：平均 rate 次/秒，允许 burst 次突发；线程安全"""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+class HostRateLimiter:
+    """每个主机一个令牌桶（附件可能在别的域名上，互不影响）"""
+    def __init__(self, rate, burst=1):
+        self.rate, self.burst = rate, burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+def make_session(pool_size=10, retries=3, backoff=0.5):
+    """共享连接池 + 对 429/5xx/连接错误按指数退避重试（遵循 Retry-After）"""
+    s = requests.Session()
+    s.headers.update({"User-Agent": UA})
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset({"GET", "HEAD"}),
+                  respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+def http_get(url, session, timeout=20, limiter=None, headers=None):
+    if limiter is not None:
+        limiter.acquire(url)
+    r = session.get(url, timeout=timeout, headers=headers)
     r.raise_for_status()
     r.encoding = r.apparent_encoding or "utf-8"
     return r
@@ -56,11 +116,101 @@ def make_doc_id(article_url: str, title_text: str) -> str:
     title_norm = re.sub(r"[\\/:*?\"<>| \t\n]+", "", title_text)[:18] or "文章"
     return f"HTU_教务处_通知_{date_str}_{tail}_{title_norm}"
 
-def extract_article(session, url, out_dir):
-    """抓取文章并落盘"""
-    resp = http_get(url, session)
+class AttachmentStore:
+    """
+    内容寻址的附件库：blobs/<sha256 前两位>/<sha256><扩展名>
+    index：url → {hash, blob, size, etag, last_modified}，随 crawl_state.json 持久化
+    """
+    def __init__(self, out_dir, index=None, lock=None, chunk_size=1 << 16):
+        self.out_dir = pathlib.Path(out_dir)
+        self.root = ensure_dir(self.out_dir/"blobs")
+        self.index = index if index is not None else {}
+        self.lock = lock or threading.Lock()
+        self.chunk_size = chunk_size
+
+    def _unchanged(self, session, url, known, limiter=None):
+        """HEAD 比对：ETag 一致，或无 ETag 时大小与 Last-Modified 一致，视为未变"""
+        if not (self.out_dir/known["blob"]).exists():
+            return False
+        if limiter is not None:
+            limiter.acquire(url)
+        try:
+            h = session.head(url, timeout=20, allow_redirects=True)
+        except requests.RequestException:
+            return False
+        if h.status_code >= 400:
+            return False
+        etag = h.headers.get("ETag")
+        if etag and known.get("etag"):
+            return etag == known["etag"]
+        size = h.headers.get("Content-Length")
+        return (size is not None and int(size) == known["size"]
+                and h.headers.get("Last-Modified") == known.get("last_modified"))
+
+    def fetch(self, session, url, limiter=None, timeout=60):
+        """返回附件记录；内容已在库中时不重复写盘"""
+        known = self.index.get(url)
+        if known and self._unchanged(session, url, known, limiter):
+            return known
+
+        if limiter is not None:
+            limiter.acquire(url)
+        tmp_dir = ensure_dir(self.root/"tmp")
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        hasher, size = hashlib.sha256(), 0
+        with session.get(url, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in r.iter_content(self.chunk_size):
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        size += len(chunk)
+                digest = hasher.hexdigest()
+                blob = self.root/digest[:2]/(digest + ext)
+                if blob.exists():
+                    os.remove(tmp)
+                else:
+                    ensure_dir(blob.parent)
+                    os.replace(tmp, blob)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            rec = {
+                "hash": "sha256:" + digest,
+                "blob": blob.relative_to(self.out_dir).as_posix(),
+                "size": size,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+            }
+        with self.lock:
+            self.index[url] = rec
+        return rec
+
+def conditional_headers(prev):
+    """依据上次抓取记录构造条件请求头"""
+    headers = {}
+    if prev and prev.get("etag"):
+        headers["If-None-Match"] = prev["etag"]
+    if prev and prev.get("last_modified"):
+        headers["If-Modified-Since"] = prev["last_modified"]
+    return headers
+
+def extract_article(session, url, out_dir, limiter=None, prev=None, store=None):
+    """
+    抓取文章并落盘；prev 为该 URL 上次的抓取记录，store 为共享的 AttachmentStore
+    返回记录 dict，status 为 new / changed / unchanged（304 或 hash_html 未变时不写盘）
+    """
+    resp = http_get(url, session, limiter=limiter, headers=conditional_headers(prev))
+    if resp.status_code == 304:
+        return {**prev, "status": "unchanged"}
+    validators = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
     html = resp.text
     hash_html = md5_bytes(html.encode("utf-8"))
+    if prev and prev.get("hash_html") == hash_html:
+        return {**prev, **validators, "status": "unchanged"}
     soup = BeautifulSoup(html, "lxml")
 
     # 取标题：优先 h1，再次从 <title>
@@ -74,15 +224,17 @@ def extract_article(session, url, out_dir):
     md = trafilatura.extract(html, include_tables=True, include_links=False, output_format="markdown")
     md = md or ""
 
-    # doc_id & 路径
-    doc_id = make_doc_id(url, title)
+    # doc_id & 路径：已抓过的文章沿用原 doc_id，标题修改后不会产生重复文档
+    doc_id = (prev or {}).get("doc_id") or make_doc_id(url, title)
+    version = f"v{int((prev or {}).get('version', 'v0')[1:]) + 1}"
     raw_dir = ensure_dir(pathlib.Path(out_dir)/"raw"/doc_id)
     stg_dir = ensure_dir(pathlib.Path(out_dir)/"staging"/doc_id)
 
     # 保存 HTML
     (raw_dir/"page.html").write_text(html, encoding="utf-8")
 
-    # 下载附件
+    # 下载附件（内容寻址，多篇通知引用的同一附件只存一份）
+    store = store or AttachmentStore(out_dir)
     attachments = []
     for a in soup.select("a[href]"):
         href = a.get("href")
@@ -92,16 +244,14 @@ def extract_article(session, url, out_dir):
             continue
         file_url = urljoin(url, href)
         try:
-            r = http_get(file_url, session)
-            fname = os.path.basename(urlparse(file_url).path) or "file"
-            local = raw_dir/"assets"/fname
-            ensure_dir(local.parent)
-            with open(local, "wb") as f:
-                f.write(r.content)
+            rec = store.fetch(session, file_url, limiter=limiter)
             attachments.append({
                 "url": file_url,
-                "local": str(local),
-                "hash": md5_bytes(r.content)
+                "name": os.path.basename(urlparse(file_url).path) or "file",
+                "local": str(store.out_dir/rec["blob"]),
+                "blob": rec["blob"],
+                "hash": rec["hash"],
+                "size": rec["size"],
             })
         except Exception as e:
             print(f"[附件失败] {file_url}: {e}", file=sys.stderr)
@@ -119,17 +269,29 @@ def extract_article(session, url, out_dir):
         "publish_date": publish_date,
         "crawl_date": str(datetime.date.today()),
         "lang": "zh",
-        "version": "v1",
+        "version": version,
         "hash_html": hash_html,
         "attachments": attachments
     }
     (stg_dir/"meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
 
-    return doc_id, title
+    return {
+        "status": "changed" if prev and prev.get("doc_id") else "new",
+        "doc_id": doc_id,
+        "title": title,
+        "version": version,
+        "hash_html": hash_html,
+        **validators,
+    }
 
-def parse_list_page(session, url):
-    """解析栏目页：返回文章链接列表 + 下一页链接（若有）"""
-    resp = http_get(url, session)
+def parse_list_page(session, url, limiter=None, prev=None):
+    """
+    解析栏目页：返回 (文章链接列表, 下一页链接或 None, 本页记录)
+    prev 为上次记录；服务端返回 304 时直接沿用其中缓存的链接
+    """
+    resp = http_get(url, session, limiter=limiter, headers=conditional_headers(prev))
+    if resp.status_code == 304:
+        return prev["links"], prev.get("next"), prev
     html = resp.text
     soup = BeautifulSoup(html, "lxml")
 
@@ -157,21 +319,84 @@ def parse_list_page(session, url):
         if l not in seen:
             uniq_links.append(l); seen.add(l)
 
-    return uniq_links, next_link
-
-def load_state(state_path):
-    if state_path.exists():
-        return json.loads(state_path.read_text(encoding="utf-8"))
-    return {"visited_articles": [], "visited_lists": []}
-
-def save_state(state_path, state):
-    state_path.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    record = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified"),
+              "links": uniq_links, "next": next_link}
+    return uniq_links, next_link, record
 
-def crawl(start_url, out_dir, max_pages=50, delay=1.0):
+class CrawlState:
+    """
+    按 URL 索引的抓取状态（dict，O(1) 查找），线程安全
+    - articles: url → {doc_id, title, version, hash_html, etag, last_modified, checked}
+    - lists:    url → {etag, last_modified, links, next}
+    - attachments: url → {hash, blob, size, etag, last_modified}（由 AttachmentStore 维护）
+    每累计 save_every 次更新才落盘一次（原子替换），结束时再强制保存
+    兼容旧格式 {"visited_articles": [...], "visited_lists": [...]}
+    """
+    def __init__(self, path, save_every=50):
+        self.path = pathlib.Path(path)
+        self.save_every = save_every
+        self.lock = threading.Lock()
+        self.dirty = 0
+        self.changes = []
+        data = json.loads(self.path.read_text(encoding="utf-8")) if self.path.exists() else {}
+        self.articles = data.get("articles") or {u: {} for u in data.get("visited_articles", [])}
+        self.lists = data.get("lists") or {}
+        self.attachments = data.get("attachments") or {}
+
+    def record_article(self, url, rec):
+        with self.lock:
+            self.articles[url] = {k: rec.get(k) for k in
+                                  ("doc_id", "title", "version", "hash_html", "etag", "last_modified")}
+            self.articles[url]["checked"] = str(datetime.date.today())
+            if rec["status"] != "unchanged":
+                self.changes.append({"doc_id": rec["doc_id"], "status": rec["status"], "source_url": url})
+            self._touch()
+
+    def record_list(self, url, rec):
+        with self.lock:
+            self.lists[url] = rec
+            self._touch()
+
+    def _touch(self):
+        self.dirty += 1
+        if self.dirty >= self.save_every:
+            self._save()
+
+    def _save(self):
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"articles": self.articles, "lists": self.lists,
+                                   "attachments": self.attachments}, ensure_ascii=False),
+                       encoding="utf-8")
+        os.replace(tmp, self.path)
+        self.dirty = 0
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def write_changes(self, out_dir):
+        """本轮新增/变更文档清单，供 chunking / build_index 只处理变化的部分"""
+        path = pathlib.Path(out_dir)/"changed_docs.json"
+        with self.lock:
+            data = {"crawl_time": datetime.datetime.now().isoformat(timespec="seconds"), "docs": self.changes}
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        return path
+
+def report_article(rec):
+    if rec["status"] == "unchanged":
+        print(f"  [未变] {rec.get('title') or rec.get('doc_id')}")
+    else:
+        print(f"  [{'新增' if rec['status'] == 'new' else '更新'}] {rec['title']} → {rec['doc_id']}")
+
+def crawl(start_url, out_dir, max_pages=50, delay=1.0, revisit=True):
+    """
+    串行模式；revisit=True 时已抓文章发条件请求复查，False 时直接跳过
+    栏目页总是复查（条件请求），首页的新通知才能被发现
+    """
     out_dir = pathlib.Path(out_dir)
     ensure_dir(out_dir)
-    state_path = out_dir/"crawl_state.json"
-    state = load_state(state_path)
+    state = CrawlState(out_dir/"crawl_state.json")
+    store = AttachmentStore(out_dir, state.attachments, lock=state.lock)
 
     s = requests.Session()
     s.headers.update({"User-Agent": UA})
@@ -180,58 +405,127 @@ def crawl(start_url, out_dir, max_pages=50, delay=1.0):
     pages_done = 0
 
     while list_url and pages_done < max_pages:
-        if list_url in state["visited_lists"]:
-            print(f"[跳过栏目已抓] {list_url}")
-        else:
+        print(f"[栏目] {list_url}")
+        try:
+            article_links, next_link, list_rec = parse_list_page(s, list_url, prev=state.lists.get(list_url))
+        except Exception as e:
+            print(f"[栏目失败] {list_url}: {e}", file=sys.stderr)
+            break
+
+        for aurl in article_links:
+            prev = state.articles.get(aurl)
+            if prev is not None and not revisit:
+                print(f"  [跳过已抓] {aurl}")
+                continue
+            try:
+                rec = extract_article(s, aurl, out_dir, prev=prev, store=store)
+                report_article(rec)
+                state.record_article(aurl, rec)
+                time.sleep(delay)
+            except Exception as e:
+                print(f"  [文章失败] {aurl}: {e}", file=sys.stderr)
+
+        # 本页文章处理完才记录栏目页，中途中断下次会重新处理
+        state.record_list(list_url, list_rec)
+        list_url = next_link
+        pages_done += 1
+        time.sleep(delay)
+
+    state.save()
+    changes_path = state.write_changes(out_dir)
+    print(f"完成：栏目页 {pages_done} 页；已知文章 {len(state.articles)} 篇，"
+          f"本轮新增/变更 {len(state.changes)} 篇（{changes_path}）。输出目录：{out_dir}")
+
+def crawl_concurrent(start_url, out_dir, max_pages=50, concurrency=8, rps=4.0, max_inflight=None,
+                     revisit=True):
+    """
+    并发模式：主线程顺序翻栏目页（下一页链接只能逐页发现），文章提交给线程池，
+    因此翻页与文章/附件下载并行进行
+    - rps：每个主机的平均请求速率（令牌桶），取代固定 sleep
+    - max_inflight：已提交未完成的文章数上限，超过时主线程暂停翻页
+    """
+    out_dir = pathlib.Path(out_dir)
+    ensure_dir(out_dir)
+    state = CrawlState(out_dir/"crawl_state.json")
+    store = AttachmentStore(out_dir, state.attachments, lock=state.lock)
+
+    s = make_session(pool_size=concurrency + 1)
+    limiter = HostRateLimiter(rps, burst=max(1, int(rps)))
+    slots = threading.BoundedSemaphore(max_inflight or concurrency * 2)
+    lock = threading.Lock()
+    t0 = time.perf_counter()
+    stats = {"ok": 0, "failed": 0}
+
+    def fetch(aurl, prev):
+        try:
+            rec = extract_article(s, aurl, out_dir, limiter=limiter, prev=prev, store=store)
+            report_article(rec)
+            state.record_article(aurl, rec)
+            with lock:
+                stats["ok"] += 1
+        except Exception as e:
+            print(f"  [文章失败] {aurl}: {e}", file=sys.stderr)
+            with lock:
+                stats["failed"] += 1
+        finally:
+            slots.release()
+
+    list_url = start_url
+    pages_done = 0
+    futures, list_recs, submitted = [], [], set()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="crawl") as pool:
+        while list_url and pages_done < max_pages:
             print(f"[栏目] {list_url}")
             try:
-                article_links, next_link = parse_list_page(s, list_url)
+                article_links, next_link, list_rec = parse_list_page(
+                    s, list_url, limiter=limiter, prev=state.lists.get(list_url))
             except Exception as e:
                 print(f"[栏目失败] {list_url}: {e}", file=sys.stderr)
                 break
-
-            got = 0
             for aurl in article_links:
-                if aurl in state["visited_articles"]:
-                    # 也可以做变更检测：拉页面 md5 对比后重跑
+                if aurl in submitted:
+                    continue
+                prev = state.articles.get(aurl)
+                if prev is not None and not revisit:
                     print(f"  [跳过已抓] {aurl}")
                     continue
-                try:
-                    doc_id, title = extract_article(s, aurl, out_dir)
-                    print(f"  [OK] {title} → {doc_id}")
-                    state["visited_articles"].append(aurl)
-                    got += 1
-                    time.sleep(delay)
-                except Exception as e:
-                    print(f"  [文章失败] {aurl}: {e}", file=sys.stderr)
-
-            state["visited_lists"].append(list_url)
-            save_state(state_path, state)
+                submitted.add(aurl)
+                slots.acquire()
+                futures.append(pool.submit(fetch, aurl, prev))
+            list_recs.append((list_url, list_rec))
             list_url = next_link
             pages_done += 1
-            time.sleep(delay)
-            continue
-
-        # 如果这页已抓过，仍尝试找下一页
-        try:
-            _, next_link = parse_list_page(s, list_url)
-        except Exception:
-            next_link = None
-        list_url = next_link
-        pages_done += 1
-        time.sleep(delay)
-
-    print(f"完成：栏目页 {pages_done} 页；文章 {len(state['visited_articles'])} 篇。输出目录：{out_dir}")
+        wait(futures)
+
+    # 栏目页在其文章全部处理完后才记录，中途中断不会漏掉文章
+    for url, rec in list_recs:
+        state.record_list(url, rec)
+    state.save()
+    changes_path = state.write_changes(out_dir)
+    elapsed = time.perf_counter() - t0
+    print(f"完成：栏目页 {pages_done} 页；本次文章 {stats['ok']} 篇（失败 {stats['failed']}，"
+          f"新增/变更 {len(state.changes)}，清单 {changes_path}），"
+          f"耗时 {elapsed:.1f}s，{stats['ok'] / max(elapsed, 1e-9):.2f} 篇/s。输出目录：{out_dir}")
+    return stats
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--start", required=True, help="栏目起始 URL，如 https://www.htu.edu.cn/teaching/3251/list.htm")
     ap.add_argument("--out", default="./dataset", help="输出根目录（包含 raw/ staging/）")
     ap.add_argument("--max-pages", type=int, default=50, help="最多遍历栏目页数")
-    ap.add_argument("--delay", type=float, default=1.0, help="请求间隔秒")
+    ap.add_argument("--delay", type=float, default=1.0, help="请求间隔秒（串行模式）")
+    ap.add_argument("--concurrency", type=int, default=1, help="并发抓取线程数，>1 启用并发模式")
+    ap.add_argument("--rps", type=float, default=None, help="并发模式下每个主机每秒请求数，缺省为 1/delay")
+    ap.add_argument("--max-inflight", type=int, default=None, help="在途文章数上限，缺省为 2×并发数")
+    ap.add_argument("--no-revisit", action="store_true", help="已抓文章直接跳过，不发条件请求复查")
     args = ap.parse_args()
-    # 友情提示：尊重 robots.txt 和网站负载，必要时加大 --delay
-    crawl(args.start, args.out, args.max_pages, args.delay)
+    # 友情提示：尊重 robots.txt 和网站负载，必要时加大 --delay / 降低 --rps
+    if args.concurrency > 1:
+        rps = args.rps or (1.0 / args.delay if args.delay > 0 else 10.0)
+        crawl_concurrent(args.start, args.out, args.max_pages, args.concurrency, rps, args.max_inflight,
+                         revisit=not args.no_revisit)
+    else:
+        crawl(args.start, args.out, args.max_pages, args.delay, revisit=not args.no_revisit)
 
 if __name__ == "__main__":
     main()
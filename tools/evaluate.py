@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+批量评测 / 回放：把问题集分块 POST 到 /ask/batch（--chat 时为 /chat/batch），汇总 hit@k 与 MRR
+问题文件：
+- .jsonl：每行 {"q": "...", "doc_ids": ["..."], "id": "..."}；doc_ids 为 chunk 元数据中的 doc_id（也可写单个 doc_id），
+  缺省时该条只回放不评测；可带 date_from / date_to / dept / doc_type 过滤条件
+- .txt：每行一个问题，只回放
+逐条结果（命中名次、检索到的 doc_id 或回答）写入 --out（jsonl），便于和上一次的夜间结果 diff
+用法：python evaluate.py --url http://127.0.0.1:8000 --queries eval.jsonl [--chat] [--batch-size 100] [--out results.jsonl]
+"""
+import argparse, json, pathlib, sys, time
+import httpx
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from evaluation import DEFAULT_KS, summarize
+
+FILTER_KEYS = ("date_from", "date_to", "dept", "doc_type")
+
+def load_items(path):
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if not path.endswith(".jsonl"):
+                items.append({"q": line, "id": str(n)})
+                continue
+            obj = json.loads(line)
+            q = obj.get("q") or obj.get("query") or obj.get("question")
+            if not q:
+                continue
+            item = {"q": q, "id": str(obj.get("id", n))}
+            labels = obj.get("doc_ids") or ([obj["doc_id"]] if obj.get("doc_id") else None)
+            if labels:
+                item["doc_ids"] = labels
+            item.update({k: obj[k] for k in FILTER_KEYS if obj.get(k)})
+            items.append(item)
+    return items
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--queries", required=True, help=".jsonl（可带 doc_ids 标注）或 .txt")
+    ap.add_argument("--chat", action="store_true", help="走 /chat/batch 生成回答（默认只检索）")
+    ap.add_argument("--batch-size", type=int, default=100, help="每个请求的问题数")
+    ap.add_argument("--ks", type=int, nargs="+", default=list(DEFAULT_KS))
+    ap.add_argument("--timeout", type=float, default=600.0)
+    ap.add_argument("--out", default=None, help="逐条结果 jsonl")
+    args = ap.parse_args()
+
+    items = load_items(args.queries)
+    endpoint = "/chat/batch" if args.chat else "/ask/batch"
+    results, timings = [], {}
+    t0 = time.perf_counter()
+    with httpx.Client(base_url=args.url, timeout=args.timeout) as client:
+        for start in range(0, len(items), args.batch_size):
+            chunk = items[start:start + args.batch_size]
+            r = client.post(endpoint, json={"queries": chunk, "ks": args.ks, "timings": True})
+            if r.status_code != 200:
+                raise SystemExit(f"❌ {endpoint} 返回 {r.status_code}：{r.text[:500]}")
+            body = r.json()
+            results.extend(body["results"])
+            for k, v in (body.get("timings") or {}).items():
+                timings[k] = timings.get(k, 0.0) + v
+            print(f"   {min(start + args.batch_size, len(items))}/{len(items)}", end="\r", flush=True)
+    elapsed = time.perf_counter() - t0
+    print()
+
+    ranks = [r.get("rank") for it, r in zip(items, results) if it.get("doc_ids")]
+    errors = sum(1 for r in results if "error" in r)
+    print(f"{len(items)} 条问题，{endpoint}，耗时 {elapsed:.1f}s（{len(items) / max(elapsed, 1e-9):.1f} 条/s）"
+          + (f"，LLM 失败 {errors} 条" if errors else ""))
+    if timings:
+        print("   服务端分阶段耗时合计：" + "，".join(f"{k} {v:.2f}s" for k, v in timings.items()))
+    if ranks:
+        summary = summarize(ranks, args.ks)
+        print(f"标注 {summary['labeled']} 条：" + "  ".join(f"{k} {v:.4f}" for k, v in summary.items() if k != "labeled"))
+        print(f"   未命中 {sum(1 for r in ranks if r is None)} 条")
+    else:
+        print("问题集中没有 doc_ids 标注，只做了回放")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for it, r in zip(items, results):
+                row = {"id": it["id"], "q": it["q"], "doc_ids": it.get("doc_ids"), "rank": r.get("rank")}
+                if args.chat:
+                    row.update({k: r[k] for k in ("answer", "error", "cached") if k in r})
+                else:
+                    row["retrieved"] = [h["doc_id"] for h in r["hits"]]
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        print(f"逐条结果已写入 {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+把查询编码器与重排模型导出为 ONNX，并做动态 int8 量化，供 Settings.inference_backend = "onnx" 使用
+- embed ：SentenceTransformer 的 Transformer + Pooling（CLS / mean）并入同一计算图，输出未归一化的句向量
+- rerank：与 FlagReranker 一致，输出 logits.view(-1)
+- 动态量化只量化权重（MatMul/Gemm → int8），激活在运行时量化，不需要校准数据
+导出后用 bench_onnx.py 检查排序一致性与延迟
+用法：python export_onnx.py --out ../dataset/onnx [--rerank-model BAAI/bge-reranker-base] [--no-quantize]
+依赖：torch、transformers、onnx、onnxruntime
+"""
+import argparse, json, os, pathlib, sys
+import torch
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from settings import Settings
+from onnx_backend import EMBED_SUBDIR, RERANK_SUBDIR, MODEL_FILE, CONFIG_FILE
+
+class _Embedder(torch.nn.Module):
+    def __init__(self, auto_model, pooling):
+        super().__init__()
+        self.auto_model = auto_model
+        self.pooling = pooling
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        kwargs = {} if token_type_ids is None else {"token_type_ids": token_type_ids}
+        h = self.auto_model(input_ids=input_ids, attention_mask=attention_mask, **kwargs).last_hidden_state
+        if self.pooling == "cls":
+            return h[:, 0]
+        mask = attention_mask.unsqueeze(-1).to(h.dtype)
+        return (h * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+
+class _Scorer(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        kwargs = {} if token_type_ids is None else {"token_type_ids": token_type_ids}
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, **kwargs).logits.view(-1)
+
+def _export(module, tokenizer, sample, out_dir, config, opset, quantize):
+    os.makedirs(out_dir, exist_ok=True)
+    enc = tokenizer(*sample, padding=True, return_tensors="pt")
+    names = [k for k in ("input_ids", "attention_mask", "token_type_ids") if k in enc]
+    fp32_path = os.path.join(out_dir, "model.fp32.onnx")
+    module.eval()
+    with torch.no_grad():
+        torch.onnx.export(module, tuple(enc[k] for k in names), fp32_path,
+                          input_names=names, output_names=["output"],
+                          dynamic_axes={**{k: {0: "batch", 1: "seq"} for k in names}, "output": {0: "batch"}},
+                          opset_version=opset)
+    model_path = os.path.join(out_dir, MODEL_FILE)
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, model_path)
+    tokenizer.save_pretrained(out_dir)
+    config["quantized"] = quantize
+    with open(os.path.join(out_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    print(f"✅ {config['model']} → {model_path}（{os.path.getsize(model_path) / 2**20:.1f} MB）")
+
+def export_embed(model_name, out_dir, opset=17, quantize=True):
+    from sentence_transformers import SentenceTransformer
+    st = SentenceTransformer(model_name, device="cpu")
+    pooling = st[1]
+    if pooling.pooling_mode_cls_token:
+        mode = "cls"
+    elif pooling.pooling_mode_mean_tokens:
+        mode = "mean"
+    else:
+        raise SystemExit(f"❌ 暂不支持 {model_name} 的池化方式（只支持 CLS / mean）")
+    config = {"model": model_name, "kind": "embed", "pooling": mode,
+              "dim": st.get_sentence_embedding_dimension(), "max_length": st.max_seq_length}
+    _export(_Embedder(st[0].auto_model, mode), st.tokenizer, (["期末考试安排", "补考申请需要什么材料"],),
+            out_dir, config, opset, quantize)
+
+def export_rerank(model_name, out_dir, opset=17, quantize=True):
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    config = {"model": model_name, "kind": "rerank", "max_length": 512}
+    _export(_Scorer(model), tokenizer, (["期末考试安排", "补考"], ["关于期末考试的通知", "补考申请表"]),
+            out_dir, config, opset, quantize)
+
+def main():
+    S = Settings()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default="../dataset/onnx")
+    ap.add_argument("--embed-model", default=S.embed_model)
+    ap.add_argument("--rerank-model", default=S.rerank_model, help="缺省取 Settings.rerank_model；为空则不导出")
+    ap.add_argument("--opset", type=int, default=17)
+    ap.add_argument("--no-quantize", action="store_true", help="保留 fp32 模型（用于对比量化带来的误差）")
+    args = ap.parse_args()
+    export_embed(args.embed_model, os.path.join(args.out, EMBED_SUBDIR), args.opset, not args.no_quantize)
+    if args.rerank_model:
+        export_rerank(args.rerank_model, os.path.join(args.out, RERANK_SUBDIR), args.opset, not args.no_quantize)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+本地 OpenAI 兼容的假 LLM 服务，用于压测 use.py 而不调用真实 provider
+- POST /v1/chat/completions，支持 stream=true（SSE，含 stream_options.include_usage）与非流式
+- --ttft：首 token 前的延迟（模拟 prefill）；--tokens-per-sec：之后的吐字速率；--tokens：回答长度
+- usage 按 prompt 字符数粗略估算，便于 /metrics 的 token 计数有值
+用法：python stub_llm.py --port 8901 --ttft 0.3 --tokens-per-sec 50 --tokens 200
+     然后以 LLM_PROVIDER=stub（可选 STUB_LLM_BASE_URL=http://127.0.0.1:8901/v1）启动 use.py
+"""
+import argparse, asyncio, json, time, uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER = "根据学校文件，期末考试安排由教务处统一发布，请以教务系统通知为准。"
+
+def make_app(ttft: float, tokens_per_sec: float, n_tokens: int) -> FastAPI:
+    app = FastAPI(title="stub llm")
+    pieces = [ANSWER[i % len(ANSWER)] for i in range(n_tokens)]
+
+    def usage(messages):
+        prompt = sum(len(m.get("content") or "") for m in messages)
+        return {"prompt_tokens": prompt, "completion_tokens": n_tokens, "total_tokens": prompt + n_tokens}
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        interval = 1.0 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + interval * n_tokens)
+            return JSONResponse({
+                "id": cid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(pieces)}}],
+                "usage": usage(body.get("messages", [])),
+            })
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta, finish=None, **extra):
+            data = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}], **extra}
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def events():
+            await asyncio.sleep(ttft)
+            yield chunk({"role": "assistant", "content": ""})
+            for p in pieces:
+                yield chunk({"content": p})
+                if interval:
+                    await asyncio.sleep(interval)
+            yield chunk({}, "stop")
+            if include_usage:
+                data = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [], "usage": usage(body.get("messages", []))}
+                yield f"data: {json.dumps(data)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model"}]}
+
+    return app
+
+def main():
+    import uvicorn
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8901)
+    ap.add_argument("--ttft", type=float, default=0.3, help="首 token 延迟（秒）")
+    ap.add_argument("--tokens-per-sec", type=float, default=50.0, help="吐字速率；<=0 表示一次吐完")
+    ap.add_argument("--tokens", type=int, default=200, help="每个回答的 token 数")
+    args = ap.parse_args()
+    uvicorn.run(make_app(args.ttft, args.tokens_per_sec, args.tokens), host=args.host, port=args.port,
+                log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,147 @@
 # -*- coding: utf-8 -*-
-from fastapi import FastAPI, Query, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+import time
+_IMPORT_T0 = time.perf_counter()
+from fastapi import FastAPI, Query, Request, HTTPException, Header, Depends
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
 from pathlib import Path
 
 # 设置模板目录
 BASE_DIR = Path(__file__).parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
-import re, json, faiss, numpy as np
-from sentence_transformers import SentenceTransformer
-from FlagEmbedding import FlagReranker
-from typing import List
+import re, os, json, asyncio, numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+from pydantic import BaseModel
 from settings import Settings
-from llm import make_llm
+from llm_router import make_router, ChatRouter
+from index_bundle import IndexBundle, resolve_index_dir
+from batching import MicroBatcher
+from cache import AnswerCache
+from lexical import rrf_fuse
+import metrics
+from metrics import Spans
+from packing import pack_context, naive_tokens
+from filters import Filters, make_filters
+from evaluation import DEFAULT_KS, DEFAULT_QUERIES, ranked_doc_ids, first_hit, summarize
 
 S = Settings()
+metrics.configure(S.metrics_enabled)
 
-# ===== 预加载索引/模型 =====
-embed_model = SentenceTransformer(S.embed_model)
-reranker = FlagReranker(S.rerank_model, use_fp16=False) if S.rerank_model else None
-index = faiss.read_index(f"{S.index_dir}/faiss.index")
-with open(f"{S.index_dir}/meta.jsonl", encoding="utf-8") as f:
-    METAS = [json.loads(l) for l in f]
-
-# ===== LLM：可插拔 =====
-llm = make_llm(
-    provider=S.llm_provider,
-    model=S.llm_model,
-    temperature=S.llm_temperature,
-    max_tokens=S.llm_max_tokens,
+# ===== 索引/模型：启动后在后台并行加载（见 boot），模块导入不碰 torch / faiss =====
+def load_embedder():
+    """按 inference_backend 加载查询编码器；两种后端的 encode 用法一致"""
+    if S.inference_backend == "onnx":
+        from onnx_backend import OnnxEncoder, EMBED_SUBDIR
+        return OnnxEncoder(os.path.join(S.onnx_dir, EMBED_SUBDIR), threads=S.onnx_threads,
+                           expected_model=S.embed_model)
+    if S.inference_backend != "torch":
+        raise ValueError(f"未知的 inference_backend: {S.inference_backend}")
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(S.embed_model)
+
+def load_reranker():
+    """可选的重排模型；两种后端的 compute_score 用法一致"""
+    if not S.rerank_model:
+        return None
+    if S.inference_backend == "onnx":
+        from onnx_backend import OnnxReranker, RERANK_SUBDIR
+        return OnnxReranker(os.path.join(S.onnx_dir, RERANK_SUBDIR), threads=S.onnx_threads,
+                            expected_model=S.rerank_model)
+    from FlagEmbedding import FlagReranker
+    return FlagReranker(S.rerank_model, use_fp16=False)
+
+def load_bundle() -> IndexBundle:
+    return IndexBundle.load(S.index_dir, nprobe=S.index_nprobe, ef_search=S.index_ef_search,
+                            hybrid=S.hybrid_enabled, mmap=S.index_mmap)
+
+embed_model = None
+reranker = None
+# 当前版本的 faiss 索引 / 元数据 / 向量 / BM25；热更新时整体替换这个引用（见 reload_index）
+# 热更新切换版本时回答缓存随之清空（见 reload_index）
+BUNDLE: IndexBundle | None = None
+
+# ===== LLM：可插拔；配置了 llm_fallbacks 时为多 provider 路由（对冲 + 切换 + 熔断） =====
+llm = make_router(
+    S.llm_provider, S.llm_model, S.llm_fallbacks,
+    llm_kwargs=dict(temperature=S.llm_temperature, max_tokens=S.llm_max_tokens),
+    timeout=S.llm_timeout,
+    max_concurrency=S.llm_max_concurrency,
+    hedge_quantile=S.llm_hedge_quantile,
+    hedge_budget=S.llm_hedge_budget,
+    breaker_failures=S.llm_breaker_failures,
+    breaker_cooldown=S.llm_breaker_cooldown,
 )
 
+# ===== 并发控制 =====
+# 编码/FAISS/重排都是同步 CPU 计算，放到有界线程池里，事件循环只负责调度和 LLM 异步 IO
+RETRIEVE_POOL = ThreadPoolExecutor(max_workers=S.retrieve_workers, thread_name_prefix="retrieve")
+# 同时处理的请求数上限；排队超过 queue_timeout 直接 503，避免请求无限堆积
+REQUEST_SLOTS = asyncio.Semaphore(S.max_concurrent_requests)
+
+def require_ready():
+    """模型与索引加载、预热完成前拒绝检索请求（负载均衡应以 /readyz 为准，不会把流量送到这里）"""
+    if not BOOT["ready"]:
+        raise HTTPException(status_code=503, detail="服务启动中，请稍后重试", headers={"Retry-After": "5"})
+
+async def acquire_slot():
+    try:
+        await asyncio.wait_for(REQUEST_SLOTS.acquire(), timeout=S.queue_timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试", headers={"Retry-After": "1"})
+
+def slot_releaser():
+    """
+    返回只生效一次的释放回调：流式响应的生成器 finally 与响应结束后的 BackgroundTask 都会调用它
+    客户端在 Starlette 开始迭代响应体之前就断开时生成器的 finally 不会执行，由 BackgroundTask 兜底
+    """
+    released = False
+    async def release():
+        nonlocal released
+        if not released:
+            released = True
+            REQUEST_SLOTS.release()
+    return release
+
+@asynccontextmanager
+async def request_slot():
+    await acquire_slot()
+    try:
+        yield
+    finally:
+        REQUEST_SLOTS.release()
+
+async def aretrieve(query: str, filters: Optional[Filters] = None):
+    """
+    并发到达的查询经微批合并后，在 RETRIEVE_POOL 中一次完成编码/检索/重排
+    返回 (docs, 问题向量, 所在批次的分阶段耗时)；问题向量供回答缓存做语义查找
+    """
+    return await RETRIEVE_BATCHER.submit((query, filters))
+
+def filter_params(
+    date_from: Optional[str] = Query(None, description="发布日期起，YYYY-MM-DD（可只写到年/月）"),
+    date_to: Optional[str] = Query(None, description="发布日期止，YYYY-MM-DD（可只写到年/月）"),
+    dept: Optional[List[str]] = Query(None, description="发布部门，可重复传多个"),
+    doc_type: Optional[List[str]] = Query(None, description="文档类型，可重复传多个"),
+) -> Optional[Filters]:
+    """元数据过滤参数；在检索内部生效（faiss IDSelector + BM25 屏蔽），不是事后过滤"""
+    try:
+        filters = make_filters(date_from, date_to, dept, doc_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if filters is not None and BUNDLE is not None and BUNDLE.filters is None:
+        raise HTTPException(status_code=400, detail="当前索引不含过滤数据，请用新版 build_index 重建后再使用过滤")
+    return filters
+
+def cache_scope(filters: Optional[Filters]) -> str:
+    return filters.key() if filters is not None else ""
+
+ANSWER_CACHE = AnswerCache(max_entries=S.cache_max_entries, ttl=S.cache_ttl,
+                           threshold=S.cache_similarity) if S.cache_enabled else None
+
 # 创建应用并挂载静态文件
 app = FastAPI(
     title="HTU RAG API (Modular LLM)",
@@ -53,30 +163,89 @@ def highlight(text: str, keywords: List[str]) -> str:
         text = re.sub(re.escape(kw), lambda m: f"**{m.group(0)}**", text, flags=re.I)
     return text
 
-def retrieve(query: str):
-    qv = embed_model.encode([query], normalize_embeddings=True).astype("float32")
-    D, I = index.search(qv, S.topk_faiss)
-    cands = [METAS[i] for i in I[0]]
-    
+def retrieve_batch(items: List) -> List[Tuple[List[dict], np.ndarray, dict]]:
+    """
+    一批查询：一次编码；按过滤条件分组，每组一次 FAISS 检索；一次重排打分
+    items 为问题文本或 (问题, Filters | None)
+    返回与 items 一一对应的 (docs, 问题向量, 分阶段耗时)；耗时按批计，同批查询共享同一个 dict
+    """
+    items = [(it, None) if isinstance(it, str) else it for it in items]
+    queries = [q for q, _ in items]
+    bundle = BUNDLE  # 整批只读一次引用：热更新发生在批处理中途时，这一批仍完整地用旧版本
+    spans = Spans()
+    with spans.span("embed"):
+        qv = embed_model.encode(queries, normalize_embeddings=True,
+                                batch_size=len(queries)).astype("float32")
+    groups = {}
+    for j, (_, f) in enumerate(items):
+        groups.setdefault(f, []).append(j)
+    all_ids = [None] * len(items)
+    fused_scores = [None] * len(items)  # 做了 RRF 融合的查询记下融合分，无重排模型时直接按它排序
+    for f, rows in groups.items():
+        with spans.span("filter"):
+            bitmap = bundle.filter_bitmap(f)
+        with spans.span("faiss"):
+            D, I = bundle.search(qv[rows], S.topk_faiss, bitmap, exact_max=S.filter_exact_max)
+        for j, row in zip(rows, I):
+            all_ids[j] = row[row >= 0]  # 库内（或满足过滤条件的）条数不足 topk 时 faiss 用 -1 填充
+        if bundle.bm25 is not None:
+            # 课程代码、表格名、日期等精确词靠 BM25 补召回；融合后只把前 topk_candidates 条送去重排
+            with spans.span("bm25"):
+                for j in rows:
+                    lexical = bundle.bm25_search(queries[j], S.topk_bm25, bitmap)[0]
+                    all_ids[j], fused_scores[j] = rrf_fuse([all_ids[j], lexical], k=S.rrf_k,
+                                                           limit=S.topk_candidates)
+    with spans.span("meta"):
+        all_cands = [bundle.metas.get_many(ids) for ids in all_ids]
+
     if reranker is not None:
-        # 如果有重排模型，使用重排模型对结果进行重排
-        pairs = [(query, " ".join(c["titles"]) + " " + c["text"]) for c in cands]
-        scores = reranker.compute_score(pairs)
-        top_idx = np.argsort(scores)[::-1][:S.topk_final]
+        # 如果有重排模型，所有查询的候选拼成一批交给重排模型
+        with spans.span("rerank"):
+            pairs = [(q, " ".join(c["titles"]) + " " + c["text"])
+                     for q, cands in zip(queries, all_cands) for c in cands]
+            flat = np.atleast_1d(np.asarray(reranker.compute_score(pairs), dtype="float32")) if pairs else []
+        bounds = np.cumsum([0] + [len(c) for c in all_cands])
+        all_scores = [flat[bounds[j]:bounds[j + 1]] for j in range(len(queries))]
     else:
-        # 否则直接使用嵌入向量的余弦相似度
-        cand_vecs = [embed_model.encode(" ".join(c["titles"]) + " " + c["text"], 
-                     normalize_embeddings=True) for c in cands]
-        sims = np.array(cand_vecs) @ qv.T
-        top_idx = np.argsort(sims.ravel())[::-1][:S.topk_final]
-        
-    return [cands[i] for i in top_idx]
-
-def build_prompt(query: str, docs: List[dict]) -> List[dict]:
-    """返回 OpenAI 格式 messages"""
+        # 否则：融合过的保持 RRF 顺序（按余弦重排会把只被 BM25 召回的结果压到后面）；
+        # 纯向量检索的用库内已存向量的余弦相似度
+        with spans.span("rescore"):
+            all_scores = [fused_scores[j] if fused_scores[j] is not None else bundle.stored_vectors(ids) @ qv[j]
+                          for j, ids in enumerate(all_ids)]
+
+    results = []
+    for j, (cands, scores) in enumerate(zip(all_cands, all_scores)):
+        top_idx = np.argsort(-np.asarray(scores), kind="stable")[:S.topk_final]
+        docs = [dict(cands[i]) for i in top_idx]  # 副本：score 只属于本次请求
+        for d, i in zip(docs, top_idx):
+            d["score"] = float(scores[i])  # 供 build_prompt 按分数填充 token 预算
+        results.append((docs, qv[j], spans.timings))
+    return results
+
+def retrieve(query: str):
+    return retrieve_batch([query])[0][0]
+
+RETRIEVE_BATCHER = MicroBatcher(retrieve_batch, max_batch_size=S.batch_max_size,
+                                max_wait_ms=S.batch_max_wait_ms,
+                                executor=RETRIEVE_POOL, max_inflight=S.retrieve_workers)
+
+def build_prompt(query: str, docs: List[dict], report: dict | None = None) -> List[dict]:
+    """
+    返回 OpenAI 格式 messages
+    context_packing 开启时同一通知的相邻 chunk 去重叠合并，并按分数填充 context_token_budget；
+    传入 report 时写入拼装前后的 token 估算
+    """
+    if S.context_packing:
+        sections, stats = pack_context(docs, S.context_token_budget)
+    else:
+        sections = [{"title": d["titles"][0], "publish_date": d.get("publish_date"), "text": d["text"]} for d in docs]
+        stats = {"tokens_naive": naive_tokens(docs), "tokens_packed": naive_tokens(docs), "tokens_saved": 0}
+    metrics.observe_prompt(stats["tokens_naive"], stats["tokens_packed"])
+    if report is not None:
+        report.update(stats)
     context = ""
-    for i, d in enumerate(docs, 1):
-        context += f"[文档{i}] {d['titles'][0]}（{d.get('publish_date','未知日期')}）\n{d['text']}\n\n"
+    for i, d in enumerate(sections, 1):
+        context += f"[文档{i}] {d['title']}（{d.get('publish_date') or '未知日期'}）\n{d['text']}\n\n"
     user = f"""你是一位熟悉河南师范大学教务与校园事务的助手。使用以上下文来回答用户的问题。如果你不知道答案，就说你“未在学校文件中找到明确规定”。总是使用中文回答。
         问题: {query}
         可参考的上下文：
@@ -91,29 +260,37 @@ def build_prompt(query: str, docs: List[dict]) -> List[dict]:
         {"role": "user", "content": user}
     ]
 
+def request_timings(spans: Spans, batch_timings: dict) -> dict:
+    """单个请求的耗时：检索批次的各阶段 + 本请求的 retrieve（含排队）/ prompt / llm 等，单位秒"""
+    return {**{k: round(v, 4) for k, v in batch_timings.items()}, **spans.rounded()}
+
+def server_timing(timings: dict) -> str:
+    return ", ".join(f"{k};dur={v * 1000:.1f}" for k, v in timings.items())
+
 @app.get("/ask", response_class=JSONResponse)
-async def ask(q: str = Query(..., description="纯检索预览")):  # 添加 async 关键字
-    docs = retrieve(q)
+async def ask(q: str = Query(..., description="纯检索预览"),
+              timings: bool = Query(False, description="在 Server-Timing 响应头里返回分阶段耗时"),
+              filters: Optional[Filters] = Depends(filter_params)):
+    require_ready()
+    t0 = time.perf_counter()
+    spans = Spans()
+    async with request_slot():
+        with spans.span("retrieve"):
+            docs, _, batch_timings = await aretrieve(q, filters)
     kws = re.split(r"[，。；,.!?、\s]", q)
-    return [{
+    body = [{
         "title": d["titles"][0],
         "publish_date": d.get("publish_date"),
         "snippet": highlight(d["text"], kws)[:200],
         "source_url": d.get("source_url")
     } for d in docs]
+    metrics.observe_request("ask", time.perf_counter() - t0)
+    if timings:
+        return JSONResponse(body, headers={"Server-Timing": server_timing(request_timings(spans, batch_timings))})
+    return body
 
-@app.get("/chat", response_class=JSONResponse)
-async def chat(q: str = Query(..., description="RAG 生成回答")):  # 添加 async 关键字
-    docs = retrieve(q)
-    if not docs:
-        return {"answer": "未找到相关内容。"}
-    messages = build_prompt(q, docs)
-    try:
-        answer = llm.chat(messages)
-    except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
-
-    # 使用字典去重，以 source_url 或 titles[0] 作为唯一标识
+def make_references(docs: List[dict]) -> List[dict]:
+    """使用字典去重，以 source_url 或 titles[0] 作为唯一标识"""
     unique_refs = {}
     for d in docs:
         key = d.get("source_url") or d["titles"][0]  # 使用 URL 或标题作为唯一标识
@@ -122,12 +299,416 @@ async def chat(q: str = Query(..., description="RAG 生成回答")):  # 添加 a
                 "title": d["titles"][0],
                 "source_url": d.get("source_url")
             }
-    
-    return {
+    return list(unique_refs.values())
+
+def cache_get_exact(q: str, version: str, scope: str = ""):
+    return ANSWER_CACHE.get_exact(q, version, scope) if ANSWER_CACHE is not None else None
+
+def cache_get_similar(qv: np.ndarray, version: str, scope: str = ""):
+    return ANSWER_CACHE.get_similar(qv, version, scope) if ANSWER_CACHE is not None else None
+
+def cache_put(q: str, qv: np.ndarray, answer: str, references: List[dict], llm_seconds: float, version: str,
+              scope: str = ""):
+    # 生成期间索引已切换时不写缓存，免得旧版本的回答混进新版本
+    if ANSWER_CACHE is not None and version == BUNDLE.version:
+        ANSWER_CACHE.put(q, qv, {"answer": answer, "references": references},
+                         llm_seconds, version, scope)
+
+@app.get("/chat", response_class=JSONResponse)
+async def chat(q: str = Query(..., description="RAG 生成回答"),
+               timings: bool = Query(False, description="在响应中附带分阶段耗时"),
+               filters: Optional[Filters] = Depends(filter_params)):
+    require_ready()
+    t_start = time.perf_counter()
+    # 精确命中不占并发名额，也不做检索；过滤条件不同的同一问题分开缓存
+    version, scope = BUNDLE.version, cache_scope(filters)
+    hit = cache_get_exact(q, version, scope)
+    if hit is not None:
+        metrics.observe_request("chat_cached", time.perf_counter() - t_start)
+        return {"query": q, **hit, "cached": "exact"}
+
+    spans = Spans()
+    async with request_slot():
+        with spans.span("retrieve"):
+            docs, qv, batch_timings = await aretrieve(q, filters)
+        if not docs:
+            return {"answer": "未找到相关内容。"}
+        hit = cache_get_similar(qv, version, scope)
+        if hit is not None:
+            metrics.observe_request("chat_cached", time.perf_counter() - t_start)
+            return {"query": q, **hit, "cached": "semantic"}
+        context_report = {}
+        with spans.span("prompt"):
+            messages = build_prompt(q, docs, context_report)
+        try:
+            t0 = time.perf_counter()
+            answer = await llm.achat(messages)
+            llm_seconds = time.perf_counter() - t0
+            spans.record("llm", llm_seconds)
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+    references = make_references(docs)
+    cache_put(q, qv, answer, references, llm_seconds, version, scope)
+    metrics.observe_request("chat", time.perf_counter() - t_start)
+    body = {
         "query": q, 
         "answer": answer, 
-        "references": list(unique_refs.values())  # 转换为列表返回
+        "references": references
+    }
+    if timings:
+        body["timings"] = request_timings(spans, batch_timings)
+        body["context"] = context_report
+    return body
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def cached_events(hit: dict):
+    yield sse("references", hit["references"])
+    yield sse("token", {"text": hit["answer"]})
+    yield sse("done", {})
+
+@app.get("/chat/stream")
+async def chat_stream(q: str = Query(..., description="RAG 生成回答（SSE 流式）"),
+                      timings: bool = Query(False, description="在 done 事件中附带分阶段耗时"),
+                      filters: Optional[Filters] = Depends(filter_params)):
+    """
+    Server-Sent Events：先发 references，再逐段发 token，最后 done
+    - event: references  data: [{"title", "source_url"}, ...]
+    - event: token       data: {"text": "..."}
+    - event: llm_error   data: {"error": "..."}（不用 error，避免与 EventSource 自带的连接错误事件混淆）
+    - event: done        data: {}（timings=true 时为 {"timings": {...}}）
+    缓存命中时整段回答作为一个 token 事件发出
+    """
+    require_ready()
+    t_start = time.perf_counter()
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    version, scope = BUNDLE.version, cache_scope(filters)
+    hit = cache_get_exact(q, version, scope)
+    if hit is not None:
+        return StreamingResponse(cached_events(hit), media_type="text/event-stream", headers=headers)
+
+    # 名额在流结束（或客户端断开）时才释放
+    await acquire_slot()
+    release = slot_releaser()
+    spans = Spans()
+    try:
+        with spans.span("retrieve"):
+            docs, qv, batch_timings = await aretrieve(q, filters)
+    except BaseException:
+        await release()
+        raise
+    hit = cache_get_similar(qv, version, scope) if docs else None
+    if hit is not None:
+        await release()
+        return StreamingResponse(cached_events(hit), media_type="text/event-stream", headers=headers)
+
+    async def events():
+        try:
+            if not docs:
+                yield sse("references", [])
+                yield sse("token", {"text": "未找到相关内容。"})
+                yield sse("done", {})
+                return
+            references = make_references(docs)
+            yield sse("references", references)
+            pieces = []
+            try:
+                context_report = {}
+                with spans.span("prompt"):
+                    messages = build_prompt(q, docs, context_report)
+                t0 = time.perf_counter()
+                async for piece in llm.astream(messages):
+                    if not pieces:
+                        spans.record("llm_first_token", time.perf_counter() - t0)
+                    pieces.append(piece)
+                    yield sse("token", {"text": piece})
+                spans.record("llm", time.perf_counter() - t0)
+                cache_put(q, qv, "".join(pieces), references, time.perf_counter() - t0, version, scope)
+            except Exception as e:
+                yield sse("llm_error", {"error": str(e)})
+            metrics.observe_request("chat_stream", time.perf_counter() - t_start)
+            yield sse("done", {"timings": request_timings(spans, batch_timings), "context": context_report}
+                      if timings else {})
+        finally:
+            await release()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers,
+                             background=BackgroundTask(release))
+
+# ===== 批量接口：QA 回放与夜间回归一次提交多条问题 =====
+class BatchQuery(BaseModel):
+    q: str
+    id: Optional[str] = None
+    doc_ids: Optional[List[str]] = None  # 标注的相关通知（chunk 元数据中的 doc_id），给定时参与 hit@k / MRR
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    dept: Optional[List[str]] = None
+    doc_type: Optional[List[str]] = None
+
+class BatchRequest(BaseModel):
+    queries: List[BatchQuery]
+    ks: List[int] = list(DEFAULT_KS)  # 评测的 hit@k
+    timings: bool = False
+
+def batch_items(req: BatchRequest) -> List[Tuple[str, Optional[Filters]]]:
+    if not req.queries:
+        raise HTTPException(status_code=400, detail="queries 不能为空")
+    if len(req.queries) > S.batch_api_max_queries:
+        raise HTTPException(status_code=413, detail=f"单次最多 {S.batch_api_max_queries} 条问题")
+    items = []
+    for i, bq in enumerate(req.queries):
+        try:
+            filters = make_filters(bq.date_from, bq.date_to, bq.dept, bq.doc_type)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"queries[{i}]: {e}")
+        if filters is not None and BUNDLE.filters is None:
+            raise HTTPException(status_code=400, detail="当前索引不含过滤数据，请用新版 build_index 重建后再使用过滤")
+        items.append((bq.q, filters))
+    return items
+
+async def retrieve_many(items: List[Tuple[str, Optional[Filters]]]):
+    """
+    绕过微批：按 batch_api_chunk 切块，每块在 RETRIEVE_POOL 里直接跑一次 retrieve_batch
+    （一次编码、按过滤条件分组检索、整块候选一起重排）；块之间串行，不挤占在线请求的检索线程
+    返回 (与 items 对应的结果, 各块分阶段耗时之和)
+    """
+    loop = asyncio.get_running_loop()
+    results, totals = [], {}
+    for start in range(0, len(items), S.batch_api_chunk):
+        chunk = await loop.run_in_executor(RETRIEVE_POOL, retrieve_batch, items[start:start + S.batch_api_chunk])
+        for k, v in chunk[0][2].items():
+            totals[k] = totals.get(k, 0.0) + v
+        results.extend(chunk)
+    return results, totals
+
+def batch_eval(req: BatchRequest, results) -> Tuple[List[Optional[int]], Optional[dict]]:
+    """逐条命中名次（未标注为 None）与标注问题的 hit@k / MRR 汇总"""
+    ranks, labeled = [], []
+    for bq, (docs, _, _) in zip(req.queries, results):
+        rank = first_hit(ranked_doc_ids(docs), bq.doc_ids) if bq.doc_ids else None
+        ranks.append(rank)
+        if bq.doc_ids:
+            labeled.append(rank)
+    return ranks, summarize(labeled, req.ks) if labeled else None
+
+def batch_hit(d: dict) -> dict:
+    return {
+        "doc_id": d.get("doc_id"),
+        "chunk_id": d["id"],
+        "title": d["titles"][0],
+        "publish_date": d.get("publish_date"),
+        "score": round(d.get("score", 0.0), 4),
+        "snippet": d["text"][:200],
+        "source_url": d.get("source_url"),
+    }
+
+@app.post("/ask/batch", response_class=JSONResponse)
+async def ask_batch(req: BatchRequest):
+    """多条问题的纯检索；给了 doc_ids 的问题同时计算 hit@k / MRR（见 evaluation.py）"""
+    require_ready()
+    t0 = time.perf_counter()
+    items = batch_items(req)
+    spans = Spans()
+    async with request_slot():
+        with spans.span("retrieve"):
+            results, batch_timings = await retrieve_many(items)
+    ranks, summary = batch_eval(req, results)
+    body = {
+        "results": [{"id": bq.id, "query": bq.q, "hits": [batch_hit(d) for d in docs],
+                     **({"rank": rank} if bq.doc_ids else {})}
+                    for bq, (docs, _, _), rank in zip(req.queries, results, ranks)],
+        "eval": summary,
     }
+    metrics.observe_request("ask_batch", time.perf_counter() - t0)
+    if req.timings:
+        body["timings"] = request_timings(spans, batch_timings)
+    return body
+
+@app.post("/chat/batch", response_class=JSONResponse)
+async def chat_batch(req: BatchRequest):
+    """
+    多条问题生成回答：整批检索后并发调用 LLM（同时在途不超过 batch_llm_concurrency）
+    单条 LLM 失败只在该条返回 error，不影响其余；命中回答缓存的直接返回缓存结果
+    """
+    require_ready()
+    t0 = time.perf_counter()
+    items = batch_items(req)
+    version = BUNDLE.version
+    spans = Spans()
+    llm_slots = asyncio.Semaphore(S.batch_llm_concurrency)
+
+    async def answer(bq: BatchQuery, item, result) -> dict:
+        q, filters = item
+        docs, qv, _ = result
+        scope = cache_scope(filters)
+        out = {"id": bq.id, "query": q}
+        hit = cache_get_exact(q, version, scope)
+        if hit is not None:
+            return {**out, **hit, "cached": "exact"}
+        hit = cache_get_similar(qv, version, scope) if docs else None
+        if hit is not None:
+            return {**out, **hit, "cached": "semantic"}
+        if not docs:
+            return {**out, "answer": "未找到相关内容。", "references": []}
+        references = make_references(docs)
+        messages = build_prompt(q, docs)
+        async with llm_slots:
+            t_llm = time.perf_counter()
+            try:
+                text = await llm.achat(messages)
+            except Exception as e:
+                return {**out, "error": str(e), "references": references}
+            llm_seconds = time.perf_counter() - t_llm
+        spans.record("llm", llm_seconds)
+        cache_put(q, qv, text, references, llm_seconds, version, scope)
+        return {**out, "answer": text, "references": references}
+
+    async with request_slot():
+        with spans.span("retrieve"):
+            results, batch_timings = await retrieve_many(items)
+        with spans.span("generate"):
+            answers = await asyncio.gather(*(answer(bq, it, r) for bq, it, r in zip(req.queries, items, results)))
+    ranks, summary = batch_eval(req, results)
+    for bq, a, rank in zip(req.queries, answers, ranks):
+        if bq.doc_ids:
+            a["rank"] = rank
+    body = {"results": answers, "eval": summary}
+    metrics.observe_request("chat_batch", time.perf_counter() - t0)
+    if req.timings:
+        body["timings"] = request_timings(spans, batch_timings)
+    return body
+
+@app.get("/stats", response_class=JSONResponse)
+async def stats():
+    """微批统计（批大小分布、排队等待时间）、回答缓存统计（命中率、节省的 LLM 耗时）与本 worker 的内存（rss / pss）"""
+    return {
+        "index_version": BUNDLE.version if BUNDLE is not None else None,
+        "boot": BOOT,
+        "index_mmapped": BUNDLE.mmapped if BUNDLE is not None else None,
+        "memory": metrics.process_memory(),
+        "retrieve_batcher": RETRIEVE_BATCHER.stats(),
+        "answer_cache": ANSWER_CACHE.stats() if ANSWER_CACHE is not None else None,
+        "llm_router": llm.stats() if isinstance(llm, ChatRouter) else None,
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus 文本格式：rag_stage_seconds / rag_request_seconds / rag_llm_* 直方图与计数器"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ===== 索引热更新 =====
+# build_index 写完新版本并切换 CURRENT 后，调用 /admin/reload 或打开 index_watch_seconds 轮询即可上线，
+# 嵌入/重排模型与 LLM 客户端都不重新加载；多 worker 部署时每个进程各自轮询
+RELOAD_LOCK = asyncio.Lock()
+
+async def reload_index(force: bool = False) -> bool:
+    """在后台线程加载 CURRENT 指向的版本，加载完成后整体替换 BUNDLE；版本未变时直接返回 False"""
+    global BUNDLE
+    async with RELOAD_LOCK:
+        version, _ = await asyncio.to_thread(resolve_index_dir, S.index_dir)
+        if version == BUNDLE.version and not force:
+            return False
+        bundle = await asyncio.to_thread(load_bundle)
+        # 单次引用赋值：新查询立刻用新版本，已取到旧引用的批次照常跑完，旧对象随引用释放
+        BUNDLE = bundle
+        if ANSWER_CACHE is not None:
+            ANSWER_CACHE.set_version(bundle.version)
+        return True
+
+@app.post("/admin/reload", response_class=JSONResponse)
+async def admin_reload(force: bool = Query(False, description="版本号未变也重新加载"),
+                       x_admin_token: str | None = Header(None)):
+    if S.admin_token and x_admin_token != S.admin_token:
+        raise HTTPException(status_code=403, detail="无权限")
+    require_ready()
+    previous = BUNDLE.version
+    try:
+        t0 = time.perf_counter()
+        reloaded = await reload_index(force)
+    except Exception as e:
+        return JSONResponse({"error": str(e), "version": previous}, status_code=500)
+    return {
+        "reloaded": reloaded,
+        "previous": previous,
+        "version": BUNDLE.version,
+        "chunks": len(BUNDLE),
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+async def watch_index():
+    while True:
+        await asyncio.sleep(S.index_watch_seconds)
+        try:
+            if await reload_index():
+                print(f"[index] 已切换到版本 {BUNDLE.version}")
+        except Exception as e:  # 新版本损坏时继续用旧版本，下个周期再试
+            print(f"[index] 加载新版本失败：{e}")
+
+# ===== 启动：并行加载 + 预热 + 就绪探针 =====
+# 进程一起来就能响应 /healthz；模型与索引在后台线程并行加载，预热完成后 /readyz 才返回 200
+BOOT = {"ready": False, "error": None, "timings": {"import": round(time.perf_counter() - _IMPORT_T0, 3)}}
+
+def _timed(name, fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    BOOT["timings"][name] = round(time.perf_counter() - t0, 3)
+    return result
+
+def warmup(n: int):
+    """用合成问题跑几次完整检索：单条 + 一整批，触发 JIT、线程池和内存分配器的首次开销"""
+    queries = [DEFAULT_QUERIES[i % len(DEFAULT_QUERIES)] for i in range(n)]
+    for q in queries[:2]:
+        retrieve_batch([q])
+    retrieve_batch(queries[:S.batch_max_size])
+
+def boot():
+    """在线程中执行：编码器、重排模型、索引三者并行加载，随后预热"""
+    global embed_model, reranker, BUNDLE
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="boot") as pool:
+        f_embed = pool.submit(_timed, "embed_model", load_embedder)
+        f_rerank = pool.submit(_timed, "reranker", load_reranker)
+        f_index = pool.submit(_timed, "index", load_bundle)
+        embed_model, reranker, BUNDLE = f_embed.result(), f_rerank.result(), f_index.result()
+    if ANSWER_CACHE is not None:
+        ANSWER_CACHE.set_version(BUNDLE.version)
+    BOOT["timings"]["load"] = round(time.perf_counter() - t0, 3)
+    if S.warmup_queries > 0:
+        _timed("warmup", warmup, S.warmup_queries)
+    BOOT["timings"]["boot"] = round(time.perf_counter() - t0, 3)
+
+async def run_boot():
+    try:
+        await asyncio.to_thread(boot)
+    except Exception as e:
+        BOOT["error"] = repr(e)
+        print(f"[boot] 启动失败：{e!r}")
+        return
+    BOOT["ready"] = True
+    print(f"[boot] 就绪，耗时（秒）：{BOOT['timings']}")
+    if S.index_watch_seconds > 0:
+        app.state.index_watcher = asyncio.create_task(watch_index())
+
+@app.on_event("startup")
+async def start_boot():
+    print(f"[boot] 模块导入耗时 {BOOT['timings']['import']}s，开始加载模型与索引")
+    app.state.boot = asyncio.create_task(run_boot())
+
+@app.get("/healthz", response_class=JSONResponse)
+async def healthz():
+    """存活探针：进程能响应即 200；启动失败时 503，便于编排系统重启该 worker"""
+    if BOOT["error"]:
+        return JSONResponse({"status": "failed", "error": BOOT["error"]}, status_code=503)
+    return {"status": "ok"}
+
+@app.get("/readyz", response_class=JSONResponse)
+async def readyz():
+    """就绪探针：模型、索引加载完成且预热结束后才 200"""
+    body = {"ready": BOOT["ready"], "timings": BOOT["timings"],
+            "index_version": BUNDLE.version if BUNDLE is not None else None}
+    return body if BOOT["ready"] else JSONResponse(body, status_code=503)
 
 # 启动：
 # uvicorn use:app --reload --port 8000